@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class AppControllerConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'app_controller'
+
+    def ready(self):
+        # Registra os receivers que invalidam o cache das opções de filtro e o
+        # que cria f_unaccent nas conexões SQLite (busca.py, importado por filtros)
+        from . import filtros  # noqa: F401
@@ -0,0 +1,120 @@
+"""
+Busca textual de vales (número do vale, nome do cliente e do motorista).
+
+Cada ramo da busca é resolvido na sua própria tabela (``cliente_id IN
+(...)``, ``motorista_id IN (...)``) em vez de um OR sobre os JOINs, para
+que o banco possa usar um índice em cada ramo. Os nomes são comparados sem
+acentos e sem diferenciar maiúsculas: ``LOWER(f_unaccent(nome))`` contra o
+termo normalizado em Python (``normalizar_busca``).
+
+No PostgreSQL, ``f_unaccent`` é o wrapper IMMUTABLE do ``unaccent`` criado
+pela migração 0024, junto com índices GIN ``gin_trgm_ops`` (pg_trgm) sobre
+essa expressão; a 0012 indexa ``numero_vale``. Assim o ``LIKE '%termo%'``
+é indexado e os resultados são ordenados por similaridade de trigramas. No
+SQLite (testes) ``f_unaccent`` é registrada em Python a cada conexão, a
+busca usa o mesmo filtro (``icontains`` no número) e uma relevância simples
+(igual > prefixo > contém).
+"""
+import unicodedata
+
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.db.models import Case, CharField, Func, IntegerField, Q, Value, When
+from django.db.models.functions import Greatest, Lower
+from django.dispatch import receiver
+
+from .models import Cliente, Motorista
+
+
+def remover_acentos(texto):
+    if texto is None:
+        return None
+    return ''.join(c for c in unicodedata.normalize('NFKD', texto) if not unicodedata.combining(c))
+
+
+def normalizar_busca(texto):
+    """Termo como é comparado com ``nome_sem_acento``: sem acentos e minúsculo"""
+    return remover_acentos(texto).lower()
+
+
+class SemAcento(Func):
+    function = 'f_unaccent'
+    output_field = CharField()
+
+
+def nome_sem_acento(campo):
+    """Expressão indexada pela migração 0024 (``LOWER(f_unaccent(campo))``)"""
+    return Lower(SemAcento(campo))
+
+
+@receiver(connection_created)
+def registrar_sem_acento(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite':
+        connection.connection.create_function('f_unaccent', 1, remover_acentos, deterministic=True)
+
+
+class BuscaVales:
+    """Busca portátil, usada como fallback fora do PostgreSQL."""
+
+    def filtrar(self, vales, termo):
+        normalizado = normalizar_busca(termo)
+        clientes = Cliente.objects.annotate(
+            nome_busca=nome_sem_acento('nome')
+        ).filter(nome_busca__contains=normalizado).values('id')
+        motoristas = Motorista.objects.annotate(
+            nome_busca=nome_sem_acento('nome')
+        ).filter(nome_busca__contains=normalizado).values('id')
+        return vales.filter(
+            Q(numero_vale__icontains=termo) |
+            Q(cliente_id__in=clientes) |
+            Q(motorista_id__in=motoristas)
+        )
+
+    def anotar_relevancia(self, vales, termo):
+        normalizado = normalizar_busca(termo)
+        return vales.alias(
+            cliente_busca=nome_sem_acento('cliente__nome'),
+            motorista_busca=nome_sem_acento('motorista__nome'),
+        ).annotate(
+            relevancia=Case(
+                When(numero_vale__iexact=termo, then=Value(3)),
+                When(numero_vale__istartswith=termo, then=Value(2)),
+                When(cliente_busca__startswith=normalizado, then=Value(2)),
+                When(motorista_busca__startswith=normalizado, then=Value(2)),
+                default=Value(1),
+                output_field=IntegerField(),
+            )
+        )
+
+    def buscar(self, vales, termo, ordenar_por_relevancia=True):
+        """Filtra ``vales`` pelo termo e, opcionalmente, ordena por relevância"""
+        termo = termo.strip()
+        if not termo:
+            return vales
+        vales = self.filtrar(vales, termo)
+        if ordenar_por_relevancia:
+            vales = self.anotar_relevancia(vales, termo).order_by('-relevancia', '-data_emissao', '-id')
+        return vales
+
+
+class BuscaValesPostgres(BuscaVales):
+    """Busca com ranking por similaridade de trigramas (pg_trgm)."""
+
+    def anotar_relevancia(self, vales, termo):
+        from django.contrib.postgres.search import TrigramSimilarity
+
+        normalizado = normalizar_busca(termo)
+        return vales.annotate(
+            relevancia=Greatest(
+                TrigramSimilarity('numero_vale', termo),
+                TrigramSimilarity(nome_sem_acento('cliente__nome'), normalizado),
+                TrigramSimilarity(nome_sem_acento('motorista__nome'), normalizado),
+            )
+        )
+
+
+def busca_vales():
+    """Backend de busca adequado ao banco configurado"""
+    if connection.vendor == 'postgresql':
+        return BuscaValesPostgres()
+    return BuscaVales()
@@ -0,0 +1,623 @@
+"""
+Consultas a serviços externos (CNPJ na receitaws, CEP no ViaCEP).
+
+A receitaws limita bastante o número de requisições, então cada CNPJ é
+consultado no máximo uma vez por período:
+
+* as respostas ficam gravadas em ``ConsultaExterna`` (positivas por
+  ``TTL_CNPJ``, negativas por ``TTL_CNPJ_NAO_ENCONTRADO``) e, na frente do
+  banco, no cache do Django por ``TTL_CACHE_LOCAL`` segundos;
+* consultas simultâneas ao mesmo CNPJ no mesmo processo esperam a primeira
+  em vez de repetir a chamada;
+* as chamadas passam por um ``Disjuntor``: depois de ``limite_falhas``
+  falhas seguidas (ou de um 429) o serviço não é chamado até o fim da
+  pausa, e a consulta devolve o último resultado gravado, mesmo vencido,
+  ou ``ServicoIndisponivel``.
+
+O backend é escolhido por ``CONSULTA_CNPJ_BACKEND``: ``'receitaws'`` ou
+``'local'`` (dados fictícios, sem rede, para testes e desenvolvimento).
+
+CEPs são procurados primeiro num LRU em memória e depois na tabela local
+``Cep`` (carregada com ``manage.py carregar_ceps``). O ViaCEP só é chamado
+quando o CEP não está na tabela; o endereço encontrado é gravado nela e um
+CEP inexistente fica registrado em ``ConsultaExterna`` por
+``TTL_CEP_NAO_ENCONTRADO``.
+
+Cada consulta tem uma versão assíncrona (``aconsultar_cnpj``,
+``aconsultar_cep``) para as views async: a chamada externa usa o
+``httpx.AsyncClient`` do event loop, aberto e fechado pelo lifespan do
+ASGI, e não ocupa uma thread enquanto espera a resposta. Consultas iguais
+simultâneas no mesmo loop esperam a mesma tarefa asyncio. Interpretação
+das respostas, cache e disjuntores são os mesmos das versões síncronas.
+"""
+import asyncio
+import datetime
+import logging
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from validate_docbr import CNPJ
+
+from .models import Cep, ConsultaExterna
+
+
+logger = logging.getLogger(__name__)
+
+TTL_CNPJ = datetime.timedelta(days=30)
+TTL_CNPJ_NAO_ENCONTRADO = datetime.timedelta(days=1)
+TTL_CACHE_LOCAL = 300
+TIMEOUT_CONSULTA = (3, 10)
+TIMEOUT_CEP = (3, 5)
+TTL_CEP_NAO_ENCONTRADO = datetime.timedelta(days=1)
+TAMANHO_LRU_CEP = 10000
+ESPERA_MAXIMA_CONSULTA = 15
+
+
+class ServicoIndisponivel(Exception):
+    """O serviço externo falhou ou está com o circuito aberto"""
+
+
+class LimiteExcedido(ServicoIndisponivel):
+    """O serviço recusou a chamada por excesso de requisições (HTTP 429)"""
+
+    def __init__(self, mensagem, espera=None):
+        super().__init__(mensagem)
+        self.espera = espera
+
+
+# ==============================================
+# HTTP
+# ==============================================
+_sessao = None
+_sessao_lock = threading.Lock()
+
+
+def sessao_http():
+    """``requests.Session`` compartilhada, com pool de conexões keep-alive"""
+    global _sessao
+    if _sessao is None:
+        with _sessao_lock:
+            if _sessao is None:
+                sessao = requests.Session()
+                adaptador = HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=0)
+                sessao.mount('https://', adaptador)
+                sessao.mount('http://', adaptador)
+                sessao.headers['User-Agent'] = 'pallet-controller'
+                _sessao = sessao
+    return _sessao
+
+
+_clientes_async = weakref.WeakKeyDictionary()
+
+
+def _novo_cliente_http_async():
+    return httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        headers={'User-Agent': 'pallet-controller'},
+    )
+
+
+async def abrir_cliente_http_async():
+    """
+    Cria o ``httpx.AsyncClient`` compartilhado do event loop corrente.
+    Chamada no startup do lifespan ASGI (``pallet_controller/asgi.py``).
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in _clientes_async:
+        _clientes_async[loop] = _novo_cliente_http_async()
+
+
+async def fechar_cliente_http_async():
+    """Fecha o cliente do event loop corrente (shutdown do lifespan ASGI)"""
+    cliente = _clientes_async.pop(asyncio.get_running_loop(), None)
+    if cliente is not None:
+        await cliente.aclose()
+
+
+@asynccontextmanager
+async def cliente_http_async():
+    """
+    ``httpx.AsyncClient`` do event loop corrente. No ASGI há um loop só,
+    aberto e fechado pelo lifespan, então todas as views async dividem o
+    mesmo pool de conexões. Sem lifespan (``runserver``, WSGI, testes) o
+    Django roda cada view async num loop próprio e o cliente vale só para
+    a chamada, fechado no final.
+    """
+    cliente = _clientes_async.get(asyncio.get_running_loop())
+    if cliente is not None:
+        yield cliente
+        return
+    async with _novo_cliente_http_async() as cliente:
+        yield cliente
+
+
+class Disjuntor:
+    """
+    Circuit breaker simples, por processo. Fechado: as chamadas passam.
+    Aberto: falham na hora com ``ServicoIndisponivel``. Ao fim da pausa uma
+    única chamada de teste passa; se ela falhar o circuito abre de novo.
+    """
+
+    def __init__(self, nome, limite_falhas=5, pausa=60):
+        self.nome = nome
+        self.limite_falhas = limite_falhas
+        self.pausa = pausa
+        self._lock = threading.Lock()
+        self._falhas = 0
+        self._aberto_ate = 0.0
+        self._testando = False
+
+    @property
+    def aberto(self):
+        return self._aberto_ate > time.monotonic()
+
+    def _liberar(self):
+        with self._lock:
+            if self._aberto_ate > time.monotonic():
+                raise ServicoIndisponivel(f'{self.nome}: circuito aberto')
+            if self._falhas >= self.limite_falhas:
+                if self._testando:
+                    raise ServicoIndisponivel(f'{self.nome}: circuito em teste')
+                self._testando = True
+
+    def chamar(self, funcao, *args, **kwargs):
+        self._liberar()
+        try:
+            resultado = funcao(*args, **kwargs)
+        except LimiteExcedido as e:
+            self._registrar_falha(abrir_por=e.espera or self.pausa)
+            raise
+        except ServicoIndisponivel:
+            self._registrar_falha()
+            raise
+        self._registrar_sucesso()
+        return resultado
+
+    async def achamar(self, funcao, *args, **kwargs):
+        """Como ``chamar``, para uma corrotina"""
+        self._liberar()
+        try:
+            resultado = await funcao(*args, **kwargs)
+        except LimiteExcedido as e:
+            self._registrar_falha(abrir_por=e.espera or self.pausa)
+            raise
+        except ServicoIndisponivel:
+            self._registrar_falha()
+            raise
+        except asyncio.CancelledError:
+            # Cliente desconectou: libera a chamada de teste sem contar falha
+            with self._lock:
+                self._testando = False
+            raise
+        self._registrar_sucesso()
+        return resultado
+
+    def _registrar_falha(self, abrir_por=None):
+        with self._lock:
+            self._falhas += 1
+            self._testando = False
+            if abrir_por is not None or self._falhas >= self.limite_falhas:
+                self._falhas = max(self._falhas, self.limite_falhas)
+                self._aberto_ate = time.monotonic() + (abrir_por or self.pausa)
+                logger.error(f"Circuito {self.nome} aberto por {abrir_por or self.pausa}s")
+
+    def _registrar_sucesso(self):
+        with self._lock:
+            self._falhas = 0
+            self._testando = False
+            self._aberto_ate = 0.0
+
+    def reiniciar(self):
+        self._registrar_sucesso()
+
+
+class _Andamento:
+    def __init__(self):
+        self.evento = threading.Event()
+        self.resultado = None
+        self.erro = None
+
+
+class ConsultasEmAndamento:
+    """Junta chamadas simultâneas com a mesma chave numa só (por processo)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._andamentos = {}
+
+    def executar(self, chave, funcao):
+        with self._lock:
+            andamento = self._andamentos.get(chave)
+            primeiro = andamento is None
+            if primeiro:
+                andamento = self._andamentos[chave] = _Andamento()
+
+        if not primeiro:
+            if not andamento.evento.wait(ESPERA_MAXIMA_CONSULTA):
+                raise ServicoIndisponivel(f'Tempo esgotado aguardando a consulta {chave}')
+            if andamento.erro is not None:
+                raise andamento.erro
+            return andamento.resultado
+
+        try:
+            andamento.resultado = funcao()
+            return andamento.resultado
+        except Exception as e:
+            andamento.erro = e
+            raise
+        finally:
+            with self._lock:
+                del self._andamentos[chave]
+            andamento.evento.set()
+
+
+class ConsultasEmAndamentoAsync:
+    """Versão async de ``ConsultasEmAndamento``, por event loop"""
+
+    def __init__(self):
+        self._tarefas = {}
+
+    async def executar(self, chave, funcao):
+        loop = asyncio.get_running_loop()
+        tarefa = self._tarefas.get((loop, chave))
+        if tarefa is None:
+            tarefa = self._tarefas[(loop, chave)] = loop.create_task(funcao())
+            tarefa.add_done_callback(lambda _: self._tarefas.pop((loop, chave), None))
+        # shield: um cliente que desconecta não cancela a consulta dos outros
+        return await asyncio.shield(tarefa)
+
+
+class CacheLRU:
+    """Dicionário limitado a ``tamanho`` itens; descarta o menos usado"""
+
+    def __init__(self, tamanho):
+        self.tamanho = tamanho
+        self._lock = threading.Lock()
+        self._itens = OrderedDict()
+
+    def get(self, chave):
+        with self._lock:
+            valor = self._itens.get(chave)
+            if valor is not None:
+                self._itens.move_to_end(chave)
+            return valor
+
+    def set(self, chave, valor):
+        with self._lock:
+            self._itens[chave] = valor
+            self._itens.move_to_end(chave)
+            if len(self._itens) > self.tamanho:
+                self._itens.popitem(last=False)
+
+    def limpar(self):
+        with self._lock:
+            self._itens.clear()
+
+
+# ==============================================
+# BACKENDS DE CNPJ
+# ==============================================
+def _url_receitaws(cnpj):
+    return f'https://receitaws.com.br/v1/cnpj/{cnpj}'
+
+
+def _dados_receitaws(response):
+    """Interpreta a resposta da receitaws (``requests`` ou ``httpx``)"""
+    if response.status_code == 429:
+        espera = response.headers.get('Retry-After')
+        raise LimiteExcedido('receitaws: limite de requisições', int(espera) if espera and espera.isdigit() else None)
+    if response.status_code >= 400:
+        raise ServicoIndisponivel(f'receitaws: HTTP {response.status_code}')
+    try:
+        data = response.json()
+    except ValueError as e:
+        raise ServicoIndisponivel(f'receitaws: resposta inválida ({e})') from e
+
+    if data.get('status') == 'ERROR':
+        return {'valido': False, 'erro': data.get('message', 'CNPJ inválido')}
+
+    return {
+        'valido': True,
+        'DsRazaoSocial': data.get('nome', ''),
+        'DsNomeFantasia': data.get('fantasia', ''),
+        'DsSituacaoCadastral': data.get('situacao', 'ATIVO'),
+        'DsEnderecoLogradouro': data.get('logradouro', ''),
+        'NrEnderecoNumero': data.get('numero', ''),
+        'DsEnderecoBairro': data.get('bairro', ''),
+        'NrEnderecoCep': data.get('cep', '').replace('.', '').replace('-', ''),
+        'DsEnderecoCidade': data.get('municipio', ''),
+        'DsEnderecoEstado': data.get('uf', ''),
+        'DsEmail': data.get('email', ''),
+        'DsInscricaoEstadual': data.get('inscricao_estadual', ''),
+        'DsTelefone': data.get('telefone', ''),
+        'DsSite': data.get('site', '')
+    }
+
+
+def _cnpj_receitaws(cnpj):
+    try:
+        response = sessao_http().get(_url_receitaws(cnpj), timeout=TIMEOUT_CONSULTA)
+    except requests.exceptions.RequestException as e:
+        raise ServicoIndisponivel(f'receitaws: {e}') from e
+    return _dados_receitaws(response)
+
+
+async def _acnpj_receitaws(cnpj):
+    try:
+        async with cliente_http_async() as cliente:
+            response = await cliente.get(_url_receitaws(cnpj), timeout=httpx.Timeout(TIMEOUT_CONSULTA[1], connect=TIMEOUT_CONSULTA[0]))
+    except httpx.HTTPError as e:
+        raise ServicoIndisponivel(f'receitaws: {e}') from e
+    return _dados_receitaws(response)
+
+
+def _cnpj_local(cnpj):
+    """Dados fictícios e determinísticos, no mesmo formato da receitaws"""
+    return {
+        'valido': True,
+        'DsRazaoSocial': f'Empresa {cnpj} Ltda',
+        'DsNomeFantasia': f'Empresa {cnpj[:8]}',
+        'DsSituacaoCadastral': 'ATIVA',
+        'DsEnderecoLogradouro': 'Rua Exemplo',
+        'NrEnderecoNumero': str(int(cnpj[8:12])),
+        'DsEnderecoBairro': 'Centro',
+        'NrEnderecoCep': '01001000',
+        'DsEnderecoCidade': 'São Paulo',
+        'DsEnderecoEstado': 'SP',
+        'DsEmail': '',
+        'DsInscricaoEstadual': '',
+        'DsTelefone': '',
+        'DsSite': ''
+    }
+
+
+async def _acnpj_local(cnpj):
+    return BACKENDS_CNPJ['local'](cnpj)
+
+
+BACKENDS_CNPJ = {
+    'receitaws': _cnpj_receitaws,
+    'local': _cnpj_local,
+}
+BACKENDS_CNPJ_ASYNC = {
+    'receitaws': _acnpj_receitaws,
+    'local': _acnpj_local,
+}
+
+disjuntor_cnpj = Disjuntor('receitaws')
+_consultas_cnpj = ConsultasEmAndamento()
+_aconsultas_cnpj = ConsultasEmAndamentoAsync()
+
+
+def _nome_backend_cnpj():
+    return getattr(settings, 'CONSULTA_CNPJ_BACKEND', 'receitaws')
+
+
+def _backend_cnpj():
+    return BACKENDS_CNPJ[_nome_backend_cnpj()]
+
+
+def _abackend_cnpj():
+    return BACKENDS_CNPJ_ASYNC[_nome_backend_cnpj()]
+
+
+# ==============================================
+# CONSULTA
+# ==============================================
+def _chave_cache(servico, chave):
+    return f'consulta:{servico}:{chave}'
+
+
+def _gravar(servico, chave, dados, encontrado, ttl):
+    agora = timezone.now()
+    ConsultaExterna.objects.update_or_create(
+        servico=servico, chave=chave,
+        defaults={'dados': dados, 'encontrado': encontrado, 'consultado_em': agora, 'expira_em': agora + ttl}
+    )
+    cache.set(_chave_cache(servico, chave), dados, min(TTL_CACHE_LOCAL, ttl.total_seconds()))
+
+
+async def _agravar(servico, chave, dados, encontrado, ttl):
+    agora = timezone.now()
+    await ConsultaExterna.objects.aupdate_or_create(
+        servico=servico, chave=chave,
+        defaults={'dados': dados, 'encontrado': encontrado, 'consultado_em': agora, 'expira_em': agora + ttl}
+    )
+    await cache.aset(_chave_cache(servico, chave), dados, min(TTL_CACHE_LOCAL, ttl.total_seconds()))
+
+
+def _resultado_vencido(cnpj, gravada, erro):
+    if gravada is None:
+        raise erro
+    # Resultado vencido é melhor que nenhum enquanto o serviço estiver fora
+    logger.error(f"Consulta de CNPJ {cnpj} indisponível, usando resultado de {gravada.consultado_em}: {str(erro)}")
+    return gravada.dados
+
+
+def _consultar_cnpj_sem_cache_local(cnpj):
+    gravada = ConsultaExterna.objects.filter(servico='cnpj', chave=cnpj).first()
+    if gravada is not None and gravada.expira_em > timezone.now():
+        cache.set(_chave_cache('cnpj', cnpj), gravada.dados, TTL_CACHE_LOCAL)
+        return gravada.dados
+
+    try:
+        dados = disjuntor_cnpj.chamar(_backend_cnpj(), cnpj)
+    except ServicoIndisponivel as e:
+        return _resultado_vencido(cnpj, gravada, e)
+
+    encontrado = dados.get('valido', False)
+    _gravar('cnpj', cnpj, dados, encontrado, TTL_CNPJ if encontrado else TTL_CNPJ_NAO_ENCONTRADO)
+    return dados
+
+
+async def _aconsultar_cnpj_sem_cache_local(cnpj):
+    gravada = await ConsultaExterna.objects.filter(servico='cnpj', chave=cnpj).afirst()
+    if gravada is not None and gravada.expira_em > timezone.now():
+        await cache.aset(_chave_cache('cnpj', cnpj), gravada.dados, TTL_CACHE_LOCAL)
+        return gravada.dados
+
+    try:
+        dados = await disjuntor_cnpj.achamar(_abackend_cnpj(), cnpj)
+    except ServicoIndisponivel as e:
+        return _resultado_vencido(cnpj, gravada, e)
+
+    encontrado = dados.get('valido', False)
+    await _agravar('cnpj', cnpj, dados, encontrado, TTL_CNPJ if encontrado else TTL_CNPJ_NAO_ENCONTRADO)
+    return dados
+
+
+def consultar_cnpj(cnpj):
+    """
+    Dados cadastrais do CNPJ (14 dígitos, sem máscara) no formato usado
+    pelo formulário de cadastro. CNPJ inexistente devolve ``{'valido':
+    False, 'erro': ...}``; falha do serviço sem resultado gravado levanta
+    ``ServicoIndisponivel``.
+    """
+    if not CNPJ().validate(cnpj):
+        # Dígito verificador errado: nem chega a consultar o serviço
+        return {'valido': False, 'erro': 'CNPJ inválido'}
+
+    dados = cache.get(_chave_cache('cnpj', cnpj))
+    if dados is not None:
+        return dados
+    return _consultas_cnpj.executar(cnpj, lambda: _consultar_cnpj_sem_cache_local(cnpj))
+
+
+async def aconsultar_cnpj(cnpj):
+    """Versão async de ``consultar_cnpj``"""
+    if not CNPJ().validate(cnpj):
+        return {'valido': False, 'erro': 'CNPJ inválido'}
+
+    dados = await cache.aget(_chave_cache('cnpj', cnpj))
+    if dados is not None:
+        return dados
+    return await _aconsultas_cnpj.executar(cnpj, lambda: _aconsultar_cnpj_sem_cache_local(cnpj))
+
+
+# ==============================================
+# CEP
+# ==============================================
+CAMPOS_CEP = ('logradouro', 'complemento', 'bairro', 'cidade', 'uf', 'codigo_ibge')
+
+disjuntor_viacep = Disjuntor('viacep')
+_consultas_cep = ConsultasEmAndamento()
+_aconsultas_cep = ConsultasEmAndamentoAsync()
+_ceps = CacheLRU(TAMANHO_LRU_CEP)
+
+
+def _url_viacep(cep):
+    return f'https://viacep.com.br/ws/{cep}/json/'
+
+
+def _campos_viacep(response):
+    """Campos de ``Cep`` vindos do ViaCEP, ou ``None`` se o CEP não existe"""
+    if response.status_code >= 400:
+        raise ServicoIndisponivel(f'viacep: HTTP {response.status_code}')
+    try:
+        data = response.json()
+    except ValueError as e:
+        raise ServicoIndisponivel(f'viacep: resposta inválida ({e})') from e
+
+    if 'erro' in data:
+        return None
+    return {
+        'logradouro': data.get('logradouro', ''),
+        'complemento': data.get('complemento', ''),
+        'bairro': data.get('bairro', ''),
+        'cidade': data.get('localidade', ''),
+        'uf': data.get('uf', ''),
+        'codigo_ibge': data.get('ibge', ''),
+    }
+
+
+def _cep_viacep(cep):
+    try:
+        response = sessao_http().get(_url_viacep(cep), timeout=TIMEOUT_CEP)
+    except requests.exceptions.RequestException as e:
+        raise ServicoIndisponivel(f'viacep: {e}') from e
+    return _campos_viacep(response)
+
+
+async def _acep_viacep(cep):
+    try:
+        async with cliente_http_async() as cliente:
+            response = await cliente.get(_url_viacep(cep), timeout=httpx.Timeout(TIMEOUT_CEP[1], connect=TIMEOUT_CEP[0]))
+    except httpx.HTTPError as e:
+        raise ServicoIndisponivel(f'viacep: {e}') from e
+    return _campos_viacep(response)
+
+
+def endereco_do_cep(campos):
+    """Campos de ``Cep`` no formato usado pelo formulário de cadastro"""
+    return {
+        'DsEnderecoLogradouro': campos['logradouro'],
+        'DsEnderecoBairro': campos['bairro'],
+        'DsEnderecoCidade': campos['cidade'],
+        'DsEnderecoEstado': campos['uf'],
+        'DsEnderecoComplemento': campos['complemento']
+    }
+
+
+def _consultar_cep_fora_do_lru(cep):
+    campos = Cep.objects.filter(pk=cep).values(*CAMPOS_CEP).first()
+    if campos is None:
+        if ConsultaExterna.objects.filter(servico='cep', chave=cep, expira_em__gt=timezone.now()).exists():
+            return None
+        campos = disjuntor_viacep.chamar(_cep_viacep, cep)
+        if campos is None:
+            _gravar('cep', cep, {}, False, TTL_CEP_NAO_ENCONTRADO)
+            return None
+        Cep.objects.update_or_create(cep=cep, defaults={**campos, 'origem': 'VIACEP'})
+
+    endereco = endereco_do_cep(campos)
+    _ceps.set(cep, endereco)
+    return endereco
+
+
+async def _aconsultar_cep_fora_do_lru(cep):
+    campos = await Cep.objects.filter(pk=cep).values(*CAMPOS_CEP).afirst()
+    if campos is None:
+        if await ConsultaExterna.objects.filter(servico='cep', chave=cep, expira_em__gt=timezone.now()).aexists():
+            return None
+        campos = await disjuntor_viacep.achamar(_acep_viacep, cep)
+        if campos is None:
+            await _agravar('cep', cep, {}, False, TTL_CEP_NAO_ENCONTRADO)
+            return None
+        await Cep.objects.aupdate_or_create(cep=cep, defaults={**campos, 'origem': 'VIACEP'})
+
+    endereco = endereco_do_cep(campos)
+    _ceps.set(cep, endereco)
+    return endereco
+
+
+def consultar_cep(cep):
+    """
+    Endereço do CEP (8 dígitos, sem máscara), ou ``None`` se ele não
+    existe. Levanta ``ServicoIndisponivel`` só quando o CEP não está na base
+    local e o ViaCEP não responde.
+    """
+    endereco = _ceps.get(cep)
+    if endereco is not None:
+        return endereco
+    return _consultas_cep.executar(cep, lambda: _consultar_cep_fora_do_lru(cep))
+
+
+async def aconsultar_cep(cep):
+    """Versão async de ``consultar_cep``"""
+    endereco = _ceps.get(cep)
+    if endereco is not None:
+        return endereco
+    return await _aconsultas_cep.executar(cep, lambda: _aconsultar_cep_fora_do_lru(cep))
+
+
+def limpar_cache_ceps():
+    _ceps.limpar()
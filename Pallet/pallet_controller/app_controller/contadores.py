@@ -0,0 +1,221 @@
+"""
+Contadores desnormalizados do dashboard.
+
+Duas tabelas são mantidas incrementalmente:
+
+* ``ContadorVales``: totais por PJ/estado/situação, para a visão completa;
+* ``ResumoDiarioVales``: os mesmos totais separados pelo dia de emissão,
+  para os filtros por período e as faixas de dias em aberto.
+
+``ValePallet.save`` e ``ValePallet.delete`` chamam ``atualizar_contadores``
+dentro da mesma transação, de modo que cadastro, scan, movimentações e
+remoção mantêm os totais sempre consistentes. Inserções em lote
+(``bulk_create``, que não chama ``save``) usam ``somar_vales_criados`` e
+atualizações diretas (``UPDATE``) usam ``atualizar_contadores_em_lote``.
+``reconstruir_contadores`` e ``divergencias_contadores`` são usados pelo
+comando ``reconciliar_contadores`` para reconstruir/conferir as tabelas a
+partir dos vales.
+"""
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, DateField, F, Q, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import ContadorVales, ResumoDiarioVales, ValePallet
+
+
+CHAVE = ('criado_por_id', 'estado', 'situacao', 'dia_validade')
+CHAVE_RESUMO = CHAVE + ('dia',)
+
+# Tabela -> campos que formam a chave de cada linha
+TABELAS = (
+    (ContadorVales, CHAVE),
+    (ResumoDiarioVales, CHAVE_RESUMO),
+)
+
+
+def situacao_vale(data_saida, data_retorno):
+    """Mesma classificação usada pelas métricas do dashboard"""
+    if data_saida is None:
+        return 'PENDENTE'
+    if data_retorno is None:
+        return 'EM_ABERTO'
+    return 'COLETADO'
+
+
+def _dia_local(valor):
+    return timezone.localtime(valor).date() if valor is not None else None
+
+
+def chave_contador(valores, campos=CHAVE):
+    """Chave do contador para um dicionário com ``ValePallet.CAMPOS_CONTADOR``"""
+    situacao = situacao_vale(valores['data_saida'], valores['data_retorno'])
+    chave = {
+        'criado_por_id': valores['criado_por_id'],
+        'estado': valores['estado'],
+        'situacao': situacao,
+        'dia_validade': _dia_local(valores['data_validade']) if situacao == 'EM_ABERTO' else None,
+        'dia': _dia_local(valores['data_emissao']),
+    }
+    return tuple(chave[campo] for campo in campos)
+
+
+def _somar(modelo, campos, chave, vales, pbr, chepp):
+    """
+    Soma as diferenças na linha da chave, criando-a se ainda não existir.
+    A chave é única: se outra transação criar a mesma linha ao mesmo tempo,
+    o INSERT falha e a soma é refeita com UPDATE sobre a linha dela.
+    """
+    filtro = dict(zip(campos, chave))
+    diferencas = {
+        'qtd_vales': F('qtd_vales') + vales,
+        'qtd_pbr': F('qtd_pbr') + pbr,
+        'qtd_chepp': F('qtd_chepp') + chepp,
+    }
+    if modelo.objects.filter(**filtro).update(**diferencas):
+        return
+    try:
+        with transaction.atomic():
+            modelo.objects.create(qtd_vales=vales, qtd_pbr=pbr, qtd_chepp=chepp, **filtro)
+    except IntegrityError:
+        modelo.objects.filter(**filtro).update(**diferencas)
+
+
+@transaction.atomic
+def atualizar_contadores_em_lote(transicoes):
+    """
+    Aplica nos contadores várias transições ``(anterior, atual)`` de vales
+    (dicionários com ``ValePallet.CAMPOS_CONTADOR``; ``None`` indica vale
+    inexistente antes/depois). As diferenças são somadas por chave: uma
+    atualização por linha de contador afetada, e não por vale.
+    """
+    for modelo, campos in TABELAS:
+        totais = defaultdict(lambda: [0, 0, 0])
+        for anterior, atual in transicoes:
+            if anterior == atual:
+                continue
+            if anterior is not None:
+                total = totais[chave_contador(anterior, campos)]
+                total[0] -= 1
+                total[1] -= anterior['qtd_pbr']
+                total[2] -= anterior['qtd_chepp']
+            if atual is not None:
+                total = totais[chave_contador(atual, campos)]
+                total[0] += 1
+                total[1] += atual['qtd_pbr']
+                total[2] += atual['qtd_chepp']
+        for chave, (qtd_vales, pbr, chepp) in totais.items():
+            # Mesma chave antes e depois: só a diferença de pallets (ou nada)
+            if qtd_vales or pbr or chepp:
+                _somar(modelo, campos, chave, qtd_vales, pbr, chepp)
+
+
+def atualizar_contadores(anterior, atual):
+    """Aplica nos contadores a transição de um vale de ``anterior`` para ``atual``"""
+    if anterior != atual:
+        atualizar_contadores_em_lote([(anterior, atual)])
+
+
+def somar_vales_criados(vales):
+    """Soma nos contadores vales recém-inseridos com ``bulk_create``"""
+    atualizar_contadores_em_lote([(None, vale._snapshot_contador()) for vale in vales])
+
+
+def contadores_da_pj(pessoa_juridica=None):
+    """Contadores de uma PJ, ou de todas (visão global) se ``None``"""
+    contadores = ContadorVales.objects.all()
+    if pessoa_juridica is not None:
+        contadores = contadores.filter(criado_por=pessoa_juridica)
+    return contadores
+
+
+def resumos_da_pj(pessoa_juridica=None, inicio=None, fim=None):
+    """Resumos diários de uma PJ (ou de todas), opcionalmente entre dois dias"""
+    resumos = ResumoDiarioVales.objects.all()
+    if pessoa_juridica is not None:
+        resumos = resumos.filter(criado_por=pessoa_juridica)
+    if inicio is not None:
+        resumos = resumos.filter(dia__gte=inicio)
+    if fim is not None:
+        resumos = resumos.filter(dia__lte=fim)
+    return resumos
+
+
+# ==============================================
+# RECONSTRUÇÃO E CONFERÊNCIA
+# ==============================================
+def _contadores_esperados(campos):
+    """Contadores calculados diretamente a partir da tabela de vales"""
+    em_aberto = Q(data_saida__isnull=False, data_retorno__isnull=True)
+    agrupado = ValePallet.objects.order_by().annotate(
+        situacao=Case(
+            When(data_saida__isnull=True, then=Value('PENDENTE')),
+            When(data_retorno__isnull=True, then=Value('EM_ABERTO')),
+            default=Value('COLETADO'),
+        ),
+        dia_validade=Case(
+            When(em_aberto, then=TruncDate('data_validade')),
+            default=None,
+            output_field=DateField(),
+        ),
+        dia=TruncDate('data_emissao'),
+    ).values(*campos).annotate(
+        total=Count('id'),
+        pbr=Sum('qtd_pbr', default=0),
+        chepp=Sum('qtd_chepp', default=0),
+    )
+    return {
+        tuple(item[campo] for campo in campos): (item['total'], item['pbr'], item['chepp'])
+        for item in agrupado
+    }
+
+
+def _contadores_atuais(modelo, campos):
+    agrupado = modelo.objects.order_by().values(*campos).annotate(
+        total=Sum('qtd_vales'),
+        pbr=Sum('qtd_pbr'),
+        chepp=Sum('qtd_chepp'),
+    )
+    return {
+        tuple(item[campo] for campo in campos): (item['total'], item['pbr'], item['chepp'])
+        for item in agrupado
+        if (item['total'], item['pbr'], item['chepp']) != (0, 0, 0)
+    }
+
+
+def divergencias_contadores():
+    """
+    Lista as linhas cujo contador difere do valor calculado a partir dos
+    vales, no formato ``(modelo, chave, esperado, atual)``, onde ``chave``
+    é um dicionário com os campos que identificam a linha.
+    """
+    vazio = (0, 0, 0)
+    divergencias = []
+    for modelo, campos in TABELAS:
+        esperados = _contadores_esperados(campos)
+        atuais = _contadores_atuais(modelo, campos)
+        for chave in sorted(set(esperados) | set(atuais), key=str):
+            if esperados.get(chave, vazio) != atuais.get(chave, vazio):
+                divergencias.append((
+                    modelo, dict(zip(campos, chave)), esperados.get(chave, vazio), atuais.get(chave, vazio)
+                ))
+    return divergencias
+
+
+@transaction.atomic
+def reconstruir_contadores():
+    """Recria as tabelas de contadores a partir dos vales"""
+    # Trava a tabela de vales contra escritas concorrentes durante a recontagem
+    list(ValePallet.objects.select_for_update().order_by().values_list('id', flat=True))
+    total = 0
+    for modelo, campos in TABELAS:
+        modelo.objects.all().delete()
+        esperados = _contadores_esperados(campos)
+        modelo.objects.bulk_create([
+            modelo(qtd_vales=vales, qtd_pbr=pbr, qtd_chepp=chepp, **dict(zip(campos, chave)))
+            for chave, (vales, pbr, chepp) in esperados.items()
+        ], batch_size=1000)
+        total += len(esperados)
+    return total
@@ -0,0 +1,182 @@
+"""
+Métricas do dashboard de movimentações.
+
+``metricas_por_contadores`` tira todas as contagens e somas de pallets das
+tabelas desnormalizadas ``ContadorVales`` (visão completa) e
+``ResumoDiarioVales`` (filtros por período) com uma agregação condicional
+(SUM ... FILTER), sem ler a tabela de vales.
+"""
+import datetime
+from dataclasses import dataclass, field
+
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+
+from .contadores import contadores_da_pj, resumos_da_pj
+
+
+PALLETS = F('qtd_pbr') + F('qtd_chepp')
+
+
+@dataclass
+class MetricasDashboard:
+    """Resultado tipado das métricas do dashboard."""
+
+    # Métricas de status
+    a_vencer: int = 0
+    coletado: int = 0
+    pendente: int = 0
+    vencido: int = 0
+
+    # Métricas de pallets
+    pallets_movimentacao: int = 0
+    pallets_prazo: int = 0
+    pallets_vencidos: int = 0
+    total_pallets: int = 0
+
+    # Dias em aberto (baseado na data_emissao)
+    menos_30_dias: int = 0
+    mais_30_dias: int = 0
+    mais_90_dias: int = 0
+    mais_180_dias: int = 0
+
+    total_vales: int = 0
+
+    # Agregação por fornecedor, ordenada por total de pallets
+    fornecedores: list = field(default_factory=list)
+
+    def top_fornecedores(self, limite=3):
+        return self.fornecedores[:limite]
+
+    def as_dict(self):
+        """Dicionário no formato esperado pelo template e pelo dashboard.js"""
+        return {
+            'a_vencer': self.a_vencer,
+            'coletado': self.coletado,
+            'pendente': self.pendente,
+            'vencido': self.vencido,
+
+            'pallets_movimentacao': self.pallets_movimentacao,
+            'pallets_prazo': self.pallets_prazo,
+            'pallets_vencidos': self.pallets_vencidos,
+            'total_pallets': self.total_pallets,
+
+            'menos_30_dias': self.menos_30_dias,
+            'mais_30_dias': self.mais_30_dias,
+            'mais_90_dias': self.mais_90_dias,
+            'mais_180_dias': self.mais_180_dias,
+
+            'fornecedores_data': self.fornecedores,
+            'total_fornecedores': {
+                'vales': self.total_vales,
+                'pallets': self.total_pallets
+            },
+        }
+
+
+def inicio_do_dia(dia):
+    """Meia-noite (no fuso local) do dia informado, como datetime aware"""
+    return timezone.make_aware(datetime.datetime.combine(dia, datetime.time.min))
+
+
+def intervalo_periodo(periodo, hoje):
+    """
+    Primeiro e último dia (inclusive) de um período do filtro do dashboard,
+    ou ``None`` para 'todos'.
+    """
+    if periodo == 'hoje':
+        return hoje, hoje
+
+    if periodo == 'semana':
+        # Semana de domingo a sábado (weekday(): segunda = 0, domingo = 6)
+        inicio_semana = hoje - datetime.timedelta(days=(hoje.weekday() + 1) % 7)
+        return inicio_semana, inicio_semana + datetime.timedelta(days=6)
+
+    if periodo == 'mes':
+        primeiro_dia_mes = hoje.replace(day=1)
+        if hoje.month == 12:
+            ultimo_dia_mes = hoje.replace(day=31)
+        else:
+            ultimo_dia_mes = hoje.replace(month=hoje.month + 1, day=1) - datetime.timedelta(days=1)
+        return primeiro_dia_mes, ultimo_dia_mes
+
+    if periodo == 'trimestre':
+        return hoje - datetime.timedelta(days=90), hoje
+
+    if periodo == 'ano':
+        return hoje.replace(month=1, day=1), hoje.replace(month=12, day=31)
+
+    return None
+
+
+def _faixas_idade(pessoa_juridica, hoje, inicio, fim, total_vales):
+    """
+    Dias em aberto a partir dos resumos diários. Só os dias dos últimos 180
+    dias são lidos; a faixa mais antiga sai da diferença com o total.
+    """
+    limite_30 = hoje - datetime.timedelta(days=30)
+    limite_90 = hoje - datetime.timedelta(days=90)
+    limite_180 = hoje - datetime.timedelta(days=180)
+
+    resumos = resumos_da_pj(pessoa_juridica, max(inicio, limite_180) if inicio else limite_180, fim)
+    faixas = resumos.order_by().aggregate(
+        menos_30_dias=Sum('qtd_vales', filter=Q(dia__gte=limite_30), default=0),
+        mais_30_dias=Sum('qtd_vales', filter=Q(dia__lt=limite_30, dia__gte=limite_90), default=0),
+        mais_90_dias=Sum('qtd_vales', filter=Q(dia__lt=limite_90), default=0),
+    )
+    faixas['mais_180_dias'] = max(total_vales - sum(faixas.values()), 0)
+    return faixas
+
+
+def metricas_por_contadores(pessoa_juridica=None, hoje=None, inicio=None, fim=None):
+    """
+    Métricas do dashboard a partir das tabelas desnormalizadas, para uma PJ
+    ou para todas (``None``).
+
+    Sem período, os totais vêm de ``ContadorVales`` (O(PJs) linhas); com
+    ``inicio``/``fim`` (dias de emissão, inclusive) vêm de
+    ``ResumoDiarioVales``, no máximo uma linha por dia do período.
+    """
+    if hoje is None:
+        hoje = timezone.localdate()
+
+    if inicio is None and fim is None:
+        contadores = contadores_da_pj(pessoa_juridica)
+    else:
+        contadores = resumos_da_pj(pessoa_juridica, inicio, fim)
+
+    pendente = Q(situacao='PENDENTE')
+    em_aberto = Q(situacao='EM_ABERTO')
+    no_prazo = em_aberto & Q(dia_validade__gte=hoje)
+    vencido = em_aberto & Q(dia_validade__lt=hoje)
+
+    totais = contadores.order_by().aggregate(
+        a_vencer=Sum('qtd_vales', filter=no_prazo, default=0),
+        coletado=Sum('qtd_vales', filter=Q(situacao='COLETADO'), default=0),
+        pendente=Sum('qtd_vales', filter=pendente, default=0),
+        vencido=Sum('qtd_vales', filter=vencido, default=0),
+
+        pallets_movimentacao=Sum(PALLETS, filter=em_aberto, default=0),
+        pallets_prazo=Sum(PALLETS, filter=pendente | no_prazo, default=0),
+        pallets_vencidos=Sum(PALLETS, filter=vencido, default=0),
+        total_pallets=Sum(PALLETS, default=0),
+
+        total_vales=Sum('qtd_vales', default=0),
+    )
+    totais.update(_faixas_idade(pessoa_juridica, hoje, inicio, fim, totais['total_vales']))
+
+    fornecedores = contadores.values(
+        'criado_por__usuario__username'
+    ).annotate(
+        vale_count=Sum('qtd_vales'),
+        total_pallets=Sum(PALLETS)
+    ).filter(vale_count__gt=0).order_by('-total_pallets')
+
+    return MetricasDashboard(
+        fornecedores=[{
+            'responsavel__username': item['criado_por__usuario__username'] or 'Sem responsável',
+            'vale': item['vale_count'],
+            'pallets': item['total_pallets'] or 0
+        } for item in fornecedores],
+        **totais
+    )
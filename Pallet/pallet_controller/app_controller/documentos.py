@@ -0,0 +1,133 @@
+"""
+Documentos (PDF) de vários vales de uma vez, com os filtros da listagem.
+
+O template do documento é carregado (e compilado) uma vez e renderizado
+para cada vale; os PDFs saem do pool de ``pdfs.py`` em paralelo e entram
+num ZIP que é transmitido à medida que cada documento fica pronto. Com
+``formato=pdf`` as páginas de todos os vales são juntadas num PDF único,
+renderizado de uma vez só (até ``LIMITE_PDF_UNICO`` vales). Lotes grandes
+rodam na fila de tarefas (``gerar_arquivo_documentos``), como as
+exportações.
+"""
+import re
+import tempfile
+import uuid
+import zipfile
+
+from django.core.exceptions import PermissionDenied
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.template import TemplateDoesNotExist
+from django.template.loader import get_template
+from django.utils import timezone
+
+from .exportacao import DIRETORIO_EXPORTACOES
+from .filtros import filtrar_vales, vales_do_usuario
+from .models import Usuario
+from .pdfs import pdfs_em_lote, renderizar_pdf_unico
+
+
+LIMITE_PDF_UNICO = 500
+CHUNK_DOCUMENTOS = 200
+
+FORMATOS = {
+    'zip': 'application/zip',
+    'pdf': 'application/pdf',
+}
+
+
+def template_documento(tipo):
+    """Template compilado de ``vales/documento_<tipo>.html``"""
+    if not re.fullmatch(r'[a-z_]+', tipo):
+        raise TemplateDoesNotExist(tipo)
+    return get_template(f'vales/documento_{tipo}.html')
+
+
+def html_documento(template, vale, usuario):
+    return template.render({'vale': vale, 'user': usuario})
+
+
+def nome_documento(vale, tipo):
+    return f'vale_{vale.numero_vale}_{tipo}.pdf'
+
+
+def consulta_documentos(usuario, filtros):
+    """Vales do usuário que passam nos filtros da listagem, em ordem de número"""
+    vales = vales_do_usuario(usuario)
+    if vales is None:
+        raise PermissionDenied
+    vales, _ = filtrar_vales(vales, filtros, ordenar_por_relevancia=False)
+    return vales.select_related('cliente', 'motorista', 'transportadora', 'criado_por').order_by('numero_vale', 'id')
+
+
+def _documentos(vales, tipo, usuario):
+    template = template_documento(tipo)
+    for vale in vales.iterator(chunk_size=CHUNK_DOCUMENTOS):
+        yield nome_documento(vale, tipo), f'vales/{vale.id}', tipo, html_documento(template, vale, usuario)
+
+
+class _Saida:
+    """Destino só de escrita do ZipFile; as partes são recolhidas a cada arquivo"""
+
+    def __init__(self):
+        self.partes = []
+        self.posicao = 0
+
+    def write(self, dados):
+        self.partes.append(bytes(dados))
+        self.posicao += len(dados)
+        return len(dados)
+
+    def tell(self):
+        return self.posicao
+
+    def flush(self):
+        pass
+
+    def recolher(self):
+        dados = b''.join(self.partes)
+        self.partes = []
+        return dados
+
+
+def zip_em_partes(vales, tipo, usuario):
+    """ZIP com um PDF por vale, gerado em partes (uma por documento)"""
+    saida = _Saida()
+    # PDF já é comprimido: ZIP_STORED evita gastar CPU à toa
+    with zipfile.ZipFile(saida, 'w', zipfile.ZIP_STORED) as arquivo_zip:
+        for nome, conteudo in pdfs_em_lote(_documentos(vales, tipo, usuario)):
+            arquivo_zip.writestr(nome, conteudo)
+            yield saida.recolher()
+    yield saida.recolher()
+
+
+def pdf_unico(vales, tipo, usuario):
+    template = template_documento(tipo)
+    return renderizar_pdf_unico(
+        html_documento(template, vale, usuario) for vale in vales.iterator(chunk_size=CHUNK_DOCUMENTOS)
+    )
+
+
+def nome_arquivo(tipo, formato):
+    return f"vales_{tipo}_{timezone.localdate().strftime('%Y%m%d')}.{formato}"
+
+
+def gerar_arquivo_documentos(usuario_id, tipo, formato, filtros):
+    """
+    Tarefa em segundo plano: gera o ZIP/PDF no storage padrão e devolve o
+    nome para ``exportacao_baixar``.
+    """
+    usuario = Usuario.objects.get(pk=usuario_id)
+    vales = consulta_documentos(usuario, filtros)
+    with tempfile.TemporaryFile() as temporario:
+        if formato == 'pdf':
+            temporario.write(pdf_unico(vales, tipo, usuario))
+        else:
+            for parte in zip_em_partes(vales, tipo, usuario):
+                temporario.write(parte)
+        temporario.seek(0)
+        nome = default_storage.save(
+            f'{DIRETORIO_EXPORTACOES}/{uuid.uuid4().hex}/{nome_arquivo(tipo, formato)}',
+            File(temporario)
+        )
+    return {'arquivo': nome}
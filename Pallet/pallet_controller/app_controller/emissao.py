@@ -0,0 +1,250 @@
+"""
+Emissão de vales em lote (endpoint ``valepallet_emitir_lote`` e comando
+``emitir_vales``).
+
+As linhas (CSV ou JSON) são validadas todas de uma vez: cada cadastro
+referenciado é buscado com uma única consulta por tabela e os números de
+vale já existentes com outra. Se alguma linha tiver erro nada é gravado;
+caso contrário vales e movimentações EMITIDO são inseridos com
+``bulk_create`` numa única transação e os contadores do dashboard são
+somados por chave. O QR Code não é gerado aqui: ele é renderizado sob
+demanda pela view ``valepallet_qr_code``.
+"""
+import datetime
+import json
+import secrets
+
+from django.db import transaction
+
+from .contadores import somar_vales_criados
+from .dashboard import inicio_do_dia
+from .movimentacoes import registrar_movimentacoes
+from .planilhas import ler_csv
+from .models import Cliente, Motorista, Movimentacao, PessoaJuridica, Transportadora, ValePallet
+
+
+LIMITE_LOTE = 1000
+
+# Campo da linha -> (modelo, campo de documento aceito no lugar do id)
+CADASTROS = {
+    'cliente': (Cliente, 'cnpj'),
+    'motorista': (Motorista, 'cpf'),
+    'transportadora': (Transportadora, 'cnpj'),
+}
+
+
+class LoteInvalido(Exception):
+    """Lote com erros; ``erros`` é uma lista de ``{'linha': n, 'erros': [...]}``"""
+
+    def __init__(self, erros):
+        super().__init__(f'{len(erros)} linha(s) com erro')
+        self.erros = erros
+
+
+# ==============================================
+# LEITURA
+# ==============================================
+def ler_linhas(conteudo, formato):
+    """
+    Converte o conteúdo enviado em uma lista de dicionários. ``formato`` é
+    ``'csv'`` (cabeçalho na primeira linha, separador , ou ;) ou ``'json'``
+    (lista de objetos, ou ``{"vales": [...]}``).
+    """
+    if isinstance(conteudo, bytes):
+        conteudo = conteudo.decode('utf-8-sig')
+
+    if formato == 'json':
+        try:
+            dados = json.loads(conteudo)
+        except ValueError as e:
+            raise LoteInvalido([{'linha': 0, 'erros': [f'JSON inválido: {e}']}])
+        if isinstance(dados, dict):
+            dados = dados.get('vales')
+        if not isinstance(dados, list) or not all(isinstance(item, dict) for item in dados):
+            raise LoteInvalido([{'linha': 0, 'erros': ['Esperada uma lista de vales']}])
+        return dados
+
+    return ler_csv(conteudo)
+
+
+# ==============================================
+# VALIDAÇÃO
+# ==============================================
+def _inteiro(valor, campo, erros, minimo=0):
+    if valor in (None, ''):
+        return 0
+    try:
+        numero = int(valor)
+    except (TypeError, ValueError):
+        erros.append(f'{campo}: número inteiro inválido')
+        return None
+    if numero < minimo:
+        erros.append(f'{campo}: deve ser maior ou igual a {minimo}')
+        return None
+    return numero
+
+
+def _data(valor, erros):
+    if not valor:
+        erros.append('data_validade: obrigatória')
+        return None
+    for formato in ('%Y-%m-%d', '%d/%m/%Y'):
+        try:
+            return datetime.datetime.strptime(str(valor), formato).date()
+        except ValueError:
+            continue
+    erros.append('data_validade: use AAAA-MM-DD ou DD/MM/AAAA')
+    return None
+
+
+def _referencias(linhas, campo, modelo, documento, pessoa_juridica):
+    """Resolve ids e documentos de um cadastro com uma consulta só"""
+    ids, documentos = set(), set()
+    for linha in linhas:
+        if linha.get(campo) not in (None, ''):
+            ids.add(str(linha[campo]))
+        if linha.get(f'{campo}_{documento}'):
+            documentos.add(str(linha[f'{campo}_{documento}']))
+
+    cadastros = modelo.objects.filter(pk__in=[i for i in ids if i.isdigit()]) | \
+        modelo.objects.filter(**{f'{documento}__in': documentos})
+    if pessoa_juridica is not None:
+        cadastros = cadastros.filter(criado_por=pessoa_juridica)
+
+    por_id, por_documento = {}, {}
+    for pk, doc in cadastros.values_list('pk', documento):
+        por_id[str(pk)] = pk
+        por_documento[doc] = pk
+    return por_id, por_documento
+
+
+def validar_lote(linhas, usuario, pessoa_juridica=None):
+    """
+    Valida as linhas e devolve os ``ValePallet`` (ainda não gravados) na
+    mesma ordem. Levanta ``LoteInvalido`` com todos os erros encontrados.
+
+    Usuários PJ só podem usar os próprios cadastros e os vales ficam sempre
+    em nome da PJ. Para staff, cada linha pode informar ``criado_por`` (id
+    da PJ); sem ele, vale a ``pessoa_juridica`` passada.
+    """
+    if not linhas:
+        raise LoteInvalido([{'linha': 0, 'erros': ['Nenhum vale informado']}])
+    if len(linhas) > LIMITE_LOTE:
+        raise LoteInvalido([{'linha': 0, 'erros': [f'Máximo de {LIMITE_LOTE} vales por lote']}])
+
+    escopo = None if usuario.is_staff else pessoa_juridica
+    referencias = {
+        campo: _referencias(linhas, campo, modelo, documento, escopo)
+        for campo, (modelo, documento) in CADASTROS.items()
+    }
+
+    numeros = [str(linha.get('numero_vale') or '').strip() for linha in linhas]
+    existentes = set(
+        ValePallet.objects.filter(numero_vale__in=[n for n in numeros if n]).values_list('numero_vale', flat=True)
+    )
+    pjs = {}
+    if usuario.is_staff:
+        ids_pj = {str(linha['criado_por']) for linha in linhas if linha.get('criado_por') not in (None, '')}
+        pjs = {
+            str(pk): pk for pk in
+            PessoaJuridica.objects.filter(pk__in=[i for i in ids_pj if i.isdigit()]).values_list('pk', flat=True)
+        }
+
+    vales, erros_lote, vistos = [], [], set()
+    for posicao, (linha, numero) in enumerate(zip(linhas, numeros), start=1):
+        erros = []
+
+        if not numero:
+            erros.append('numero_vale: obrigatório')
+        elif len(numero) > ValePallet._meta.get_field('numero_vale').max_length:
+            erros.append('numero_vale: muito longo')
+        elif numero in existentes:
+            erros.append(f'numero_vale: o vale {numero} já existe')
+        elif numero in vistos:
+            erros.append(f'numero_vale: {numero} repetido no lote')
+        vistos.add(numero)
+
+        fks = {}
+        for campo, (modelo, documento) in CADASTROS.items():
+            por_id, por_documento = referencias[campo]
+            valor_id = linha.get(campo)
+            valor_documento = linha.get(f'{campo}_{documento}')
+            if valor_id not in (None, ''):
+                fks[campo] = por_id.get(str(valor_id))
+            elif valor_documento:
+                fks[campo] = por_documento.get(str(valor_documento))
+            else:
+                erros.append(f'{campo}: informe {campo} (id) ou {campo}_{documento}')
+                continue
+            if fks[campo] is None:
+                erros.append(f'{campo}: {modelo._meta.verbose_name} não encontrado')
+
+        criado_por = pessoa_juridica.pk if pessoa_juridica is not None else None
+        if usuario.is_staff and linha.get('criado_por') not in (None, ''):
+            criado_por = pjs.get(str(linha['criado_por']))
+            if criado_por is None:
+                erros.append('criado_por: pessoa jurídica não encontrada')
+
+        data_validade = _data(linha.get('data_validade'), erros)
+        qtd_pbr = _inteiro(linha.get('qtd_pbr'), 'qtd_pbr', erros)
+        qtd_chepp = _inteiro(linha.get('qtd_chepp'), 'qtd_chepp', erros)
+
+        if erros:
+            erros_lote.append({'linha': posicao, 'numero_vale': numero, 'erros': erros})
+            continue
+
+        vales.append(ValePallet(
+            numero_vale=numero,
+            cliente_id=fks['cliente'],
+            motorista_id=fks['motorista'],
+            transportadora_id=fks['transportadora'],
+            data_validade=inicio_do_dia(data_validade),
+            qtd_pbr=qtd_pbr,
+            qtd_chepp=qtd_chepp,
+            estado='EMITIDO',
+            criado_por_id=criado_por,
+            hash_seguranca=secrets.token_hex(16),
+        ))
+
+    if erros_lote:
+        raise LoteInvalido(erros_lote)
+    return vales
+
+
+# ==============================================
+# GRAVAÇÃO
+# ==============================================
+@transaction.atomic
+def emitir_lote(vales, usuario):
+    """
+    Grava os vales validados e suas movimentações EMITIDO numa única
+    transação. Devolve os vales com ``pk`` preenchido.
+    """
+    vales = ValePallet.objects.bulk_create(vales, batch_size=500)
+    if any(vale.pk is None for vale in vales):
+        # Bancos sem RETURNING: recupera os ids pelos números (únicos)
+        ids = dict(ValePallet.objects.filter(
+            numero_vale__in=[vale.numero_vale for vale in vales]
+        ).values_list('numero_vale', 'pk'))
+        for vale in vales:
+            vale.pk = ids[vale.numero_vale]
+
+    registrar_movimentacoes([
+        Movimentacao(
+            vale=vale,
+            tipo='EMITIDO',
+            qtd_pbr=vale.qtd_pbr,
+            qtd_chepp=vale.qtd_chepp,
+            responsavel=usuario,
+            observacao=f'Vale {vale.numero_vale} criado (lote)'
+        )
+        for vale in vales
+    ])
+
+    somar_vales_criados(vales)
+    return vales
+
+
+def emitir_vales(linhas, usuario, pessoa_juridica=None):
+    """Valida e emite um lote; levanta ``LoteInvalido`` sem gravar nada se houver erros"""
+    return emitir_lote(validar_lote(linhas, usuario, pessoa_juridica), usuario)
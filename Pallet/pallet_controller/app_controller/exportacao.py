@@ -0,0 +1,205 @@
+"""
+Exportação de vales e movimentações em CSV ou XLSX.
+
+As linhas são lidas com ``values_list(...).iterator()`` (cursor no servidor
+no PostgreSQL) e escritas à medida que chegam, então a memória usada não
+cresce com o tamanho da exportação. O escopo e os filtros são os mesmos da
+listagem de vales (``filtros.py``). Exportações grandes rodam na fila de
+tarefas (``gerar_arquivo_exportacao``) e o arquivo fica disponível para
+download em ``exportacao_baixar``.
+
+Textos digitados pelos usuários (nomes, observações) que começam com
+``=``, ``+``, ``-`` ou ``@`` seriam executados como fórmula pelo Excel; eles
+saem com um ``'`` na frente, no CSV e no XLSX.
+
+Os arquivos gerados em segundo plano ficam em ``DIRETORIO_EXPORTACOES``
+por ``EXPORTACOES_VALIDADE_HORAS`` e depois são apagados por
+``limpar_exportacoes`` (chamada pelo worker ``processar_tarefas``).
+
+XLSX usa o modo ``write_only`` do openpyxl, que é opcional: sem ele apenas
+CSV está disponível.
+"""
+import csv
+import datetime
+import logging
+import tempfile
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from .filtros import filtrar_vales, vales_do_usuario
+from .models import Movimentacao, Tarefa, Usuario
+
+
+logger = logging.getLogger(__name__)
+
+CHUNK_EXPORTACAO = 2000
+DIRETORIO_EXPORTACOES = 'exportacoes'
+EXPORTACOES_VALIDADE_HORAS = 24
+
+# Início de texto que planilhas interpretam como fórmula
+INICIO_FORMULA = ('=', '+', '-', '@', '\t', '\r')
+
+# Tipo -> colunas (cabeçalho, campo)
+COLUNAS = {
+    'vales': (
+        ('ID', 'id'),
+        ('Número', 'numero_vale'),
+        ('Estado', 'estado'),
+        ('Emissão', 'data_emissao'),
+        ('Validade', 'data_validade'),
+        ('Saída', 'data_saida'),
+        ('Retorno', 'data_retorno'),
+        ('PBR', 'qtd_pbr'),
+        ('CHEPP', 'qtd_chepp'),
+        ('Cliente', 'cliente__nome'),
+        ('CNPJ Cliente', 'cliente__cnpj'),
+        ('Motorista', 'motorista__nome'),
+        ('CPF Motorista', 'motorista__cpf'),
+        ('Transportadora', 'transportadora__nome'),
+        ('Empresa', 'criado_por__razao_social'),
+        ('Observações', 'observacoes'),
+    ),
+    'movimentacoes': (
+        ('ID', 'id'),
+        ('Vale', 'vale__numero_vale'),
+        ('Tipo', 'tipo'),
+        ('Data/Hora', 'data_hora'),
+        ('PBR', 'qtd_pbr'),
+        ('CHEPP', 'qtd_chepp'),
+        ('Responsável', 'responsavel__username'),
+        ('Observação', 'observacao'),
+    ),
+}
+
+FORMATOS = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+
+def consulta_exportacao(usuario, tipo, filtros):
+    """
+    Linhas a exportar (``values_list`` ordenado por id) no escopo do
+    usuário. Movimentações são as dos vales que passam nos filtros.
+    """
+    vales = vales_do_usuario(usuario)
+    if vales is None:
+        raise PermissionDenied
+    vales, _ = filtrar_vales(vales, filtros, ordenar_por_relevancia=False)
+
+    campos = [campo for _, campo in COLUNAS[tipo]]
+    if tipo == 'vales':
+        return vales.order_by('id').values_list(*campos)
+    return Movimentacao.objects.filter(
+        vale_id__in=vales.order_by().values('id')
+    ).order_by('id').values_list(*campos)
+
+
+def cabecalho(tipo):
+    return [titulo for titulo, _ in COLUNAS[tipo]]
+
+
+def _valor(valor, formato):
+    if hasattr(valor, 'tzinfo') and valor.tzinfo is not None:
+        valor = timezone.localtime(valor)
+        # Planilhas não guardam fuso: grava a hora local
+        return valor.replace(tzinfo=None) if formato == 'xlsx' else valor.strftime('%d/%m/%Y %H:%M:%S')
+    if isinstance(valor, str) and valor.startswith(INICIO_FORMULA):
+        return "'" + valor
+    return '' if valor is None else valor
+
+
+def linhas_exportacao(consulta, formato):
+    """Linhas já formatadas, lidas do banco em blocos"""
+    for linha in consulta.iterator(chunk_size=CHUNK_EXPORTACAO):
+        yield [_valor(valor, formato) for valor in linha]
+
+
+class _Eco:
+    """Arquivo falso para o csv.writer devolver cada linha como texto"""
+
+    def write(self, valor):
+        return valor
+
+
+def csv_em_partes(tipo, linhas):
+    """CSV (separador ; e BOM, para abrir direto no Excel) linha a linha"""
+    escritor = csv.writer(_Eco(), delimiter=';')
+    yield '\ufeff' + escritor.writerow(cabecalho(tipo))
+    for linha in linhas:
+        yield escritor.writerow(linha)
+
+
+def escrever_xlsx(tipo, linhas, arquivo):
+    """Grava o XLSX em ``arquivo`` sem manter as linhas em memória"""
+    from openpyxl import Workbook
+
+    planilha = Workbook(write_only=True)
+    aba = planilha.create_sheet(title=tipo.capitalize())
+    aba.append(cabecalho(tipo))
+    for linha in linhas:
+        aba.append(linha)
+    planilha.save(arquivo)
+
+
+def nome_arquivo(tipo, formato):
+    return f"{tipo}_{timezone.localdate().strftime('%Y%m%d')}.{formato}"
+
+
+def escrever_exportacao(usuario, tipo, formato, filtros, arquivo):
+    """Escreve a exportação completa em ``arquivo`` (modo binário)"""
+    linhas = linhas_exportacao(consulta_exportacao(usuario, tipo, filtros), formato)
+    if formato == 'xlsx':
+        escrever_xlsx(tipo, linhas, arquivo)
+        return
+    for parte in csv_em_partes(tipo, linhas):
+        arquivo.write(parte.encode('utf-8'))
+
+
+def gerar_arquivo_exportacao(usuario_id, tipo, formato, filtros):
+    """
+    Tarefa em segundo plano: gera o arquivo no storage padrão e devolve o
+    nome para ``exportacao_baixar``.
+    """
+    usuario = Usuario.objects.get(pk=usuario_id)
+    with tempfile.TemporaryFile() as temporario:
+        escrever_exportacao(usuario, tipo, formato, filtros, temporario)
+        temporario.seek(0)
+        nome = default_storage.save(
+            f'{DIRETORIO_EXPORTACOES}/{uuid.uuid4().hex}/{nome_arquivo(tipo, formato)}',
+            File(temporario)
+        )
+    return {'arquivo': nome}
+
+
+def limpar_exportacoes(agora=None):
+    """
+    Apaga os arquivos de exportação (e de documentos em lote) gerados há
+    mais de ``EXPORTACOES_VALIDADE_HORAS``. A tarefa fica marcada como
+    expirada para ``exportacao_baixar``. Devolve quantos foram apagados.
+    """
+    agora = agora or timezone.now()
+    validade = datetime.timedelta(
+        hours=getattr(settings, 'EXPORTACOES_VALIDADE_HORAS', EXPORTACOES_VALIDADE_HORAS)
+    )
+    vencidas = Tarefa.objects.filter(
+        status='CONCLUIDA',
+        concluido_em__lt=agora - validade,
+        resultado__arquivo__startswith=f'{DIRETORIO_EXPORTACOES}/',
+    )
+    apagados = 0
+    for tarefa in vencidas.iterator():
+        try:
+            default_storage.delete(tarefa.resultado['arquivo'])
+        except OSError as e:
+            logger.error(f"Erro ao apagar a exportação {tarefa.resultado['arquivo']}: {str(e)}")
+            continue
+        tarefa.resultado = {'expirado': True}
+        tarefa.save(update_fields=['resultado'])
+        apagados += 1
+    return apagados
@@ -0,0 +1,165 @@
+"""
+Escopo e filtros da listagem de vales, compartilhados entre a view
+``valepallet_listar`` e as exportações (que rodam também fora de uma
+requisição, no worker de tarefas e em comandos).
+
+As opções dos selects de filtro (responsável, transportadora e cliente)
+vêm de ``opcoes_filtros``: só ``(id, rótulo)``, no escopo da PJ do usuário
+(staff vê todas), guardadas no cache por escopo. Os receivers no fim do
+módulo (registrados em ``AppControllerConfig.ready``) descartam o escopo
+afetado quando um cliente, transportadora ou PJ é salvo ou removido.
+"""
+import datetime
+
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .busca import busca_vales
+from .models import Cliente, PessoaJuridica, Transportadora, ValePallet
+
+
+# Parâmetros GET da listagem que restringem o resultado
+FILTROS_VALES = (
+    'search', 'estado', 'responsavel', 'transportadora', 'cliente',
+    'data_emissao', 'data_inicio', 'data_fim',
+)
+
+
+def vales_do_usuario(usuario):
+    """Vales visíveis para o usuário (staff vê todos); ``None`` se nenhum"""
+    if usuario.is_staff:
+        return ValePallet.objects.all()
+    if hasattr(usuario, 'pessoa_juridica'):
+        return ValePallet.objects.filter(criado_por=usuario.pessoa_juridica)
+    return None
+
+
+def extrair_filtros(parametros):
+    """Só os filtros da listagem, como dicionário simples (serializável)"""
+    return {campo: parametros.get(campo, '') for campo in FILTROS_VALES if parametros.get(campo)}
+
+
+def filtrar_vales(vales, filtros, ordenar_por_relevancia=True):
+    """
+    Aplica os filtros da listagem. Devolve ``(vales, erros)``; filtros
+    inválidos são ignorados e descritos em ``erros``.
+    """
+    erros = []
+    search = filtros.get('search', '')
+    estado = filtros.get('estado', '')
+    responsavel = filtros.get('responsavel', '')
+    transportadora = filtros.get('transportadora', '')
+    cliente = filtros.get('cliente', '')
+    data_emissao = filtros.get('data_emissao', '')
+    data_inicio = filtros.get('data_inicio', '')
+    data_fim = filtros.get('data_fim', '')
+
+    # Filtro de busca (opcionalmente ordenado por relevância)
+    if search:
+        vales = busca_vales().buscar(vales, search, ordenar_por_relevancia=ordenar_por_relevancia)
+
+    # Filtro por status
+    if estado:
+        vales = vales.filter(estado=estado)
+
+    # Filtro por responsável
+    if responsavel:
+        vales = vales.filter(criado_por_id=responsavel)
+
+    # Filtro por transportadora
+    if transportadora:
+        vales = vales.filter(transportadora_id=transportadora)
+
+    # Filtro por cliente
+    if cliente:
+        vales = vales.filter(cliente_id=cliente)
+
+    # Filtro por data de emissão
+    if data_emissao:
+        hoje = timezone.now().date()
+        if data_emissao == 'today':
+            vales = vales.filter(data_emissao=hoje)
+        elif data_emissao == 'week':
+            semana_passada = hoje - datetime.timedelta(days=7)
+            vales = vales.filter(data_emissao__range=[semana_passada, hoje])
+        elif data_emissao == 'month':
+            mes_passado = hoje - datetime.timedelta(days=30)
+            vales = vales.filter(data_emissao__range=[mes_passado, hoje])
+        elif data_emissao == 'custom' and data_inicio and data_fim:
+            try:
+                # Converter strings para objetos date
+                data_inicio_obj = datetime.datetime.strptime(data_inicio, '%Y-%m-%d').date()
+                data_fim_obj = datetime.datetime.strptime(data_fim, '%Y-%m-%d').date()
+                vales = vales.filter(data_emissao__range=[data_inicio_obj, data_fim_obj])
+            except ValueError:
+                erros.append('Formato de data inválido')
+
+    return vales, erros
+
+
+# ==============================================
+# OPÇÕES DOS FILTROS
+# ==============================================
+# O cache padrão pode ser local ao processo: o TTL limita quanto tempo outro
+# worker mostra opções antigas (com cache compartilhado, a invalidação vale
+# para todos na hora)
+TTL_OPCOES_FILTROS = 300
+TODOS = 'todos'
+
+
+def _chave_opcoes(escopo):
+    return f'filtros_vales:{escopo}'
+
+
+def _montar_opcoes(pessoa_juridica):
+    if pessoa_juridica is None:
+        responsaveis = PessoaJuridica.objects.all()
+        transportadoras = Transportadora.objects.all()
+        clientes = Cliente.objects.all()
+    else:
+        responsaveis = PessoaJuridica.objects.filter(pk=pessoa_juridica.pk)
+        transportadoras = Transportadora.objects.filter(criado_por=pessoa_juridica)
+        clientes = Cliente.objects.filter(criado_por=pessoa_juridica)
+    return {
+        'responsaveis': list(responsaveis.order_by('razao_social', 'id').values_list('id', 'razao_social')),
+        'transportadoras': list(transportadoras.order_by('nome', 'id').values_list('id', 'nome')),
+        'clientes': list(clientes.order_by('nome', 'id').values_list('id', 'nome')),
+    }
+
+
+def opcoes_filtros(usuario):
+    """
+    ``{'responsaveis', 'transportadoras', 'clientes'}``, cada um uma lista de
+    ``(id, rótulo)``, para os selects de filtro da listagem de vales.
+    """
+    pessoa_juridica = None if usuario.is_staff else getattr(usuario, 'pessoa_juridica', None)
+    if not usuario.is_staff and pessoa_juridica is None:
+        return {'responsaveis': [], 'transportadoras': [], 'clientes': []}
+
+    chave = _chave_opcoes(TODOS if pessoa_juridica is None else pessoa_juridica.pk)
+    opcoes = cache.get(chave)
+    if opcoes is None:
+        opcoes = _montar_opcoes(pessoa_juridica)
+        cache.set(chave, opcoes, TTL_OPCOES_FILTROS)
+    return opcoes
+
+
+def limpar_opcoes_filtros(pessoa_juridica_id=None):
+    """Descarta as opções do escopo da PJ (e do staff, que vê todas)"""
+    chaves = [_chave_opcoes(TODOS)]
+    if pessoa_juridica_id is not None:
+        chaves.append(_chave_opcoes(pessoa_juridica_id))
+    cache.delete_many(chaves)
+
+
+@receiver([post_save, post_delete], sender=Cliente)
+@receiver([post_save, post_delete], sender=Transportadora)
+def _cadastro_alterado(sender, instance, **kwargs):
+    limpar_opcoes_filtros(instance.criado_por_id)
+
+
+@receiver([post_save, post_delete], sender=PessoaJuridica)
+def _pessoa_juridica_alterada(sender, instance, **kwargs):
+    limpar_opcoes_filtros(instance.pk)
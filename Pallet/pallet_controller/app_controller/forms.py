@@ -4,6 +4,8 @@ from django.utils import timezone
 from .models import Cliente, Motorista, Transportadora, ValePallet, Movimentacao, Usuario, PessoaJuridica
 from django.core.exceptions import ValidationError
 from django.contrib.auth import get_user_model
+from django.urls import reverse
+from .listagens import CADASTROS, PESSOAS_JURIDICAS, rotulo_cadastro
 
 # ===== CONSTANTES DE VALIDAÇÃO =====
 CNPJ_REGEX = r'^\d{2}\.\d{3}\.\d{3}/\d{4}-\d{2}$'
@@ -378,6 +380,33 @@ class TransportadoraForm(forms.ModelForm):
         return instance
 
 
+class SelectAutocompletar(forms.Select):
+    """
+    ``<select>`` que renderiza só a opção escolhida; as demais são buscadas
+    na API ``autocompletar`` enquanto o usuário digita (js/autocompletar.js).
+    """
+
+    def __init__(self, tipo, attrs=None):
+        super().__init__(attrs)
+        self.tipo = tipo
+
+    def get_context(self, name, value, attrs):
+        attrs = {**(attrs or {}), 'data-autocompletar': reverse('autocompletar', args=[self.tipo])}
+        return super().get_context(name, value, attrs)
+
+    def optgroups(self, name, value, attrs=None):
+        escolhidos = [valor for valor in value if str(valor).isdigit()]
+        opcoes = [self.create_option(name, '', 'Digite para buscar...', not escolhidos, 0)]
+        if escolhidos:
+            cadastro = PESSOAS_JURIDICAS if self.tipo == 'pessoas_juridicas' else CADASTROS[self.tipo]
+            linhas = self.choices.queryset.filter(pk__in=escolhidos).values_list(
+                'id', cadastro.nome, cadastro.documento
+            )
+            for indice, (id, nome, documento) in enumerate(linhas, start=1):
+                opcoes.append(self.create_option(name, str(id), rotulo_cadastro(nome, documento), True, indice))
+        return [(None, opcoes, 0)]
+
+
 class ValePalletForm(forms.ModelForm):
     data_validade = forms.DateField(
         widget=forms.DateInput(attrs={
@@ -393,7 +422,14 @@ class ValePalletForm(forms.ModelForm):
         self.user = kwargs.pop('user', None)
         super().__init__(*args, **kwargs)
         
-        if self.user and hasattr(self.user, 'pessoa_juridica'): 
+        if self.user and self.user.is_staff:
+            # Staff escolhe entre todos os cadastros; as opções vêm do autocompletar
+            self.fields['cliente'].queryset = Cliente.objects.all()
+            self.fields['motorista'].queryset = Motorista.objects.all()
+            self.fields['transportadora'].queryset = Transportadora.objects.all()
+            self.fields['criado_por'].queryset = PessoaJuridica.objects.all()
+            self.fields['criado_por'].required = False
+        elif self.user and hasattr(self.user, 'pessoa_juridica'): 
             pj = self.user.pessoa_juridica #Aqui é para usuarios PJ
             self.fields['cliente'].queryset = Cliente.objects.filter(criado_por=pj).order_by('nome')
             self.fields['motorista'].queryset = Motorista.objects.filter(criado_por=pj).order_by('nome')
@@ -415,6 +451,10 @@ class ValePalletForm(forms.ModelForm):
         fields = ['numero_vale', 'cliente', 'motorista', 'transportadora', 
                 'data_validade', 'qtd_pbr', 'qtd_chepp','criado_por']
         widgets = {
+            'cliente': SelectAutocompletar('clientes'),
+            'motorista': SelectAutocompletar('motoristas'),
+            'transportadora': SelectAutocompletar('transportadoras'),
+            'criado_por': SelectAutocompletar('pessoas_juridicas'),
             'numero_vale': forms.NumberInput(attrs={
                 'class': 'form-control',
                 'placeholder': 'Use um Numerador para Identificar Ticket'
@@ -0,0 +1,192 @@
+"""
+Importação em massa de clientes, motoristas e transportadoras (CSV/XLSX).
+
+O arquivo inteiro é normalizado e validado numa passada só (CPF/CNPJ com
+dígitos verificadores, telefone e e-mail), os documentos já cadastrados
+são buscados em blocos com ``documento IN (...)`` e as linhas válidas são
+inseridas com ``bulk_create``. Linhas com erro não impedem a importação
+das demais: elas voltam no relatório, com o número da linha na planilha.
+"""
+import re
+from dataclasses import dataclass, field
+
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction
+from validate_docbr import CNPJ, CPF
+
+from .filtros import limpar_opcoes_filtros
+from .models import Cliente, Motorista, Transportadora
+
+
+TAMANHO_BLOCO = 1000
+LIMITE_LINHAS = 100000
+
+# Tipo -> (modelo, campo do documento)
+CADASTROS = {
+    'clientes': (Cliente, 'cnpj'),
+    'motoristas': (Motorista, 'cpf'),
+    'transportadoras': (Transportadora, 'cnpj'),
+}
+
+_NAO_DIGITOS = re.compile(r'\D')
+
+
+@dataclass
+class RelatorioImportacao:
+    total: int = 0
+    importados: int = 0
+    # {'linha': n, 'documento': ..., 'erros': [...]}
+    erros: list = field(default_factory=list)
+
+    def as_dict(self):
+        return {'total': self.total, 'importados': self.importados, 'erros': self.erros}
+
+
+# ==============================================
+# NORMALIZAÇÃO
+# ==============================================
+def _digitos(valor, tamanho=None):
+    """
+    Só os dígitos do valor. Com ``tamanho`` (CPF/CNPJ), uma célula numérica
+    mais curta é completada com zeros à esquerda, que as planilhas costumam
+    perder; telefones nunca começam com zero e não são completados.
+    """
+    if isinstance(valor, float) and valor.is_integer():
+        valor = int(valor)
+    digitos = _NAO_DIGITOS.sub('', str(valor or ''))
+    if tamanho and digitos and len(digitos) < tamanho and isinstance(valor, int):
+        digitos = digitos.zfill(tamanho)
+    return digitos
+
+
+def formatar_cnpj(digitos):
+    return f'{digitos[:2]}.{digitos[2:5]}.{digitos[5:8]}/{digitos[8:12]}-{digitos[12:]}'
+
+
+def formatar_cpf(digitos):
+    return f'{digitos[:3]}.{digitos[3:6]}.{digitos[6:9]}-{digitos[9:]}'
+
+
+def formatar_telefone(digitos):
+    if len(digitos) == 11:
+        return f'({digitos[:2]}) {digitos[2:7]}-{digitos[7:]}'
+    return f'({digitos[:2]}) {digitos[2:6]}-{digitos[6:]}'
+
+
+# Campo do documento -> (tamanho, validador, formatação)
+DOCUMENTOS = {
+    'cnpj': (14, CNPJ(), formatar_cnpj),
+    'cpf': (11, CPF(), formatar_cpf),
+}
+
+
+def _campo(linha, nome):
+    """Valor de uma coluna, sem diferenciar maiúsculas no cabeçalho"""
+    for chave, valor in linha.items():
+        if str(chave).strip().lower() == nome:
+            return valor
+    return None
+
+
+def _validar_linha(linha, documento):
+    """Devolve ``(dados, erros)`` de uma linha da planilha"""
+    erros = []
+    tamanho, validador, formatar = DOCUMENTOS[documento]
+
+    nome = str(_campo(linha, 'nome') or '').strip()
+    if not nome:
+        erros.append('nome: obrigatório')
+    elif len(nome) > 255:
+        erros.append('nome: muito longo')
+
+    digitos = _digitos(_campo(linha, documento), tamanho)
+    if len(digitos) != tamanho or not validador.validate(digitos):
+        erros.append(f'{documento}: {documento.upper()} inválido')
+
+    telefone = _digitos(_campo(linha, 'telefone'))
+    if len(telefone) not in (10, 11):
+        erros.append('telefone: informe DDD + número (10 ou 11 dígitos)')
+
+    email = str(_campo(linha, 'email') or '').strip() or None
+    if email:
+        try:
+            validate_email(email)
+        except ValidationError:
+            erros.append('email: e-mail inválido')
+
+    if erros:
+        return None, erros
+    return {
+        'nome': nome,
+        documento: formatar(digitos),
+        'telefone': formatar_telefone(telefone),
+        'email': email,
+    }, []
+
+
+# ==============================================
+# IMPORTAÇÃO
+# ==============================================
+def _documentos_existentes(modelo, documento, valores):
+    """Documentos já cadastrados, buscados em blocos (usa o índice único)"""
+    valores = list(valores)
+    existentes = set()
+    for inicio in range(0, len(valores), TAMANHO_BLOCO * 5):
+        bloco = valores[inicio:inicio + TAMANHO_BLOCO * 5]
+        existentes.update(
+            modelo.objects.filter(**{f'{documento}__in': bloco}).values_list(documento, flat=True)
+        )
+    return existentes
+
+
+def importar_cadastros(tipo, linhas, pessoa_juridica=None):
+    """
+    Importa as ``linhas`` (dicionários com nome, documento, telefone e
+    email) como cadastros do ``tipo`` da PJ informada.
+    """
+    modelo, documento = CADASTROS[tipo]
+    relatorio = RelatorioImportacao(total=len(linhas))
+    if len(linhas) > LIMITE_LINHAS:
+        relatorio.erros.append({'linha': 0, 'documento': None, 'erros': [f'Máximo de {LIMITE_LINHAS} linhas']})
+        return relatorio
+
+    validos = []
+    vistos = {}
+    # Linha 1 da planilha é o cabeçalho
+    for posicao, linha in enumerate(linhas, start=2):
+        dados, erros = _validar_linha(linha, documento)
+        if dados is not None:
+            anterior = vistos.setdefault(dados[documento], posicao)
+            if anterior != posicao:
+                erros = [f'{documento}: repetido na planilha (linha {anterior})']
+        if erros:
+            relatorio.erros.append({
+                'linha': posicao,
+                'documento': str(_campo(linha, documento) or ''),
+                'erros': erros,
+            })
+            continue
+        validos.append((posicao, dados))
+
+    existentes = _documentos_existentes(modelo, documento, (dados[documento] for _, dados in validos))
+
+    novos = []
+    for posicao, dados in validos:
+        if dados[documento] in existentes:
+            relatorio.erros.append({
+                'linha': posicao,
+                'documento': dados[documento],
+                'erros': [f'{documento}: já cadastrado'],
+            })
+            continue
+        novos.append(modelo(criado_por=pessoa_juridica, **dados))
+
+    with transaction.atomic():
+        modelo.objects.bulk_create(novos, batch_size=TAMANHO_BLOCO)
+    if novos:
+        # bulk_create não dispara post_save
+        limpar_opcoes_filtros(pessoa_juridica.pk if pessoa_juridica else None)
+    relatorio.importados = len(novos)
+    relatorio.erros.sort(key=lambda erro: erro['linha'])
+    return relatorio
@@ -0,0 +1,158 @@
+"""
+Listagens e autocompletar de cadastros (clientes, motoristas e transportadoras).
+
+As três listagens usam o mesmo mecanismo: escopo por PJ (staff vê todos),
+busca por prefixo do nome ou do documento, ordenação por coluna e
+paginação por cursor (``paginacao.py``), de modo que o custo de uma página
+não depende do tamanho do cadastro.
+
+A busca por nome usa ``istartswith``, coberto no PostgreSQL pelos índices
+``UPPER(nome) text_pattern_ops`` da migração 0020. CNPJ e CPF são gravados
+com máscara, então a busca por documento formata os dígitos digitados e
+usa ``startswith``, coberto pelo índice ``_like`` que o Django cria para
+campos ``unique``.
+
+Os campos de cadastro do formulário de vale não trazem mais o catálogo
+inteiro: as opções vêm de ``autocompletar_cadastros`` (mesma busca, no
+máximo ``LIMITE_AUTOCOMPLETAR`` linhas, só ``id`` e rótulo).
+"""
+import re
+from typing import NamedTuple
+
+from .models import Cliente, Motorista, PessoaJuridica, Transportadora
+from .paginacao import paginar_por_cursor
+
+
+POR_PAGINA = 50
+LIMITE_CONTAGEM = 1000
+LIMITE_AUTOCOMPLETAR = 20
+
+ORDENS = ('nome', '-nome', 'documento', '-documento')
+
+
+class Cadastro(NamedTuple):
+    modelo: type
+    documento: str
+    mascara: str
+    nome: str = 'nome'
+
+
+CADASTROS = {
+    'clientes': Cadastro(Cliente, 'cnpj', '00.000.000/0000-00'),
+    'motoristas': Cadastro(Motorista, 'cpf', '000.000.000-00'),
+    'transportadoras': Cadastro(Transportadora, 'cnpj', '00.000.000/0000-00'),
+}
+
+# Só para o staff escolher o dono do vale (sem escopo por PJ)
+PESSOAS_JURIDICAS = Cadastro(PessoaJuridica, 'cnpj', '00.000.000/0000-00', nome='razao_social')
+
+
+def cadastros_do_usuario(usuario, tipo):
+    """Cadastros ``tipo`` visíveis para o usuário (staff vê todos); ``None`` se nenhum"""
+    modelo = CADASTROS[tipo].modelo
+    if usuario.is_staff:
+        return modelo.objects.all()
+    if hasattr(usuario, 'pessoa_juridica'):
+        return modelo.objects.filter(criado_por=usuario.pessoa_juridica)
+    return None
+
+
+def prefixo_documento(digitos, mascara):
+    """
+    Prefixo já com a máscara para os ``digitos`` digitados (``'1234'`` vira
+    ``'12.34'`` num CNPJ); ``None`` se houver mais dígitos que a máscara.
+    """
+    if len(digitos) > mascara.count('0'):
+        return None
+    prefixo = []
+    restantes = iter(digitos)
+    for caractere in mascara:
+        if caractere != '0':
+            prefixo.append(caractere)
+            continue
+        digito = next(restantes, None)
+        if digito is None:
+            break
+        prefixo.append(digito)
+    return ''.join(prefixo)
+
+
+def buscar_cadastros(cadastros, cadastro, termo):
+    """Filtra por prefixo do documento (se o termo só tem dígitos e pontuação) ou do nome"""
+    termo = termo.strip()
+    if not termo:
+        return cadastros
+    digitos = re.sub(r'\D', '', termo)
+    if digitos and re.fullmatch(r'[\d.\-/\s]+', termo):
+        prefixo = prefixo_documento(digitos, cadastro.mascara)
+        if prefixo is None:
+            return cadastros.none()
+        return cadastros.filter(**{f'{cadastro.documento}__startswith': prefixo})
+    return cadastros.filter(**{f'{cadastro.nome}__istartswith': termo})
+
+
+def ordenacao_cadastros(cadastro, ordem):
+    """Ordenação de paginação (terminando em ``id``) para a coluna escolhida"""
+    campo = cadastro.documento if ordem.lstrip('-') == 'documento' else cadastro.nome
+    if ordem.startswith('-'):
+        return (f'-{campo}', '-id')
+    return (campo, 'id')
+
+
+def listar_cadastros(usuario, tipo, parametros):
+    """
+    Página da listagem ``tipo`` conforme os parâmetros ``busca``, ``ordem`` e
+    ``cursor``. Devolve ``(pagina, busca, ordem)``, ou ``None`` se o usuário
+    não tem acesso.
+    """
+    cadastros = cadastros_do_usuario(usuario, tipo)
+    if cadastros is None:
+        return None
+
+    cadastro = CADASTROS[tipo]
+    busca = parametros.get('busca', '').strip()
+    ordem = parametros.get('ordem', 'nome')
+    if ordem not in ORDENS:
+        ordem = 'nome'
+
+    pagina = paginar_por_cursor(
+        buscar_cadastros(cadastros, cadastro, busca),
+        parametros.get('cursor'),
+        por_pagina=POR_PAGINA,
+        ordenacao=ordenacao_cadastros(cadastro, ordem),
+        limite_contagem=LIMITE_CONTAGEM,
+    )
+    return pagina, busca, ordem
+
+
+# ==============================================
+# AUTOCOMPLETAR
+# ==============================================
+def rotulo_cadastro(nome, documento):
+    return f'{nome} - {documento}'
+
+
+def _opcoes(cadastros, cadastro, termo, limite):
+    linhas = (
+        buscar_cadastros(cadastros, cadastro, termo)
+        .order_by(cadastro.nome, 'id')
+        .values_list('id', cadastro.nome, cadastro.documento)[:limite]
+    )
+    return [{'id': id, 'texto': rotulo_cadastro(nome, documento)} for id, nome, documento in linhas]
+
+
+def autocompletar_cadastros(usuario, tipo, termo, limite=LIMITE_AUTOCOMPLETAR):
+    """
+    Opções ``{'id', 'texto'}`` de ``tipo`` que começam com ``termo`` (nome
+    ou documento), no escopo do usuário; ``None`` se ele não tem acesso.
+    ``tipo`` ``pessoas_juridicas`` é só para staff.
+    """
+    if tipo == 'pessoas_juridicas':
+        if not usuario.is_staff:
+            return None
+        return _opcoes(PessoaJuridica.objects.all(), PESSOAS_JURIDICAS, termo, limite)
+
+    cadastros = cadastros_do_usuario(usuario, tipo)
+    if cadastros is None:
+        return None
+    return _opcoes(cadastros, CADASTROS[tipo], termo, limite)
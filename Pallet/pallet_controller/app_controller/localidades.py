@@ -0,0 +1,156 @@
+"""
+Estados e municípios do IBGE para os selects do cadastro.
+
+Os dados ficam nas tabelas ``Estado`` e ``Municipio``, atualizadas com
+``manage.py atualizar_localidades`` (uma única chamada à API de localidades
+do IBGE). As respostas das APIs ``listar_estados_api`` e
+``listar_municipios_api`` são montadas uma vez por processo, já em JSON e
+com ETag, e renovadas a cada ``TTL_MEMORIA`` segundos; assim a página de
+cadastro não faz nenhuma chamada externa. Se as tabelas estiverem vazias
+(instalação nova), a primeira consulta as preenche a partir do IBGE.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from typing import NamedTuple
+
+import requests
+from asgiref.sync import sync_to_async
+from django.db import transaction
+
+from .consultas import Disjuntor, ServicoIndisponivel, sessao_http
+from .models import Estado, Municipio
+
+
+logger = logging.getLogger(__name__)
+
+URL_LOCALIDADES = 'https://servicodados.ibge.gov.br/api/v1/localidades/municipios?view=nivelado'
+TIMEOUT_LOCALIDADES = (5, 60)
+TTL_MEMORIA = 3600
+TAMANHO_BLOCO = 1000
+
+disjuntor_ibge = Disjuntor('ibge', limite_falhas=3, pausa=300)
+
+
+class RespostaLocalidades(NamedTuple):
+    conteudo: bytes
+    etag: str
+
+
+# ==============================================
+# ATUALIZAÇÃO
+# ==============================================
+def _baixar_localidades():
+    try:
+        response = sessao_http().get(URL_LOCALIDADES, timeout=TIMEOUT_LOCALIDADES)
+        response.raise_for_status()
+        dados = response.json()
+    except ValueError as e:
+        raise ServicoIndisponivel(f'ibge: resposta inválida ({e})') from e
+    except requests.exceptions.RequestException as e:
+        raise ServicoIndisponivel(f'ibge: {e}') from e
+
+    estados, municipios = {}, []
+    for item in dados:
+        estados[item['UF-id']] = Estado(id=item['UF-id'], sigla=item['UF-sigla'], nome=item['UF-nome'])
+        municipios.append(Municipio(id=item['municipio-id'], nome=item['municipio-nome'], estado_id=item['UF-id']))
+    if not estados:
+        raise ServicoIndisponivel('ibge: nenhuma localidade retornada')
+    return list(estados.values()), municipios
+
+
+def atualizar_localidades():
+    """Baixa estados e municípios do IBGE e sincroniza as tabelas"""
+    estados, municipios = disjuntor_ibge.chamar(_baixar_localidades)
+
+    with transaction.atomic():
+        Estado.objects.bulk_create(
+            estados, update_conflicts=True, unique_fields=['id'], update_fields=['sigla', 'nome']
+        )
+        Municipio.objects.bulk_create(
+            municipios, batch_size=TAMANHO_BLOCO,
+            update_conflicts=True, unique_fields=['id'], update_fields=['nome', 'estado']
+        )
+        Municipio.objects.exclude(id__in=[municipio.id for municipio in municipios]).delete()
+        Estado.objects.exclude(id__in=[estado.id for estado in estados]).delete()
+
+    limpar_cache_localidades()
+    return len(estados), len(municipios)
+
+
+# ==============================================
+# RESPOSTAS EM MEMÓRIA
+# ==============================================
+_respostas = {}
+_carregado_em = 0.0
+_lock = threading.RLock()
+
+
+def _resposta(dados):
+    conteudo = json.dumps(dados, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return RespostaLocalidades(conteudo, hashlib.sha256(conteudo).hexdigest()[:32])
+
+
+def _montar_respostas():
+    estados = list(Estado.objects.order_by('nome').values_list('sigla', 'nome'))
+    if not estados:
+        logger.error("Tabelas de localidades vazias; carregando do IBGE")
+        atualizar_localidades()
+        estados = list(Estado.objects.order_by('nome').values_list('sigla', 'nome'))
+
+    por_uf = {sigla: [] for sigla, _ in estados}
+    for id_municipio, nome, sigla in Municipio.objects.order_by('nome').values_list('id', 'nome', 'estado__sigla'):
+        por_uf[sigla].append({'id': id_municipio, 'nome': nome})
+
+    return {
+        'estados': _resposta({'estados': [{'sigla': sigla, 'nome': nome} for sigla, nome in estados]}),
+        'municipios': {sigla: _resposta({'municipios': municipios}) for sigla, municipios in por_uf.items()},
+    }
+
+
+def _respostas_atuais():
+    global _respostas, _carregado_em
+    if _em_memoria():
+        return _respostas
+    with _lock:
+        if not _respostas or time.monotonic() - _carregado_em >= TTL_MEMORIA:
+            _respostas = _montar_respostas()
+            _carregado_em = time.monotonic()
+    return _respostas
+
+
+def _em_memoria():
+    return _respostas and time.monotonic() - _carregado_em < TTL_MEMORIA
+
+
+async def _arespostas_atuais():
+    # Com as respostas em memória não há por que passar pela thread do ORM
+    if _em_memoria():
+        return _respostas
+    return await sync_to_async(_respostas_atuais)()
+
+
+def resposta_estados():
+    """JSON ``{"estados": [...]}`` já serializado, com ETag"""
+    return _respostas_atuais()['estados']
+
+
+def resposta_municipios(uf):
+    """JSON ``{"municipios": [...]}`` da UF, ou ``None`` se ela não existe"""
+    return _respostas_atuais()['municipios'].get(uf.upper())
+
+
+async def aresposta_estados():
+    return (await _arespostas_atuais())['estados']
+
+
+async def aresposta_municipios(uf):
+    return (await _arespostas_atuais())['municipios'].get(uf.upper())
+
+
+def limpar_cache_localidades():
+    global _respostas
+    with _lock:
+        _respostas = {}
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app_controller.consultas import ServicoIndisponivel
+from app_controller.localidades import atualizar_localidades
+
+
+class Command(BaseCommand):
+    help = 'Atualiza as tabelas de estados e municípios a partir da API de localidades do IBGE'
+
+    def handle(self, *args, **options):
+        try:
+            estados, municipios = atualizar_localidades()
+        except ServicoIndisponivel as e:
+            raise CommandError(f'Não foi possível consultar o IBGE: {e}')
+
+        self.stdout.write(self.style.SUCCESS(f'{estados} estado(s) e {municipios} município(s) atualizados.'))
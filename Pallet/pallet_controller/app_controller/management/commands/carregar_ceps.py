@@ -0,0 +1,77 @@
+import csv
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from app_controller.consultas import limpar_cache_ceps
+from app_controller.models import Cep
+
+
+TAMANHO_BLOCO = 5000
+
+# Nomes de coluna aceitos além dos campos do modelo (dumps no formato do ViaCEP)
+SINONIMOS = {
+    'localidade': 'cidade',
+    'municipio': 'cidade',
+    'estado': 'uf',
+    'ibge': 'codigo_ibge',
+}
+CAMPOS = ('logradouro', 'complemento', 'bairro', 'cidade', 'uf', 'codigo_ibge')
+
+
+class Command(BaseCommand):
+    help = 'Carrega (ou atualiza) a base local de CEPs a partir de um arquivo CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'arquivo',
+            help='CSV com cabeçalho: cep, logradouro, complemento, bairro, cidade (ou localidade), uf, codigo_ibge (ou ibge)'
+        )
+        parser.add_argument('--separador', default=';', help='Separador de colunas (padrão: ;)')
+        parser.add_argument('--encoding', default='utf-8-sig', help='Codificação do arquivo (padrão: utf-8)')
+
+    def handle(self, *args, **options):
+        try:
+            arquivo = open(options['arquivo'], newline='', encoding=options['encoding'])
+        except OSError as e:
+            raise CommandError(f'Não foi possível abrir {options["arquivo"]}: {e}')
+
+        carregados = ignorados = 0
+        bloco = []
+        with arquivo:
+            leitor = csv.DictReader(arquivo, delimiter=options['separador'])
+            colunas = {
+                coluna: SINONIMOS.get(coluna.strip().lower(), coluna.strip().lower())
+                for coluna in leitor.fieldnames or []
+            }
+            if 'cep' not in colunas.values() or 'cidade' not in colunas.values() or 'uf' not in colunas.values():
+                raise CommandError('O arquivo precisa das colunas cep, cidade e uf')
+
+            for linha in leitor:
+                dados = {colunas[coluna]: (valor or '').strip() for coluna, valor in linha.items() if coluna in colunas}
+                cep = re.sub(r'\D', '', dados.get('cep', ''))
+                if len(cep) != 8 or not dados.get('cidade') or len(dados.get('uf', '')) != 2:
+                    ignorados += 1
+                    continue
+                bloco.append(Cep(cep=cep, origem='ARQUIVO', **{campo: dados.get(campo, '') for campo in CAMPOS}))
+                if len(bloco) >= TAMANHO_BLOCO:
+                    carregados += self._gravar(bloco)
+                    bloco = []
+            if bloco:
+                carregados += self._gravar(bloco)
+
+        limpar_cache_ceps()
+        self.stdout.write(self.style.SUCCESS(f'{carregados} CEP(s) carregado(s); {ignorados} linha(s) ignorada(s).'))
+
+    def _gravar(self, bloco):
+        # Um CEP repetido no mesmo INSERT ... ON CONFLICT falha no PostgreSQL
+        bloco = list({cep.cep: cep for cep in bloco}.values())
+        with transaction.atomic():
+            Cep.objects.bulk_create(
+                bloco,
+                update_conflicts=True,
+                unique_fields=['cep'],
+                update_fields=[*CAMPOS, 'origem', 'atualizado_em'],
+            )
+        return len(bloco)
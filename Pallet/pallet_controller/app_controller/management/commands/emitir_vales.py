@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app_controller.emissao import LoteInvalido, emitir_vales, ler_linhas
+from app_controller.models import PessoaJuridica, Usuario
+
+
+class Command(BaseCommand):
+    help = 'Emite vales em lote a partir de um arquivo CSV ou JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('arquivo', help='Arquivo .csv ou .json com os vales')
+        parser.add_argument(
+            '--usuario',
+            required=True,
+            help='Usuário responsável pela emissão (username)'
+        )
+        parser.add_argument(
+            '--pj',
+            type=int,
+            help='Id da pessoa jurídica dos vales (padrão: a PJ do usuário)'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            usuario = Usuario.objects.get(username=options['usuario'])
+        except Usuario.DoesNotExist:
+            raise CommandError(f"Usuário {options['usuario']} não encontrado")
+
+        pessoa_juridica = getattr(usuario, 'pessoa_juridica', None)
+        if options['pj'] is not None:
+            if not usuario.is_staff:
+                raise CommandError('Apenas staff pode emitir vales para outra pessoa jurídica')
+            pessoa_juridica = PessoaJuridica.objects.filter(pk=options['pj']).first()
+            if pessoa_juridica is None:
+                raise CommandError(f"Pessoa jurídica {options['pj']} não encontrada")
+        elif pessoa_juridica is None and not usuario.is_staff:
+            raise CommandError('Usuário não está associado a uma pessoa jurídica')
+
+        formato = 'json' if options['arquivo'].lower().endswith('.json') else 'csv'
+        with open(options['arquivo'], 'rb') as arquivo:
+            conteudo = arquivo.read()
+
+        try:
+            vales = emitir_vales(ler_linhas(conteudo, formato), usuario, pessoa_juridica)
+        except LoteInvalido as e:
+            for erro in e.erros:
+                self.stderr.write(f"Linha {erro['linha']}: {'; '.join(erro['erros'])}")
+            raise CommandError(f'Nenhum vale emitido: {e}')
+
+        self.stdout.write(self.style.SUCCESS(f'{len(vales)} vale(s) emitido(s).'))
@@ -0,0 +1,57 @@
+from django.core.exceptions import PermissionDenied
+from django.core.management.base import BaseCommand, CommandError
+
+from app_controller.exportacao import COLUNAS, escrever_exportacao
+from app_controller.filtros import FILTROS_VALES
+from app_controller.models import Usuario
+from app_controller.planilhas import xlsx_disponivel
+
+
+class Command(BaseCommand):
+    help = 'Exporta vales ou movimentações para CSV/XLSX, com os filtros da listagem de vales'
+
+    def add_arguments(self, parser):
+        parser.add_argument('saida', help='Arquivo de saída (.csv ou .xlsx)')
+        parser.add_argument(
+            '--tipo',
+            choices=sorted(COLUNAS),
+            default='vales',
+            help='O que exportar (padrão: vales)'
+        )
+        parser.add_argument(
+            '--usuario',
+            required=True,
+            help='Usuário cujo escopo de vales é exportado (staff exporta tudo)'
+        )
+        parser.add_argument(
+            '--filtro',
+            action='append',
+            default=[],
+            metavar='CAMPO=VALOR',
+            help=f"Filtro da listagem ({', '.join(FILTROS_VALES)}); pode repetir"
+        )
+
+    def handle(self, *args, **options):
+        formato = 'xlsx' if options['saida'].lower().endswith('.xlsx') else 'csv'
+        if formato == 'xlsx' and not xlsx_disponivel():
+            raise CommandError('Exportação XLSX requer o pacote openpyxl')
+
+        try:
+            usuario = Usuario.objects.get(username=options['usuario'])
+        except Usuario.DoesNotExist:
+            raise CommandError(f"Usuário {options['usuario']} não encontrado")
+
+        filtros = {}
+        for filtro in options['filtro']:
+            campo, _, valor = filtro.partition('=')
+            if campo not in FILTROS_VALES:
+                raise CommandError(f'Filtro desconhecido: {campo}')
+            filtros[campo] = valor
+
+        try:
+            with open(options['saida'], 'wb') as arquivo:
+                escrever_exportacao(usuario, options['tipo'], formato, filtros, arquivo)
+        except PermissionDenied:
+            raise CommandError('Usuário sem acesso a vales (não é staff nem pessoa jurídica)')
+
+        self.stdout.write(self.style.SUCCESS(f"Exportação gravada em {options['saida']}."))
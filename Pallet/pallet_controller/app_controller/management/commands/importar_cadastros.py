@@ -0,0 +1,70 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app_controller.importacao import CADASTROS, importar_cadastros
+from app_controller.models import PessoaJuridica, Usuario
+from app_controller.planilhas import ler_planilha, xlsx_disponivel
+
+
+class Command(BaseCommand):
+    help = 'Importa clientes, motoristas ou transportadoras de uma planilha CSV ou XLSX'
+
+    def add_arguments(self, parser):
+        parser.add_argument('tipo', choices=sorted(CADASTROS))
+        parser.add_argument('arquivo', help='Planilha .csv ou .xlsx (colunas nome, cnpj/cpf, telefone, email)')
+        parser.add_argument(
+            '--usuario',
+            required=True,
+            help='Usuário responsável pela importação (username)'
+        )
+        parser.add_argument(
+            '--pj',
+            type=int,
+            help='Id da pessoa jurídica dos cadastros (padrão: a PJ do usuário)'
+        )
+        parser.add_argument(
+            '--relatorio',
+            help='Grava as linhas com erro neste arquivo CSV'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            usuario = Usuario.objects.get(username=options['usuario'])
+        except Usuario.DoesNotExist:
+            raise CommandError(f"Usuário {options['usuario']} não encontrado")
+
+        pessoa_juridica = getattr(usuario, 'pessoa_juridica', None)
+        if options['pj'] is not None:
+            if not usuario.is_staff:
+                raise CommandError('Apenas staff pode importar cadastros para outra pessoa jurídica')
+            pessoa_juridica = PessoaJuridica.objects.filter(pk=options['pj']).first()
+            if pessoa_juridica is None:
+                raise CommandError(f"Pessoa jurídica {options['pj']} não encontrada")
+        elif pessoa_juridica is None and not usuario.is_staff:
+            raise CommandError('Usuário não está associado a uma pessoa jurídica')
+
+        if options['arquivo'].lower().endswith('.xlsx') and not xlsx_disponivel():
+            raise CommandError('Importação XLSX requer o pacote openpyxl; use CSV')
+
+        with open(options['arquivo'], 'rb') as arquivo:
+            linhas = ler_planilha(arquivo.read(), options['arquivo'])
+
+        relatorio = importar_cadastros(options['tipo'], linhas, pessoa_juridica)
+
+        if options['relatorio'] and relatorio.erros:
+            with open(options['relatorio'], 'w', newline='', encoding='utf-8-sig') as saida:
+                escritor = csv.writer(saida, delimiter=';')
+                escritor.writerow(['Linha', 'Documento', 'Erros'])
+                for erro in relatorio.erros:
+                    escritor.writerow([erro['linha'], erro['documento'], '; '.join(erro['erros'])])
+
+        for erro in relatorio.erros[:20]:
+            self.stderr.write(f"Linha {erro['linha']}: {'; '.join(erro['erros'])}")
+        if len(relatorio.erros) > 20:
+            self.stderr.write(f'... e mais {len(relatorio.erros) - 20} linha(s) com erro')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{relatorio.importados} de {relatorio.total} cadastro(s) importado(s); '
+            f'{len(relatorio.erros)} linha(s) com erro.'
+        ))
@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from app_controller.exportacao import limpar_exportacoes
+from app_controller.tarefas import processar_pendentes
+
+
+# Segundos entre duas limpezas de exportações vencidas
+INTERVALO_LIMPEZA = 3600
+
+
+class Command(BaseCommand):
+    help = 'Worker da fila de tarefas em segundo plano (exportações, PDFs...)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--uma-vez',
+            action='store_true',
+            help='Processa as tarefas disponíveis e encerra'
+        )
+        parser.add_argument(
+            '--intervalo',
+            type=float,
+            default=2.0,
+            help='Segundos de espera quando a fila está vazia (padrão: 2)'
+        )
+
+    def handle(self, *args, **options):
+        if options['uma_vez']:
+            total = processar_pendentes()
+            apagados = limpar_exportacoes()
+            self.stdout.write(self.style.SUCCESS(
+                f'{total} tarefa(s) processada(s), {apagados} exportação(ões) vencida(s) apagada(s).'
+            ))
+            return
+
+        self.stdout.write('Aguardando tarefas... (Ctrl+C para sair)')
+        ultima_limpeza = None
+        try:
+            while True:
+                if ultima_limpeza is None or time.monotonic() - ultima_limpeza >= INTERVALO_LIMPEZA:
+                    limpar_exportacoes()
+                    ultima_limpeza = time.monotonic()
+                if not processar_pendentes(limite=50):
+                    time.sleep(options['intervalo'])
+        except KeyboardInterrupt:
+            self.stdout.write('Worker encerrado.')
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from app_controller.contadores import divergencias_contadores, reconstruir_contadores
+
+
+class Command(BaseCommand):
+    help = 'Confere os contadores do dashboard com a tabela de vales e os reconstrói se necessário'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--apenas-verificar',
+            action='store_true',
+            help='Apenas lista as divergências, sem alterar os contadores'
+        )
+        parser.add_argument(
+            '--reconstruir',
+            action='store_true',
+            help='Reconstrói todos os contadores mesmo sem divergências'
+        )
+
+    def handle(self, *args, **options):
+        divergencias = divergencias_contadores()
+
+        for modelo, chave, esperado, atual in divergencias:
+            descricao = ' '.join(f"{campo}={valor if valor is not None else '-'}" for campo, valor in chave.items())
+            self.stdout.write(
+                f"{modelo._meta.verbose_name}: {descricao}: "
+                f"esperado (vales, pbr, chepp)={esperado} atual={atual}"
+            )
+
+        if not divergencias:
+            self.stdout.write(self.style.SUCCESS('Contadores consistentes com os vales.'))
+        else:
+            self.stdout.write(self.style.WARNING(f'{len(divergencias)} divergência(s) encontrada(s).'))
+
+        if options['apenas_verificar']:
+            return
+
+        if divergencias or options['reconstruir']:
+            total = reconstruir_contadores()
+            self.stdout.write(self.style.SUCCESS(f'Contadores reconstruídos ({total} linha(s)).'))
@@ -0,0 +1,72 @@
+# Generated by Django 5.2.6 on 2026-10-17 15:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Case, Count, DateField, Q, Sum, Value, When
+from django.db.models.functions import TruncDate
+
+
+def popular_resumos(apps, schema_editor):
+    ValePallet = apps.get_model('app_controller', 'ValePallet')
+    ResumoDiarioVales = apps.get_model('app_controller', 'ResumoDiarioVales')
+
+    agrupado = ValePallet.objects.order_by().annotate(
+        situacao=Case(
+            When(data_saida__isnull=True, then=Value('PENDENTE')),
+            When(data_retorno__isnull=True, then=Value('EM_ABERTO')),
+            default=Value('COLETADO'),
+        ),
+        dia_validade=Case(
+            When(Q(data_saida__isnull=False, data_retorno__isnull=True), then=TruncDate('data_validade')),
+            default=None,
+            output_field=DateField(),
+        ),
+        dia=TruncDate('data_emissao'),
+    ).values('dia', 'criado_por_id', 'estado', 'situacao', 'dia_validade').annotate(
+        total=Count('id'),
+        pbr=Sum('qtd_pbr', default=0),
+        chepp=Sum('qtd_chepp', default=0),
+    )
+    ResumoDiarioVales.objects.bulk_create([
+        ResumoDiarioVales(
+            dia=item['dia'],
+            criado_por_id=item['criado_por_id'],
+            estado=item['estado'],
+            situacao=item['situacao'],
+            dia_validade=item['dia_validade'],
+            qtd_vales=item['total'],
+            qtd_pbr=item['pbr'],
+            qtd_chepp=item['chepp'],
+        )
+        for item in agrupado
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_controller', '0010_contadorvales'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumoDiarioVales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia', models.DateField()),
+                ('estado', models.CharField(choices=[('EMITIDO', 'Emitido'), ('SAIDA', 'Saida'), ('RETORNO', 'Retorno'), ('CANCELADO', 'Cancelado')], max_length=10)),
+                ('situacao', models.CharField(choices=[('PENDENTE', 'Pendente'), ('EM_ABERTO', 'Em aberto'), ('COLETADO', 'Coletado')], max_length=10)),
+                ('dia_validade', models.DateField(blank=True, null=True)),
+                ('qtd_vales', models.IntegerField(default=0)),
+                ('qtd_pbr', models.BigIntegerField(default=0)),
+                ('qtd_chepp', models.BigIntegerField(default=0)),
+                ('criado_por', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='resumos_diarios_vales', to='app_controller.pessoajuridica')),
+            ],
+            options={
+                'verbose_name': 'Resumo Diário de Vales',
+                'verbose_name_plural': 'Resumos Diários de Vales',
+                'indexes': [models.Index(fields=['dia', 'criado_por'], name='app_control_dia_ed2b3b_idx'), models.Index(fields=['criado_por', 'dia'], name='app_control_criado__33992d_idx')],
+            },
+        ),
+        migrations.RunPython(popular_resumos, migrations.RunPython.noop),
+    ]
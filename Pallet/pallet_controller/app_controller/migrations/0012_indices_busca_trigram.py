@@ -0,0 +1,42 @@
+from django.db import migrations
+
+
+# Índices GIN de trigramas para a busca da listagem de vales. Cobrem o
+# UPPER(...) gerado pelo lookup icontains do Django no PostgreSQL.
+INDICES = [
+    ('app_controller_valepallet', 'numero_vale', 'valepallet_numero_trgm'),
+    ('app_controller_cliente', 'nome', 'cliente_nome_trgm'),
+    ('app_controller_motorista', 'nome', 'motorista_nome_trgm'),
+]
+
+
+def criar_indices(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for tabela, coluna, nome in INDICES:
+        schema_editor.execute(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{nome}" '
+            f'ON "{tabela}" USING gin (UPPER("{coluna}"::text) gin_trgm_ops)'
+        )
+
+
+def remover_indices(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for _, _, nome in INDICES:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{nome}"')
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY não pode rodar dentro de uma transação
+    atomic = False
+
+    dependencies = [
+        ('app_controller', '0011_resumodiariovales'),
+    ]
+
+    operations = [
+        migrations.RunPython(criar_indices, remover_indices),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.6 on 2026-10-17 15:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_controller', '0012_indices_busca_trigram'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='valepallet',
+            index=models.Index(fields=['-data_emissao', '-id'], name='vale_emissao_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='valepallet',
+            index=models.Index(fields=['criado_por', '-data_emissao', '-id'], name='vale_pj_emissao_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='valepallet',
+            index=models.Index(fields=['criado_por', 'estado', 'data_validade'], name='vale_pj_estado_validade_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='valepallet',
+            index=models.Index(condition=models.Q(('data_retorno__isnull', True), ('data_saida__isnull', False)), fields=['criado_por', 'data_validade'], name='vale_pj_abertos_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='valepallet',
+            index=models.Index(condition=models.Q(('data_saida__isnull', True)), fields=['criado_por', 'data_emissao'], name='vale_pj_pendentes_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.6 on 2026-10-17 15:58
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_controller', '0015_movimentacao_chave_idempotencia'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConsultaExterna',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('servico', models.CharField(max_length=20)),
+                ('chave', models.CharField(max_length=64)),
+                ('dados', models.JSONField()),
+                ('encontrado', models.BooleanField(default=True)),
+                ('consultado_em', models.DateTimeField(default=django.utils.timezone.now)),
+                ('expira_em', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'Consulta Externa',
+                'verbose_name_plural': 'Consultas Externas',
+                'constraints': [models.UniqueConstraint(fields=('servico', 'chave'), name='consulta_servico_chave_uniq')],
+            },
+        ),
+    ]
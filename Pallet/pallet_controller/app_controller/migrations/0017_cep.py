@@ -0,0 +1,31 @@
+# Generated by Django 5.2.6 on 2026-10-17 15:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_controller', '0016_consultaexterna'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Cep',
+            fields=[
+                ('cep', models.CharField(max_length=8, primary_key=True, serialize=False)),
+                ('logradouro', models.CharField(blank=True, max_length=255)),
+                ('complemento', models.CharField(blank=True, max_length=255)),
+                ('bairro', models.CharField(blank=True, max_length=100)),
+                ('cidade', models.CharField(max_length=100)),
+                ('uf', models.CharField(max_length=2)),
+                ('codigo_ibge', models.CharField(blank=True, max_length=7)),
+                ('origem', models.CharField(choices=[('ARQUIVO', 'Arquivo'), ('VIACEP', 'ViaCEP')], default='ARQUIVO', max_length=10)),
+                ('atualizado_em', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'CEP',
+                'verbose_name_plural': 'CEPs',
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.6 on 2026-10-17 16:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_controller', '0017_cep'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Estado',
+            fields=[
+                ('id', models.PositiveSmallIntegerField(primary_key=True, serialize=False, verbose_name='Código IBGE')),
+                ('sigla', models.CharField(max_length=2, unique=True)),
+                ('nome', models.CharField(max_length=50)),
+            ],
+            options={
+                'verbose_name': 'Estado',
+                'verbose_name_plural': 'Estados',
+                'ordering': ['nome'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Municipio',
+            fields=[
+                ('id', models.PositiveIntegerField(primary_key=True, serialize=False, verbose_name='Código IBGE')),
+                ('nome', models.CharField(max_length=100)),
+                ('estado', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='municipios', to='app_controller.estado')),
+            ],
+            options={
+                'verbose_name': 'Município',
+                'verbose_name_plural': 'Municípios',
+                'ordering': ['nome'],
+                'indexes': [models.Index(fields=['estado', 'nome'], name='municipio_estado_nome_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.6 on 2026-10-17 16:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_controller', '0018_estado_municipio'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cliente',
+            index=models.Index(fields=['criado_por', 'nome', 'id'], name='cliente_pj_nome_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='motorista',
+            index=models.Index(fields=['criado_por', 'nome', 'id'], name='motorista_pj_nome_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transportadora',
+            index=models.Index(fields=['criado_por', 'nome', 'id'], name='transportadora_pj_nome_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+from django.db import migrations
+
+
+# Índices para a busca por prefixo do nome nas listagens de cadastros. O
+# lookup istartswith do Django gera UPPER("nome"::text) LIKE 'X%' no
+# PostgreSQL, que só usa índice com text_pattern_ops (fora da collation C).
+INDICES = [
+    ('app_controller_cliente', 'nome', 'cliente_nome_prefixo'),
+    ('app_controller_motorista', 'nome', 'motorista_nome_prefixo'),
+    ('app_controller_transportadora', 'nome', 'transportadora_nome_prefixo'),
+]
+
+
+def criar_indices(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for tabela, coluna, nome in INDICES:
+        schema_editor.execute(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{nome}" '
+            f'ON "{tabela}" (UPPER("{coluna}"::text) text_pattern_ops)'
+        )
+
+
+def remover_indices(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for _, _, nome in INDICES:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{nome}"')
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY não pode rodar dentro de uma transação
+    atomic = False
+
+    dependencies = [
+        ('app_controller', '0019_indices_cadastros'),
+    ]
+
+    operations = [
+        migrations.RunPython(criar_indices, remover_indices),
+    ]
@@ -0,0 +1,41 @@
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+CHAVE = ('criado_por_id', 'estado', 'situacao', 'dia_validade')
+
+
+def unificar_duplicados(apps, schema_editor):
+    """Soma numa só linha os contadores criados em duplicidade para a mesma chave"""
+    ContadorVales = apps.get_model('app_controller', 'ContadorVales')
+
+    duplicados = ContadorVales.objects.order_by().values(*CHAVE).annotate(
+        linhas=Count('id'),
+        total=Sum('qtd_vales'),
+        pbr=Sum('qtd_pbr'),
+        chepp=Sum('qtd_chepp'),
+    ).filter(linhas__gt=1)
+    for item in duplicados:
+        chave = {campo: item[campo] for campo in CHAVE}
+        ContadorVales.objects.filter(**chave).delete()
+        ContadorVales.objects.create(qtd_vales=item['total'], qtd_pbr=item['pbr'], qtd_chepp=item['chepp'], **chave)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_controller', '0020_indices_prefixo_cadastros'),
+    ]
+
+    operations = [
+        migrations.RunPython(unificar_duplicados, migrations.RunPython.noop),
+        # O índice da restrição única cobre as mesmas colunas
+        migrations.RemoveIndex(
+            model_name='contadorvales',
+            name='app_control_criado__24f458_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='contadorvales',
+            constraint=models.UniqueConstraint(fields=('criado_por', 'estado', 'situacao', 'dia_validade'), name='contador_vales_chave_uniq', nulls_distinct=False),
+        ),
+    ]
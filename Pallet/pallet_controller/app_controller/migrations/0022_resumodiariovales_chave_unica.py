@@ -0,0 +1,41 @@
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+CHAVE = ('dia', 'criado_por_id', 'estado', 'situacao', 'dia_validade')
+
+
+def unificar_duplicados(apps, schema_editor):
+    """Soma numa só linha os resumos criados em duplicidade para a mesma chave"""
+    ResumoDiarioVales = apps.get_model('app_controller', 'ResumoDiarioVales')
+
+    duplicados = ResumoDiarioVales.objects.order_by().values(*CHAVE).annotate(
+        linhas=Count('id'),
+        total=Sum('qtd_vales'),
+        pbr=Sum('qtd_pbr'),
+        chepp=Sum('qtd_chepp'),
+    ).filter(linhas__gt=1)
+    for item in duplicados:
+        chave = {campo: item[campo] for campo in CHAVE}
+        ResumoDiarioVales.objects.filter(**chave).delete()
+        ResumoDiarioVales.objects.create(qtd_vales=item['total'], qtd_pbr=item['pbr'], qtd_chepp=item['chepp'], **chave)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_controller', '0021_contadorvales_chave_unica'),
+    ]
+
+    operations = [
+        migrations.RunPython(unificar_duplicados, migrations.RunPython.noop),
+        # O índice da restrição única começa pelas mesmas colunas
+        migrations.RemoveIndex(
+            model_name='resumodiariovales',
+            name='app_control_dia_ed2b3b_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='resumodiariovales',
+            constraint=models.UniqueConstraint(fields=('dia', 'criado_por', 'estado', 'situacao', 'dia_validade'), name='resumo_diario_chave_uniq', nulls_distinct=False),
+        ),
+    ]
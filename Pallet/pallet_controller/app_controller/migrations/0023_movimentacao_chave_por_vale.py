@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_controller', '0022_resumodiariovales_chave_unica'),
+    ]
+
+    operations = [
+        # A chave de idempotência passa a ser única por vale, e não global
+        migrations.AlterField(
+            model_name='movimentacao',
+            name='chave_idempotencia',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='movimentacao',
+            constraint=models.UniqueConstraint(fields=('vale', 'chave_idempotencia'), name='movimentacao_vale_chave_uniq'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+from django.db import migrations
+
+
+# A busca da listagem de vales compara os nomes por LOWER(f_unaccent(nome))
+# (ver busca.py). unaccent() não é IMMUTABLE e não pode entrar num índice:
+# f_unaccent é o wrapper usual, com o dicionário fixo. Os índices de
+# trigramas da 0012 sobre UPPER(nome) deixam de ser usados e são trocados.
+INDICES = [
+    ('app_controller_cliente', 'nome', 'cliente_nome_sem_acento_trgm', 'cliente_nome_trgm'),
+    ('app_controller_motorista', 'nome', 'motorista_nome_sem_acento_trgm', 'motorista_nome_trgm'),
+]
+
+
+def criar_indices(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS unaccent')
+    schema_editor.execute(
+        "CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text AS "
+        "$$ SELECT public.unaccent('public.unaccent', $1) $$ "
+        "LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT"
+    )
+    for tabela, coluna, nome, antigo in INDICES:
+        schema_editor.execute(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{nome}" '
+            f'ON "{tabela}" USING gin (LOWER(f_unaccent("{coluna}")) gin_trgm_ops)'
+        )
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{antigo}"')
+
+
+def remover_indices(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for tabela, coluna, nome, antigo in INDICES:
+        schema_editor.execute(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{antigo}" '
+            f'ON "{tabela}" USING gin (UPPER("{coluna}"::text) gin_trgm_ops)'
+        )
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{nome}"')
+    schema_editor.execute('DROP FUNCTION IF EXISTS f_unaccent(text)')
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY não pode rodar dentro de uma transação
+    atomic = False
+
+    dependencies = [
+        ('app_controller', '0023_movimentacao_chave_por_vale'),
+    ]
+
+    operations = [
+        migrations.RunPython(criar_indices, remover_indices),
+    ]
@@ -1,4 +1,5 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Q
 import secrets
 from django.utils import timezone
 from django.core.exceptions import ValidationError
@@ -176,6 +177,7 @@ class Cliente(models.Model):
         indexes = [
             models.Index(fields=['nome']),
             models.Index(fields=['cnpj']),
+            models.Index(fields=['criado_por', 'nome', 'id'], name='cliente_pj_nome_idx'),
         ]
 
     def __str__(self):
@@ -224,6 +226,7 @@ class Motorista(models.Model):
         indexes = [
             models.Index(fields=['nome']),
             models.Index(fields=['cpf']),
+            models.Index(fields=['criado_por', 'nome', 'id'], name='motorista_pj_nome_idx'),
         ]
 
     def __str__(self):
@@ -272,6 +275,7 @@ class Transportadora(models.Model):
         indexes = [
             models.Index(fields=['nome']),
             models.Index(fields=['cnpj']),
+            models.Index(fields=['criado_por', 'nome', 'id'], name='transportadora_pj_nome_idx'),
         ]
 
     def __str__(self):
@@ -299,6 +303,7 @@ class ValePallet(models.Model):
     data_validade = models.DateTimeField()
     qtd_pbr = models.PositiveIntegerField(default=0)
     qtd_chepp = models.PositiveIntegerField(default=0)
+    # Legado: o QR Code agora é renderizado sob demanda (views.valepallet_qr_code)
     qr_code = models.ImageField(upload_to='qrcodes/', blank=True, null=True)
     estado = models.CharField(max_length=10, choices=ESTADO_CHOICES, default='EMITIDO')
     observacoes = models.TextField(blank=True, null=True)
@@ -338,9 +343,31 @@ class ValePallet(models.Model):
         ordering = ['-data_emissao']
         verbose_name = 'Vale Pallet'
         verbose_name_plural = 'Vales Pallets'
+        indexes = [
+            # Listagens (staff e por PJ) na ordem da paginação
+            models.Index(fields=['-data_emissao', '-id'], name='vale_emissao_idx'),
+            models.Index(fields=['criado_por', '-data_emissao', '-id'], name='vale_pj_emissao_idx'),
+            # Filtros por estado + validade (modal do dashboard)
+            models.Index(fields=['criado_por', 'estado', 'data_validade'], name='vale_pj_estado_validade_idx'),
+            # Vales em aberto (saída sem retorno) por PJ, na ordem de vencimento
+            models.Index(
+                fields=['criado_por', 'data_validade'],
+                condition=Q(data_saida__isnull=False, data_retorno__isnull=True),
+                name='vale_pj_abertos_idx'
+            ),
+            # Vales pendentes (sem saída) por PJ
+            models.Index(
+                fields=['criado_por', 'data_emissao'],
+                condition=Q(data_saida__isnull=True),
+                name='vale_pj_pendentes_idx'
+            ),
+        ]
     
     def __str__(self):
-        return f"Vale {self.numero_vale} - {self.cliente.nome}"
+        # O cliente só entra se já estiver carregado, para não gerar uma consulta por vale
+        if ValePallet.cliente.is_cached(self):
+            return f"Vale {self.numero_vale} - {self.cliente.nome}"
+        return f"Vale {self.numero_vale}"
         
     @property
     def esta_vencido(self):
@@ -352,6 +379,57 @@ class ValePallet(models.Model):
         """Gera um hash seguro usando secrets"""
         self.hash_seguranca = secrets.token_hex(16)
 
+    # Campos que determinam em qual contador do dashboard o vale é somado
+    CAMPOS_CONTADOR = (
+        'criado_por_id', 'estado', 'data_saida', 'data_retorno',
+        'data_validade', 'data_emissao', 'qtd_pbr', 'qtd_chepp',
+    )
+
+    def _snapshot_contador(self):
+        """Valores atuais dos campos de contador (None se algum estiver adiado)"""
+        carregados = self.__dict__
+        if any(campo not in carregados for campo in self.CAMPOS_CONTADOR):
+            return None
+        return {campo: carregados[campo] for campo in self.CAMPOS_CONTADOR}
+
+    def _contador_gravado(self):
+        """Campos de contador como estão no banco, com a linha travada até o fim da transação"""
+        return ValePallet.objects.select_for_update().filter(pk=self.pk).values(*self.CAMPOS_CONTADOR).first()
+
+    def save(self, *args, **kwargs):
+        from .contadores import atualizar_contadores
+
+        with transaction.atomic(using=kwargs.get('using')):
+            # Lido do banco, e não da instância: um scan gravado depois que
+            # ela foi carregada já mudou o contador em que o vale está
+            anterior = None
+            if self.pk and not self._state.adding:
+                anterior = self._contador_gravado()
+
+            super().save(*args, **kwargs)
+
+            atual = self._snapshot_contador()
+            update_fields = kwargs.get('update_fields')
+            if atual is None:
+                atual = ValePallet.objects.filter(pk=self.pk).values(*self.CAMPOS_CONTADOR).first()
+            elif anterior and update_fields is not None:
+                # Campos fora de update_fields não foram gravados no banco
+                gravados = {self._meta.get_field(nome).attname for nome in update_fields}
+                atual = {
+                    campo: atual[campo] if campo in gravados else anterior[campo]
+                    for campo in self.CAMPOS_CONTADOR
+                }
+            atualizar_contadores(anterior, atual)
+
+    def delete(self, *args, **kwargs):
+        from .contadores import atualizar_contadores
+
+        with transaction.atomic(using=kwargs.get('using')):
+            anterior = self._contador_gravado()
+            resultado = super().delete(*args, **kwargs)
+            atualizar_contadores(anterior, None)
+        return resultado
+
 
 class Movimentacao(models.Model):
     TIPO_CHOICES = [
@@ -375,25 +453,35 @@ class Movimentacao(models.Model):
         null=True,
         blank=True,
     )
+    # Chave do scan que gerou a movimentação; repetições com a mesma chave no
+    # mesmo vale não geram uma nova transição (ver transicoes.registrar_scan)
+    chave_idempotencia = models.CharField(max_length=64, null=True, blank=True)
     
     class Meta:
         ordering = ['-data_hora']
         verbose_name = 'Movimentação'
         verbose_name_plural = 'Movimentações'
+        constraints = [
+            models.UniqueConstraint(fields=['vale', 'chave_idempotencia'], name='movimentacao_vale_chave_uniq'),
+        ]
     
     def __str__(self):
-        return f"{self.get_tipo_display()} - Vale {self.vale.numero_vale}"
+        if Movimentacao.vale.is_cached(self):
+            return f"{self.get_tipo_display()} - Vale {self.vale.numero_vale}"
+        return f"{self.get_tipo_display()} - Vale #{self.vale_id}"
     
     def save(self, *args, **kwargs):
-        if not self.pk:  # Apenas na criação
-            if self.tipo == 'EMITIDO':
-                self.vale.estado = 'EMITIDO'
-            elif self.tipo == 'SAIDA':
-                self.vale.estado = 'SAIDA'
-            elif self.tipo == 'RETORNO':
-                self.vale.estado = 'RETORNO'
-            self.vale.save()
-        super().save(*args, **kwargs)
+        from .movimentacoes import aplicar_estados
+
+        if self.pk:
+            super().save(*args, **kwargs)
+            return
+
+        # Na criação, leva o vale ao estado da movimentação com um UPDATE
+        # direcionado (nenhum, se o vale já estiver nesse estado)
+        with transaction.atomic(using=kwargs.get('using')):
+            aplicar_estados([self])
+            super().save(*args, **kwargs)
 
 
         # models.py
@@ -411,4 +499,212 @@ class DocumentoVale(models.Model):
         verbose_name_plural = "Documentos dos Vales"
 
     def __str__(self):
-        return f"{self.nome_original} ({self.vale.numero_vale})"
+        if DocumentoVale.vale.is_cached(self):
+            return f"{self.nome_original} ({self.vale.numero_vale})"
+        return f"{self.nome_original} (vale #{self.vale_id})"
+
+
+class ContadorVales(models.Model):
+    """
+    Contadores desnormalizados do dashboard, mantidos incrementalmente.
+
+    Cada linha soma os vales de uma PJ (``criado_por`` nulo para vales sem
+    PJ) com o mesmo estado e a mesma situação. Para vales em aberto (saída
+    sem retorno) a linha também é separada pelo dia de validade, para que
+    vencidos e a vencer possam ser somados sem ler a tabela de vales.
+    """
+    SITUACAO_CHOICES = [
+        ('PENDENTE', 'Pendente'),
+        ('EM_ABERTO', 'Em aberto'),
+        ('COLETADO', 'Coletado'),
+    ]
+
+    criado_por = models.ForeignKey(
+        PessoaJuridica,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='contadores_vales'
+    )
+    estado = models.CharField(max_length=10, choices=ValePallet.ESTADO_CHOICES)
+    situacao = models.CharField(max_length=10, choices=SITUACAO_CHOICES)
+    dia_validade = models.DateField(null=True, blank=True)
+    qtd_vales = models.IntegerField(default=0)
+    qtd_pbr = models.BigIntegerField(default=0)
+    qtd_chepp = models.BigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Contador de Vales'
+        verbose_name_plural = 'Contadores de Vales'
+        constraints = [
+            # Uma linha por chave (vales sem PJ e fora de aberto têm chave com nulos)
+            models.UniqueConstraint(
+                fields=['criado_por', 'estado', 'situacao', 'dia_validade'],
+                nulls_distinct=False,
+                name='contador_vales_chave_uniq'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.criado_por_id or 'global'} - {self.estado}/{self.situacao}: {self.qtd_vales}"
+
+
+class ResumoDiarioVales(models.Model):
+    """
+    Mesmos totais de ``ContadorVales``, separados também pelo dia de
+    emissão do vale. Usado pelos filtros de período do dashboard, que
+    somam no máximo uma linha por dia do período em vez de ler os vales.
+    """
+    dia = models.DateField()
+    criado_por = models.ForeignKey(
+        PessoaJuridica,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='resumos_diarios_vales'
+    )
+    estado = models.CharField(max_length=10, choices=ValePallet.ESTADO_CHOICES)
+    situacao = models.CharField(max_length=10, choices=ContadorVales.SITUACAO_CHOICES)
+    dia_validade = models.DateField(null=True, blank=True)
+    qtd_vales = models.IntegerField(default=0)
+    qtd_pbr = models.BigIntegerField(default=0)
+    qtd_chepp = models.BigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Resumo Diário de Vales'
+        verbose_name_plural = 'Resumos Diários de Vales'
+        indexes = [
+            models.Index(fields=['criado_por', 'dia']),
+        ]
+        constraints = [
+            # Uma linha por dia e chave do contador; também serve aos filtros por dia
+            models.UniqueConstraint(
+                fields=['dia', 'criado_por', 'estado', 'situacao', 'dia_validade'],
+                nulls_distinct=False,
+                name='resumo_diario_chave_uniq'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.dia} - {self.criado_por_id or 'global'} - {self.estado}/{self.situacao}: {self.qtd_vales}"
+
+
+class Tarefa(models.Model):
+    """
+    Tarefa em segundo plano da fila local (ver ``tarefas.py``). ``funcao`` é
+    o caminho pontuado da função a executar e ``argumentos`` os kwargs.
+    """
+    STATUS_CHOICES = [
+        ('PENDENTE', 'Pendente'),
+        ('EXECUTANDO', 'Executando'),
+        ('CONCLUIDA', 'Concluída'),
+        ('ERRO', 'Erro'),
+    ]
+
+    funcao = models.CharField(max_length=255)
+    argumentos = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDENTE')
+    tentativas = models.PositiveIntegerField(default=0)
+    max_tentativas = models.PositiveIntegerField(default=3)
+    erro = models.TextField(blank=True, null=True)
+    resultado = models.JSONField(blank=True, null=True)
+    criado_em = models.DateTimeField(auto_now_add=True)
+    executar_apos = models.DateTimeField(default=timezone.now)
+    iniciado_em = models.DateTimeField(null=True, blank=True)
+    concluido_em = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['executar_apos', 'id']
+        verbose_name = 'Tarefa'
+        verbose_name_plural = 'Tarefas'
+        indexes = [
+            models.Index(fields=['status', 'executar_apos'], name='tarefa_fila_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.funcao} ({self.get_status_display()})"
+
+
+class ConsultaExterna(models.Model):
+    """
+    Cache persistente das respostas de serviços externos (ver
+    ``consultas.py``). ``encontrado`` falso guarda respostas negativas
+    (ex.: CNPJ inexistente), que expiram antes das positivas.
+    """
+    servico = models.CharField(max_length=20)
+    chave = models.CharField(max_length=64)
+    dados = models.JSONField()
+    encontrado = models.BooleanField(default=True)
+    consultado_em = models.DateTimeField(default=timezone.now)
+    expira_em = models.DateTimeField()
+
+    class Meta:
+        verbose_name = 'Consulta Externa'
+        verbose_name_plural = 'Consultas Externas'
+        constraints = [
+            models.UniqueConstraint(fields=['servico', 'chave'], name='consulta_servico_chave_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.servico}:{self.chave}"
+
+
+class Cep(models.Model):
+    """
+    Base local de CEPs, carregada de um arquivo (``manage.py carregar_ceps``)
+    e completada com as consultas ao ViaCEP que não estavam nela.
+    """
+    ORIGEM_CHOICES = [
+        ('ARQUIVO', 'Arquivo'),
+        ('VIACEP', 'ViaCEP'),
+    ]
+
+    cep = models.CharField(max_length=8, primary_key=True)
+    logradouro = models.CharField(max_length=255, blank=True)
+    complemento = models.CharField(max_length=255, blank=True)
+    bairro = models.CharField(max_length=100, blank=True)
+    cidade = models.CharField(max_length=100)
+    uf = models.CharField(max_length=2)
+    codigo_ibge = models.CharField(max_length=7, blank=True)
+    origem = models.CharField(max_length=10, choices=ORIGEM_CHOICES, default='ARQUIVO')
+    atualizado_em = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'CEP'
+        verbose_name_plural = 'CEPs'
+
+    def __str__(self):
+        return f"{self.cep} - {self.cidade}/{self.uf}"
+
+
+class Estado(models.Model):
+    """Unidade federativa (dados de referência do IBGE, ver ``localidades.py``)"""
+    id = models.PositiveSmallIntegerField(primary_key=True, verbose_name='Código IBGE')
+    sigla = models.CharField(max_length=2, unique=True)
+    nome = models.CharField(max_length=50)
+
+    class Meta:
+        ordering = ['nome']
+        verbose_name = 'Estado'
+        verbose_name_plural = 'Estados'
+
+    def __str__(self):
+        return self.sigla
+
+
+class Municipio(models.Model):
+    """Município (dados de referência do IBGE, ver ``localidades.py``)"""
+    id = models.PositiveIntegerField(primary_key=True, verbose_name='Código IBGE')
+    nome = models.CharField(max_length=100)
+    estado = models.ForeignKey(Estado, on_delete=models.CASCADE, related_name='municipios')
+
+    class Meta:
+        ordering = ['nome']
+        verbose_name = 'Município'
+        verbose_name_plural = 'Municípios'
+        indexes = [
+            models.Index(fields=['estado', 'nome'], name='municipio_estado_nome_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.nome}/{self.estado_id}"
@@ -0,0 +1,225 @@
+"""
+Monitor das consultas SQL feitas em cada requisição (desenvolvimento e testes).
+
+``MonitorConsultasMiddleware`` registra, via ``connection.execute_wrapper``,
+todas as consultas da requisição e agrupa por view (nome da URL):
+
+- a mesma consulta (mesma forma, ignorando parâmetros e literais) repetida
+  ``LIMITE_CONSULTAS_REPETIDAS`` vezes ou mais é tratada como N+1 — em
+  geral uma FK carregada dentro de um laço, sem ``select_related`` ou
+  ``prefetch_related``;
+- views com entrada em ``ORCAMENTO_CONSULTAS`` não podem passar desse
+  número de consultas. O orçamento pode ser um número ou um dicionário
+  por método HTTP (ex.: ``{'GET': 6, 'POST': 32}``), para views em que o
+  POST grava e custa bem mais que o GET.
+
+Fora dos testes os problemas vão para o log. Com o ``ExecutorTestes``
+(``TEST_RUNNER``) o monitor fica em modo estrito: a requisição que estoura
+o orçamento levanta ``OrcamentoConsultasExcedido`` e o teste que a fez
+falha; no final é impresso o relatório por view.
+
+O middleware só é carregado com ``MONITOR_CONSULTAS`` (padrão: ``DEBUG``)
+ou em modo estrito.
+"""
+import logging
+import re
+import threading
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.test.runner import DiscoverRunner
+
+
+logger = logging.getLogger(__name__)
+
+LIMITE_CONSULTAS_REPETIDAS = 5
+
+_estrito = False
+_relatorio = {}
+_relatorio_lock = threading.Lock()
+
+
+class OrcamentoConsultasExcedido(AssertionError):
+    pass
+
+
+# ==============================================
+# REGISTRO DAS CONSULTAS
+# ==============================================
+_LITERAL_TEXTO = re.compile(r"'(?:[^']|'')*'")
+_LITERAL_NUMERO = re.compile(r'\b\d+(?:\.\d+)?\b')
+_LISTA_PARAMETROS = re.compile(r'\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)')
+_ESPACOS = re.compile(r'\s+')
+
+
+def forma_consulta(sql):
+    """SQL sem literais e com listas ``IN (...)`` colapsadas, para agrupar consultas iguais"""
+    sql = _LITERAL_TEXTO.sub('?', sql)
+    sql = _LITERAL_NUMERO.sub('?', sql)
+    sql = _LISTA_PARAMETROS.sub('(...)', sql)
+    return _ESPACOS.sub(' ', sql).strip()
+
+
+class RegistroConsultas:
+    """``execute_wrapper`` que guarda o SQL de cada consulta executada"""
+
+    def __init__(self):
+        self.consultas = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.consultas.append(sql)
+        return execute(sql, params, many, context)
+
+    def __len__(self):
+        return len(self.consultas)
+
+    def mais_repetida(self):
+        """``(forma, vezes)`` da consulta que mais se repetiu, ou ``(None, 0)``"""
+        if not self.consultas:
+            return None, 0
+        return Counter(forma_consulta(sql) for sql in self.consultas).most_common(1)[0]
+
+
+@contextmanager
+def registrar_consultas():
+    """Registra as consultas de todas as conexões enquanto o bloco executa"""
+    registro = RegistroConsultas()
+    with ExitStack() as pilha:
+        for conexao in connections.all():
+            pilha.enter_context(conexao.execute_wrapper(registro))
+        yield registro
+
+
+# ==============================================
+# ORÇAMENTO E RELATÓRIO
+# ==============================================
+def orcamento(view, metodo=None):
+    """
+    Máximo de consultas da ``view`` (``ORCAMENTO_CONSULTAS``) para o método
+    HTTP, ou ``None``. Sem método, o maior orçamento da view.
+    """
+    limite = getattr(settings, 'ORCAMENTO_CONSULTAS', {}).get(view)
+    if isinstance(limite, dict):
+        return limite.get(metodo) if metodo else max(limite.values(), default=None)
+    return limite
+
+
+def limite_repeticoes():
+    return getattr(settings, 'LIMITE_CONSULTAS_REPETIDAS', LIMITE_CONSULTAS_REPETIDAS)
+
+
+@dataclass
+class EstatisticaView:
+    requisicoes: int = 0
+    consultas: int = 0
+    maximo: int = 0
+    repeticoes: int = 0
+    forma_repetida: str = ''
+    excedidas: int = 0
+
+    def registrar(self, total, forma, vezes, excedeu):
+        self.requisicoes += 1
+        self.consultas += total
+        self.maximo = max(self.maximo, total)
+        if vezes > self.repeticoes:
+            self.repeticoes, self.forma_repetida = vezes, forma
+        self.excedidas += excedeu
+
+
+def relatorio():
+    """Cópia das estatísticas por view acumuladas desde o início do processo"""
+    with _relatorio_lock:
+        return {view: EstatisticaView(**vars(estatistica)) for view, estatistica in _relatorio.items()}
+
+
+def limpar_relatorio():
+    with _relatorio_lock:
+        _relatorio.clear()
+
+
+def linhas_relatorio():
+    """Relatório em texto, views com mais consultas primeiro"""
+    estatisticas = sorted(relatorio().items(), key=lambda item: (-item[1].maximo, item[0]))
+    if not estatisticas:
+        return []
+    linhas = [f"{'view':<40} {'req':>5} {'média':>6} {'máx':>5} {'orç.':>5} {'exced.':>6} {'repet.':>6}"]
+    for view, estatistica in estatisticas:
+        limite = orcamento(view)
+        linhas.append(
+            f"{view:<40} {estatistica.requisicoes:>5} "
+            f"{estatistica.consultas / estatistica.requisicoes:>6.1f} {estatistica.maximo:>5} "
+            f"{'-' if limite is None else limite:>5} {estatistica.excedidas:>6} {estatistica.repeticoes:>6}"
+        )
+    for view, estatistica in estatisticas:
+        if estatistica.repeticoes >= limite_repeticoes():
+            linhas.append(f"N+1 em {view} ({estatistica.repeticoes}x): {estatistica.forma_repetida[:200]}")
+    return linhas
+
+
+def _registrar(view, metodo, registro):
+    total = len(registro)
+    forma, vezes = registro.mais_repetida()
+    limite = orcamento(view, metodo)
+    excedeu = limite is not None and total > limite
+    with _relatorio_lock:
+        _relatorio.setdefault(view, EstatisticaView()).registrar(total, forma, vezes, excedeu)
+
+    if vezes >= limite_repeticoes():
+        logger.warning(f"Possível N+1 em {view}: consulta repetida {vezes}x: {forma[:200]}")
+    if excedeu:
+        mensagem = f"{view} ({metodo}) fez {total} consultas (orçamento: {limite})"
+        if _estrito:
+            raise OrcamentoConsultasExcedido(mensagem)
+        logger.error(mensagem)
+
+
+# ==============================================
+# MIDDLEWARE
+# ==============================================
+class MonitorConsultasMiddleware:
+    """Deve ser o primeiro da lista, para contar também sessão e autenticação"""
+
+    def __init__(self, get_response):
+        if not (_estrito or getattr(settings, 'MONITOR_CONSULTAS', settings.DEBUG)):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with registrar_consultas() as registro:
+            response = self.get_response(request)
+        resolver_match = getattr(request, 'resolver_match', None)
+        if resolver_match is not None:
+            _registrar(resolver_match.view_name, request.method, registro)
+        return response
+
+
+# ==============================================
+# TESTES
+# ==============================================
+class ExecutorTestes(DiscoverRunner):
+    """
+    Executor de testes com o monitor em modo estrito: requisições acima do
+    orçamento falham o teste e o relatório por view sai no final.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        global _estrito
+        super().setup_test_environment(**kwargs)
+        _estrito = True
+        limpar_relatorio()
+
+    def teardown_test_environment(self, **kwargs):
+        global _estrito
+        _estrito = False
+        super().teardown_test_environment(**kwargs)
+
+    def run_suite(self, suite, **kwargs):
+        resultado = super().run_suite(suite, **kwargs)
+        linhas = linhas_relatorio()
+        if linhas and self.verbosity >= 1:
+            self.log('\nConsultas SQL por view:\n' + '\n'.join(linhas))
+        return resultado
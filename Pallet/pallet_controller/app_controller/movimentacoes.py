@@ -0,0 +1,102 @@
+"""
+Registro de movimentações de vales.
+
+Uma movimentação EMITIDO/SAIDA/RETORNO leva o vale ao estado
+correspondente. Em vez de regravar o vale inteiro (``vale.save()``) a cada
+movimentação, ``aplicar_estados`` faz um ``UPDATE`` direcionado das colunas
+de estado e data, agrupado por estado de destino, e só para os vales cujo
+estado realmente muda. ``Movimentacao.save`` usa esta mesma rotina;
+``registrar_movimentacoes`` grava muitas movimentações de uma vez.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .contadores import atualizar_contadores_em_lote
+from .models import Movimentacao, ValePallet
+
+
+# Tipo da movimentação -> estado do vale (SCAN e CANCELADO não alteram o estado)
+ESTADO_POR_TIPO = {
+    'EMITIDO': 'EMITIDO',
+    'SAIDA': 'SAIDA',
+    'RETORNO': 'RETORNO',
+}
+
+# Data preenchida no vale ao entrar no estado, se ainda estiver vazia
+DATA_POR_ESTADO = {
+    'SAIDA': 'data_saida',
+    'RETORNO': 'data_retorno',
+}
+
+
+def _destinos(movimentacoes):
+    """Estado final de cada vale (a última movimentação prevalece)"""
+    destinos = {}
+    for movimentacao in movimentacoes:
+        estado = ESTADO_POR_TIPO.get(movimentacao.tipo)
+        if estado is None:
+            continue
+        vale = movimentacao.vale if Movimentacao.vale.is_cached(movimentacao) else None
+        destinos[movimentacao.vale_id] = (estado, vale)
+    return destinos
+
+
+def aplicar_estados(movimentacoes, agora=None):
+    """
+    Aplica nos vales o estado das movimentações (ainda não gravadas).
+    Devolve quantos vales mudaram de estado.
+    """
+    destinos = _destinos(movimentacoes)
+    # Vale já carregado no estado de destino (ex.: acabou de ser salvo): nada a fazer
+    pendentes = {
+        vale_id: estado for vale_id, (estado, vale) in destinos.items()
+        if vale is None or vale.estado != estado
+    }
+    if not pendentes:
+        return 0
+
+    agora = agora or timezone.now()
+    with transaction.atomic():
+        atuais = ValePallet.objects.select_for_update().filter(pk__in=pendentes).values('id', *ValePallet.CAMPOS_CONTADOR)
+
+        por_estado = defaultdict(list)
+        transicoes = []
+        for anterior in atuais:
+            vale_id = anterior.pop('id')
+            estado = pendentes[vale_id]
+            if anterior['estado'] == estado:
+                continue
+            atual = dict(anterior, estado=estado)
+            campo_data = DATA_POR_ESTADO.get(estado)
+            if campo_data and atual[campo_data] is None:
+                atual[campo_data] = agora
+            por_estado[estado].append(vale_id)
+            transicoes.append((anterior, atual))
+
+            vale = destinos[vale_id][1]
+            if vale is not None:
+                vale.estado = estado
+                if campo_data:
+                    setattr(vale, campo_data, atual[campo_data])
+
+        for estado, ids in por_estado.items():
+            campos = {'estado': estado}
+            campo_data = DATA_POR_ESTADO.get(estado)
+            if campo_data:
+                campos[campo_data] = Coalesce(campo_data, Value(agora))
+            ValePallet.objects.filter(pk__in=ids).update(**campos)
+
+        # O UPDATE direto não passa por ValePallet.save
+        atualizar_contadores_em_lote(transicoes)
+        return len(transicoes)
+
+
+@transaction.atomic
+def registrar_movimentacoes(movimentacoes, agora=None):
+    """Grava várias movimentações com ``bulk_create``, sem salvar vale a vale"""
+    aplicar_estados(movimentacoes, agora)
+    return Movimentacao.objects.bulk_create(movimentacoes, batch_size=500)
@@ -0,0 +1,157 @@
+"""
+Paginação por cursor (keyset) para listagens grandes.
+
+Em vez de ``OFFSET``, cada página filtra a partir da última linha da página
+anterior usando a própria ordenação da listagem (por exemplo
+``(-data_emissao, -id)``), então o custo de uma página não depende da sua
+profundidade. Os cursores são tokens opacos assinados, válidos por
+``VALIDADE_CURSOR``, e o total exibido é contado apenas até um limite.
+"""
+from django.core import signing
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+SALT_CURSOR = 'app_controller.paginacao'
+# Cursores mais antigos que isso (segundos) recomeçam da primeira página
+VALIDADE_CURSOR = 24 * 60 * 60
+
+
+class PaginaCursor:
+    """Página de uma listagem paginada por cursor."""
+
+    def __init__(self, object_list, proximo_cursor, cursor_anterior, total, total_excede):
+        self.object_list = object_list
+        self.proximo_cursor = proximo_cursor
+        self.cursor_anterior = cursor_anterior
+        self.total = total
+        self.total_excede = total_excede
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.proximo_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.cursor_anterior is not None
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+
+def _campos_ordenacao(ordenacao):
+    return [(campo.lstrip('-'), campo.startswith('-')) for campo in ordenacao]
+
+
+def _gerar_cursor(objeto, ordenacao, direcao):
+    valores = []
+    for campo, _ in _campos_ordenacao(ordenacao):
+        # Aceita instâncias e linhas de .values()
+        valor = objeto[campo] if isinstance(objeto, dict) else getattr(objeto, campo)
+        valores.append(valor.isoformat() if hasattr(valor, 'isoformat') else valor)
+    return signing.dumps({'v': valores, 'd': direcao}, salt=SALT_CURSOR, compress=True)
+
+
+def _ler_cursor(token, modelo, ordenacao):
+    """Decodifica um cursor; devolve ``None`` se for inválido, adulterado ou vencido."""
+    try:
+        dados = signing.loads(token, salt=SALT_CURSOR, max_age=VALIDADE_CURSOR)
+        campos = _campos_ordenacao(ordenacao)
+        if len(dados['v']) != len(campos) or dados['d'] not in ('proximo', 'anterior'):
+            return None
+        valores = [
+            modelo._meta.get_field(campo).to_python(valor)
+            for (campo, _), valor in zip(campos, dados['v'])
+        ]
+        return valores, dados['d']
+    except (signing.BadSignature, ValidationError, KeyError, TypeError, ValueError):
+        return None
+
+
+def _filtro_keyset(ordenacao, valores, depois):
+    """
+    Filtro das linhas que vêm depois (ou antes) da chave ``valores`` na
+    ordenação informada: (a < x) OR (a = x AND b < y) OR ...
+    """
+    filtro = Q()
+    iguais = Q()
+    for (campo, decrescente), valor in zip(_campos_ordenacao(ordenacao), valores):
+        usar_menor = decrescente == depois
+        lookup = f"{campo}__lt" if usar_menor else f"{campo}__gt"
+        filtro |= iguais & Q(**{lookup: valor})
+        iguais &= Q(**{campo: valor})
+    return filtro
+
+
+def _inverter(ordenacao):
+    return [campo[1:] if campo.startswith('-') else f"-{campo}" for campo in ordenacao]
+
+
+def contar_com_limite(queryset, limite):
+    """Conta no máximo ``limite`` linhas; devolve ``(total, excedeu)``."""
+    total = queryset.order_by().values('pk')[:limite + 1].count()
+    return min(total, limite), total > limite
+
+
+def cursor_apos(objeto, ordenacao=('-data_emissao', '-id')):
+    """Cursor para continuar a listagem logo depois de ``objeto``"""
+    return _gerar_cursor(objeto, list(ordenacao), 'proximo')
+
+
+def continuar_do_cursor(queryset, cursor=None, ordenacao=('-data_emissao', '-id')):
+    """
+    ``queryset`` ordenado e filtrado a partir de um cursor de avanço (sem
+    limite de página), para leituras sequenciais como exportações e
+    streaming. Cursor ausente ou inválido recomeça do início.
+    """
+    ordenacao = list(ordenacao)
+    lido = _ler_cursor(cursor, queryset.model, ordenacao) if cursor else None
+    if lido is not None and lido[1] == 'proximo':
+        queryset = queryset.filter(_filtro_keyset(ordenacao, lido[0], depois=True))
+    return queryset.order_by(*ordenacao)
+
+
+def paginar_por_cursor(queryset, cursor=None, por_pagina=20,
+                       ordenacao=('-data_emissao', '-id'), limite_contagem=1000):
+    """
+    Pagina ``queryset`` por cursor. A ordenação deve terminar num campo
+    único (normalmente ``id``) para que a chave seja total.
+    """
+    ordenacao = list(ordenacao)
+    lido = _ler_cursor(cursor, queryset.model, ordenacao) if cursor else None
+
+    if lido is None:
+        linhas = list(queryset.order_by(*ordenacao)[:por_pagina + 1])
+        tem_mais = len(linhas) > por_pagina
+        linhas = linhas[:por_pagina]
+        tem_proximo, tem_anterior = tem_mais, False
+    else:
+        valores, direcao = lido
+        if direcao == 'proximo':
+            linhas = list(
+                queryset.filter(_filtro_keyset(ordenacao, valores, depois=True))
+                .order_by(*ordenacao)[:por_pagina + 1]
+            )
+            tem_mais = len(linhas) > por_pagina
+            linhas = linhas[:por_pagina]
+            tem_proximo, tem_anterior = tem_mais, True
+        else:
+            linhas = list(
+                queryset.filter(_filtro_keyset(ordenacao, valores, depois=False))
+                .order_by(*_inverter(ordenacao))[:por_pagina + 1]
+            )
+            tem_mais = len(linhas) > por_pagina
+            linhas = linhas[:por_pagina][::-1]
+            tem_proximo, tem_anterior = True, tem_mais
+
+    proximo = _gerar_cursor(linhas[-1], ordenacao, 'proximo') if tem_proximo and linhas else None
+    anterior = _gerar_cursor(linhas[0], ordenacao, 'anterior') if tem_anterior and linhas else None
+
+    total, excede = contar_com_limite(queryset, limite_contagem)
+    return PaginaCursor(linhas, proximo, anterior, total, excede)
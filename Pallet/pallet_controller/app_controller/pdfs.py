@@ -0,0 +1,206 @@
+"""
+Geração de PDFs (WeasyPrint) dos documentos de vale.
+
+O PDF é gerado em memória (``write_pdf()`` sem arquivo de destino) num
+pool de processos com ``PDF_PROCESSOS`` workers, para que a renderização,
+pesada em CPU e memória, não rode no processo web nem concorra com o GIL.
+Com ``PDF_PROCESSOS = 0`` a renderização é feita no próprio processo. Cada
+worker mantém uma única ``FontConfiguration``, reaproveitada entre os
+documentos que renderiza.
+
+Cada PDF gerado fica no storage padrão, identificado pelo hash do HTML de
+origem: enquanto o vale (e o que aparece no documento) não mudar, novos
+downloads reaproveitam o arquivo e o hash serve de ETag. Ao gravar uma
+nova versão, as anteriores do mesmo documento são removidas.
+
+Este módulo não importa models: os workers do pool são processos novos
+(``spawn``) que só precisam do WeasyPrint.
+"""
+import hashlib
+import logging
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import NamedTuple
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+
+logger = logging.getLogger(__name__)
+
+DIRETORIO_PDFS = 'pdfs'
+TIMEOUT_PDF = 120
+
+_pool = None
+_pool_lock = threading.Lock()
+_fontes = None
+
+
+class DocumentoPDF(NamedTuple):
+    nome: str
+    versao: str
+
+    def abrir(self):
+        return default_storage.open(self.nome, 'rb')
+
+
+# ==============================================
+# RENDERIZAÇÃO (executada nos workers)
+# ==============================================
+def _configuracao_fontes():
+    global _fontes
+    if _fontes is None:
+        from weasyprint.text.fonts import FontConfiguration
+
+        _fontes = FontConfiguration()
+    return _fontes
+
+
+def _escrever_pdf(html, base_url=None):
+    from weasyprint import HTML
+
+    return HTML(string=html, base_url=base_url).write_pdf(font_config=_configuracao_fontes())
+
+
+def _escrever_pdf_unico(htmls, base_url=None):
+    """Um PDF só com as páginas de todos os ``htmls``, na ordem"""
+    from weasyprint import HTML
+
+    fontes = _configuracao_fontes()
+    documentos = [HTML(string=html, base_url=base_url).render(font_config=fontes) for html in htmls]
+    paginas = [pagina for documento in documentos for pagina in documento.pages]
+    return documentos[0].copy(paginas).write_pdf()
+
+
+# ==============================================
+# POOL DE PROCESSOS
+# ==============================================
+def _processos():
+    return getattr(settings, 'PDF_PROCESSOS', 2)
+
+
+def _pool_pdf():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(
+                    max_workers=_processos(),
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+    return _pool
+
+
+def _descartar_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _enviar(funcao, *args):
+    """``Future`` da ``funcao`` no pool (ou já resolvido, sem pool)"""
+    if _processos():
+        return _pool_pdf().submit(funcao, *args)
+    futuro = Future()
+    try:
+        futuro.set_result(funcao(*args))
+    except Exception as e:
+        futuro.set_exception(e)
+    return futuro
+
+
+def _resultado(futuro, funcao, *args):
+    try:
+        return futuro.result(timeout=TIMEOUT_PDF)
+    except BrokenProcessPool:
+        # Um worker morreu (ex.: falta de memória): recria o pool na próxima
+        logger.error("Pool de PDFs quebrado; renderizando no próprio processo")
+        _descartar_pool()
+        return funcao(*args)
+
+
+def renderizar_pdf(html, base_url=None):
+    """Bytes do PDF do ``html``, renderizado no pool de processos"""
+    return _resultado(_enviar(_escrever_pdf, html, base_url), _escrever_pdf, html, base_url)
+
+
+def renderizar_pdf_unico(htmls, base_url=None):
+    """Bytes de um PDF com todos os ``htmls`` (renderizado num único worker)"""
+    htmls = list(htmls)
+    return _resultado(_enviar(_escrever_pdf_unico, htmls, base_url), _escrever_pdf_unico, htmls, base_url)
+
+
+# ==============================================
+# VERSÕES NO STORAGE
+# ==============================================
+def versao_html(html):
+    return hashlib.sha256(html.encode('utf-8')).hexdigest()[:32]
+
+
+def _caminho(diretorio, prefixo, html):
+    versao = versao_html(html)
+    return f'{DIRETORIO_PDFS}/{diretorio}/{prefixo}-{versao}.pdf', versao
+
+
+def _remover_versoes_antigas(diretorio, prefixo, atual):
+    try:
+        _, arquivos = default_storage.listdir(diretorio)
+    except FileNotFoundError:
+        return
+    for arquivo in arquivos:
+        nome = f'{diretorio}/{arquivo}'
+        if arquivo.startswith(f'{prefixo}-') and nome != atual:
+            default_storage.delete(nome)
+
+
+def _gravar_versao(diretorio, prefixo, nome, conteudo):
+    salvo = default_storage.save(nome, ContentFile(conteudo))
+    if salvo != nome:
+        # Outra requisição gravou a mesma versão ao mesmo tempo
+        default_storage.delete(salvo)
+    _remover_versoes_antigas(f'{DIRETORIO_PDFS}/{diretorio}', prefixo, nome)
+
+
+def documento_pdf(diretorio, prefixo, html, base_url=None):
+    """
+    PDF do ``html`` gravado em ``pdfs/<diretorio>/<prefixo>-<versão>.pdf``,
+    renderizado só se essa versão ainda não existir.
+    """
+    nome, versao = _caminho(diretorio, prefixo, html)
+    if not default_storage.exists(nome):
+        _gravar_versao(diretorio, prefixo, nome, renderizar_pdf(html, base_url))
+    return DocumentoPDF(nome, versao)
+
+
+def _concluir(chave, diretorio, prefixo, nome, html, futuro, base_url):
+    if futuro is None:
+        with default_storage.open(nome, 'rb') as arquivo:
+            return chave, arquivo.read()
+    conteudo = _resultado(futuro, _escrever_pdf, html, base_url)
+    _gravar_versao(diretorio, prefixo, nome, conteudo)
+    return chave, conteudo
+
+
+def pdfs_em_lote(documentos, base_url=None):
+    """
+    Para cada ``(chave, diretorio, prefixo, html)`` de ``documentos`` gera
+    ``(chave, bytes do PDF)``, na mesma ordem. Versões já gravadas vêm do
+    storage; as demais são renderizadas em paralelo no pool, com no máximo
+    ``2 × PDF_PROCESSOS`` em andamento para limitar a memória.
+    """
+    janela = deque()
+    limite = 2 * max(_processos(), 1)
+    for chave, diretorio, prefixo, html in documentos:
+        nome, _ = _caminho(diretorio, prefixo, html)
+        futuro = None if default_storage.exists(nome) else _enviar(_escrever_pdf, html, base_url)
+        janela.append((chave, diretorio, prefixo, nome, html, futuro))
+        if len(janela) >= limite:
+            yield _concluir(*janela.popleft(), base_url)
+    while janela:
+        yield _concluir(*janela.popleft(), base_url)
@@ -0,0 +1,52 @@
+"""
+Leitura de planilhas enviadas pelos usuários (CSV e, se o openpyxl estiver
+instalado, XLSX) como sequência de dicionários por linha.
+"""
+import csv
+import io
+
+
+def xlsx_disponivel():
+    try:
+        import openpyxl  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def ler_csv(conteudo):
+    """Linhas de um CSV com cabeçalho (separador , ou ;)"""
+    if isinstance(conteudo, bytes):
+        conteudo = conteudo.decode('utf-8-sig')
+    try:
+        dialeto = csv.Sniffer().sniff(conteudo[:2048], delimiters=',;')
+    except csv.Error:
+        dialeto = csv.excel
+    return [
+        {chave.strip(): (valor or '').strip() for chave, valor in linha.items() if chave}
+        for linha in csv.DictReader(io.StringIO(conteudo), dialect=dialeto)
+    ]
+
+
+def ler_xlsx(conteudo):
+    """Linhas da primeira aba de um XLSX, com o cabeçalho na primeira linha"""
+    from openpyxl import load_workbook
+
+    planilha = load_workbook(io.BytesIO(conteudo), read_only=True, data_only=True)
+    try:
+        linhas = planilha.worksheets[0].iter_rows(values_only=True)
+        cabecalho = [str(coluna or '').strip() for coluna in next(linhas, ())]
+        return [
+            {chave: valor for chave, valor in zip(cabecalho, linha) if chave}
+            for linha in linhas
+            if any(valor not in (None, '') for valor in linha)
+        ]
+    finally:
+        planilha.close()
+
+
+def ler_planilha(conteudo, nome_arquivo):
+    """CSV ou XLSX, conforme a extensão do arquivo"""
+    if nome_arquivo.lower().endswith('.xlsx'):
+        return ler_xlsx(conteudo)
+    return ler_csv(conteudo)
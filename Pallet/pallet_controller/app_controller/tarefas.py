@@ -0,0 +1,135 @@
+"""
+Fila de tarefas em segundo plano.
+
+Cada tarefa é gravada na tabela ``Tarefa`` dentro da transação corrente.
+Com o backend padrão (``TAREFAS_BACKEND = 'banco'``) ela só fica visível
+para o worker (``manage.py processar_tarefas``) depois do commit. O backend
+``'imediato'`` executa a tarefa no próprio processo logo após o commit,
+útil em desenvolvimento e nos testes; o status e o resultado ficam
+registrados do mesmo jeito.
+
+Uma tarefa em execução há mais de ``TAREFAS_PRAZO_EXECUCAO`` segundos é
+considerada abandonada (worker interrompido) e volta para a fila, dentro
+do limite de tentativas. Se o worker antigo ainda terminar, o resultado
+dele é descartado: vale só o da tentativa mais recente.
+"""
+import logging
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Tarefa
+
+
+logger = logging.getLogger(__name__)
+
+PRAZO_EXECUCAO = 30 * 60
+
+
+def _backend():
+    return getattr(settings, 'TAREFAS_BACKEND', 'banco')
+
+
+def _prazo_execucao():
+    return datetime.timedelta(seconds=getattr(settings, 'TAREFAS_PRAZO_EXECUCAO', PRAZO_EXECUCAO))
+
+
+def enfileirar(funcao, **argumentos):
+    """
+    Agenda ``funcao`` (caminho pontuado) com os ``argumentos`` informados,
+    que precisam ser serializáveis em JSON.
+    """
+    tarefa = Tarefa.objects.create(funcao=funcao, argumentos=argumentos)
+    if _backend() == 'imediato':
+        transaction.on_commit(lambda: _executar_agora(tarefa.pk))
+    return tarefa
+
+
+def _executar_agora(tarefa_id):
+    Tarefa.objects.filter(pk=tarefa_id).update(
+        status='EXECUTANDO', tentativas=F('tentativas') + 1, iniciado_em=timezone.now()
+    )
+    executar(Tarefa.objects.get(pk=tarefa_id))
+
+
+def reservar_proxima():
+    """
+    Marca a próxima tarefa pendente (ou abandonada por um worker que parou
+    no meio da execução) como em execução e a devolve
+    """
+    while True:
+        with transaction.atomic():
+            agora = timezone.now()
+            tarefa = Tarefa.objects.select_for_update(skip_locked=True).filter(
+                Q(status='PENDENTE', executar_apos__lte=agora) |
+                Q(status='EXECUTANDO', iniciado_em__lt=agora - _prazo_execucao())
+            ).order_by('executar_apos', 'id').first()
+            if tarefa is None:
+                return None
+
+            if tarefa.status == 'EXECUTANDO':
+                logger.warning(f"Tarefa {tarefa.id} ({tarefa.funcao}) abandonada na tentativa {tarefa.tentativas}")
+                tarefa.erro = 'Tempo de execução esgotado'
+                if tarefa.tentativas >= tarefa.max_tentativas:
+                    tarefa.status = 'ERRO'
+                    tarefa.concluido_em = agora
+                    tarefa.save(update_fields=['status', 'erro', 'concluido_em'])
+                    continue
+
+            tarefa.status = 'EXECUTANDO'
+            tarefa.tentativas += 1
+            tarefa.iniciado_em = agora
+            tarefa.save(update_fields=['status', 'erro', 'tentativas', 'iniciado_em'])
+            return tarefa
+
+
+def _gravar(tarefa, campos):
+    """
+    Grava o desfecho da tentativa, a menos que a tarefa tenha sido
+    reservada de novo depois de abandonada (o worker se atrasou)
+    """
+    gravadas = Tarefa.objects.filter(
+        pk=tarefa.pk, status='EXECUTANDO', tentativas=tarefa.tentativas
+    ).update(**{campo: getattr(tarefa, campo) for campo in campos})
+    if not gravadas:
+        logger.warning(f"Tarefa {tarefa.id} ({tarefa.funcao}): tentativa {tarefa.tentativas} já expirada, resultado descartado")
+    return bool(gravadas)
+
+
+def executar(tarefa):
+    """Executa uma tarefa reservada, com nova tentativa em caso de erro"""
+    try:
+        resultado = import_string(tarefa.funcao)(**tarefa.argumentos)
+    except Exception as e:
+        logger.error(f"Erro na tarefa {tarefa.id} ({tarefa.funcao}): {str(e)}", exc_info=True)
+        tarefa.erro = str(e)
+        if tarefa.tentativas < tarefa.max_tentativas:
+            # Nova tentativa com espera crescente: 30s, 60s, 120s...
+            tarefa.status = 'PENDENTE'
+            tarefa.executar_apos = timezone.now() + datetime.timedelta(seconds=30 * 2 ** (tarefa.tentativas - 1))
+        else:
+            tarefa.status = 'ERRO'
+            tarefa.concluido_em = timezone.now()
+        _gravar(tarefa, ['status', 'erro', 'executar_apos', 'concluido_em'])
+        return False
+
+    tarefa.status = 'CONCLUIDA'
+    tarefa.resultado = resultado if isinstance(resultado, (dict, list, str, int, float, bool)) else None
+    tarefa.concluido_em = timezone.now()
+    return _gravar(tarefa, ['status', 'resultado', 'concluido_em'])
+
+
+def processar_pendentes(limite=None):
+    """Executa as tarefas disponíveis; devolve quantas foram processadas"""
+    processadas = 0
+    while limite is None or processadas < limite:
+        tarefa = reservar_proxima()
+        if tarefa is None:
+            break
+        executar(tarefa)
+        processadas += 1
+    return processadas
@@ -1,3 +1,1370 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import io
+import json
+import re
+import tempfile
+import time
+import zipfile
 
-# Create your tests here.
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import QuerySet
+from django.http import StreamingHttpResponse
+from django.test import TestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import consultas, localidades, pdfs
+from .busca import BuscaVales, busca_vales
+from .contadores import CHAVE, _somar, chave_contador, divergencias_contadores, reconstruir_contadores
+from .dashboard import intervalo_periodo, metricas_por_contadores
+from .emissao import LoteInvalido, emitir_vales
+from .exportacao import DIRETORIO_EXPORTACOES, consulta_exportacao, limpar_exportacoes, linhas_exportacao
+from .filtros import filtrar_vales, opcoes_filtros, vales_do_usuario
+from .forms import ValePalletForm
+from .importacao import formatar_cnpj, formatar_cpf, importar_cadastros
+from .listagens import LIMITE_AUTOCOMPLETAR, POR_PAGINA as POR_PAGINA_CADASTROS
+from .paginacao import VALIDADE_CURSOR, paginar_por_cursor
+from .monitor_consultas import OrcamentoConsultasExcedido, forma_consulta, orcamento, registrar_consultas
+from .models import (
+    Cep, Cliente, ConsultaExterna, ContadorVales, DocumentoVale, Estado, Motorista, Movimentacao, Municipio,
+    PessoaJuridica, Tarefa, Transportadora, Usuario, ValePallet,
+)
+from .movimentacoes import aplicar_estados, registrar_movimentacoes
+from .tarefas import executar, reservar_proxima
+from .transicoes import INTERVALO_MINIMO_SCAN, registrar_scan
+from .utils import renderizar_qr_code
+
+
+def criar_pessoa_juridica(username='empresa', cnpj='11.222.333/0001-81'):
+    usuario = Usuario.objects.create_user(username=username, email=f'{username}@teste.com', password='senha')
+    return PessoaJuridica.objects.create(
+        usuario=usuario, razao_social=f'Empresa {username}', cnpj=cnpj,
+        telefone='(11) 99999-9999', email=f'{username}@teste.com', cep='01001-000',
+        logradouro='Rua A', numero='1', bairro='Centro', estado='SP', cidade='São Paulo'
+    )
+
+
+def criar_vale(pessoa_juridica, numero, **campos):
+    cliente, _ = Cliente.objects.get_or_create(
+        cnpj='11.444.777/0001-61', defaults={'nome': 'Cliente', 'telefone': '(11) 99999-9999'}
+    )
+    motorista, _ = Motorista.objects.get_or_create(
+        cpf='529.982.247-25', defaults={'nome': 'Motorista', 'telefone': '(11) 99999-9999'}
+    )
+    transportadora, _ = Transportadora.objects.get_or_create(
+        cnpj='19.131.243/0001-97', defaults={'nome': 'Transportadora', 'telefone': '(11) 99999-9999'}
+    )
+    dados = {
+        'data_validade': timezone.now() + datetime.timedelta(days=10),
+        'qtd_pbr': 1,
+        'qtd_chepp': 1,
+        'hash_seguranca': f'hash-{numero}',
+    }
+    dados.update(campos)
+    return ValePallet.objects.create(
+        numero_vale=str(numero), cliente=cliente, motorista=motorista,
+        transportadora=transportadora, criado_por=pessoa_juridica, **dados
+    )
+
+
+def criar_cadastros(pessoa_juridica, indice=1):
+    """Cliente, motorista e transportadora da PJ, com documentos distintos por ``indice``"""
+    cliente = Cliente.objects.create(
+        nome=f'Cliente {indice}', cnpj=formatar_cnpj(f'{indice:012d}01'),
+        telefone='(11) 99999-9999', criado_por=pessoa_juridica
+    )
+    motorista = Motorista.objects.create(
+        nome=f'Motorista {indice}', cpf=formatar_cpf(f'{indice:011d}'),
+        telefone='(11) 99999-9999', criado_por=pessoa_juridica
+    )
+    transportadora = Transportadora.objects.create(
+        nome=f'Transportadora {indice}', cnpj=formatar_cnpj(f'{indice:012d}02'),
+        telefone='(11) 99999-9999', criado_por=pessoa_juridica
+    )
+    return cliente, motorista, transportadora
+
+
+class IndicesValePalletTests(TestCase):
+    """Garante (via EXPLAIN) que as consultas principais usam os índices de ValePallet."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.pj = criar_pessoa_juridica()
+        agora = timezone.now()
+        for numero in range(30):
+            criar_vale(
+                cls.pj, numero,
+                data_saida=agora if numero % 2 else None,
+                data_validade=agora + datetime.timedelta(days=numero - 15),
+                estado='SAIDA' if numero % 2 else 'EMITIDO',
+            )
+
+    def setUp(self):
+        if connection.vendor == 'postgresql':
+            # Com tabelas pequenas o planner preferiria seq scan
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertUsaIndice(self, queryset, indice):
+        plano = queryset.explain()
+        self.assertIn(indice, plano, f'Índice {indice} não usado:\n{plano}')
+
+    def listagem(self, filtros, cursor=False):
+        """Primeira página de ``valepallet_listar``, montada como na view"""
+        vales = vales_do_usuario(self.pj.usuario).select_related(
+            'cliente', 'motorista', 'transportadora'
+        ).order_by('-data_emissao')
+        vales, erros = filtrar_vales(vales, filtros, ordenar_por_relevancia=not cursor)
+        self.assertEqual(erros, [])
+        if cursor:
+            # paginar_por_cursor: ordenação total e uma linha a mais
+            return vales.order_by('-data_emissao', '-id')[:21]
+        # Paginator(vales, 20).page(1)
+        return vales[:20]
+
+    def test_listagem_por_pj_usa_indice_de_emissao(self):
+        self.assertUsaIndice(self.listagem({}), 'vale_pj_emissao_idx')
+
+    def test_listagem_por_cursor_usa_indice_de_emissao(self):
+        self.assertUsaIndice(self.listagem({}, cursor=True), 'vale_pj_emissao_idx')
+
+    def test_listagem_com_busca_por_cursor_usa_indice_de_emissao(self):
+        self.assertUsaIndice(self.listagem({'search': '1'}, cursor=True), 'vale_pj_emissao_idx')
+
+    def test_vales_em_aberto_por_vencimento_usam_indice_parcial(self):
+        vales = ValePallet.objects.filter(
+            criado_por=self.pj, data_saida__isnull=False, data_retorno__isnull=True
+        ).order_by('data_validade')
+        self.assertUsaIndice(vales, 'vale_pj_abertos_idx')
+
+    def test_vencidos_por_estado_usam_indice_de_validade(self):
+        vales = ValePallet.objects.filter(
+            criado_por=self.pj, estado='SAIDA', data_validade__lt=timezone.now()
+        )
+        self.assertUsaIndice(vales, 'vale_pj_estado_validade_idx')
+
+    def test_pendentes_usam_indice_parcial(self):
+        vales = ValePallet.objects.filter(
+            criado_por=self.pj, data_saida__isnull=True
+        ).order_by('data_emissao')
+        self.assertUsaIndice(vales, 'vale_pj_pendentes_idx')
+
+
+class BuscaValesTests(TestCase):
+    """Busca da listagem: sem acentos nem maiúsculas, ordenada por relevância."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.pj = criar_pessoa_juridica()
+        cliente, motorista, _ = criar_cadastros(cls.pj, 1)
+        Cliente.objects.filter(pk=cliente.pk).update(nome='Distribuidora São João')
+        Motorista.objects.filter(pk=motorista.pk).update(nome='ÂNGELO Conceição')
+        outro_cliente, outro_motorista, _ = criar_cadastros(cls.pj, 2)
+        Cliente.objects.filter(pk=outro_cliente.pk).update(nome='Joãozinho Atacado')
+
+        def vale(numero, cliente, motorista):
+            vale = criar_vale(cls.pj, numero)
+            ValePallet.objects.filter(pk=vale.pk).update(cliente=cliente, motorista=motorista)
+            return vale
+
+        vale('900', cliente, motorista)
+        vale('901', outro_cliente, outro_motorista)
+        terceiro_cliente, terceiro_motorista, _ = criar_cadastros(cls.pj, 3)
+        for numero in ('77', '7700', '1770'):
+            vale(numero, terceiro_cliente, terceiro_motorista)
+
+    def buscar(self, termo, ordenar_por_relevancia=True):
+        vales, erros = filtrar_vales(
+            vales_do_usuario(self.pj.usuario), {'search': termo}, ordenar_por_relevancia=ordenar_por_relevancia
+        )
+        self.assertEqual(erros, [])
+        return [vale.numero_vale for vale in vales]
+
+    def test_nomes_sem_acento_e_sem_maiusculas(self):
+        self.assertEqual(self.buscar('sao joao'), ['900'])
+        self.assertEqual(self.buscar('SÃO JOÃO'), ['900'])
+        self.assertEqual(self.buscar('angelo conceicao'), ['900'])
+        self.assertEqual(sorted(self.buscar('joao', ordenar_por_relevancia=False)), ['900', '901'])
+
+    def test_relevancia_igual_prefixo_contem(self):
+        self.assertEqual(self.buscar('77'), ['77', '7700', '1770'])
+        # Nome que começa com o termo vem antes do que só o contém
+        self.assertEqual(self.buscar('joao'), ['901', '900'])
+
+    def test_fallback_fora_do_postgres(self):
+        if connection.vendor == 'postgresql':
+            self.skipTest('Fallback usado só fora do PostgreSQL')
+        self.assertIs(type(busca_vales()), BuscaVales)
+        # f_unaccent registrada na conexão SQLite
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT f_unaccent('Conceição')")
+            self.assertEqual(cursor.fetchone()[0], 'Conceicao')
+        # Número do vale por icontains, sem normalização
+        self.assertEqual(sorted(self.buscar('770', ordenar_por_relevancia=False)), ['1770', '7700'])
+
+
+class ContadoresValesTests(TestCase):
+    """Contadores do dashboard sempre iguais aos calculados a partir dos vales."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.pj = criar_pessoa_juridica()
+
+    def assertConsistentes(self):
+        self.assertEqual(divergencias_contadores(), [])
+
+    def test_ciclo_do_vale(self):
+        vale = criar_vale(self.pj, 1)
+        criar_vale(self.pj, 2, qtd_pbr=5)
+        self.assertConsistentes()
+
+        vale.qtd_pbr = 10
+        vale.data_validade += datetime.timedelta(days=3)
+        vale.save()
+        self.assertConsistentes()
+
+        registrar_scan(vale.pk, vale.hash_seguranca, self.pj.usuario)
+        self.assertConsistentes()
+
+        vale.refresh_from_db()
+        vale.delete()
+        self.assertConsistentes()
+
+    def test_save_de_instancia_carregada_antes_do_scan(self):
+        vale = criar_vale(self.pj, 1)
+        carregado = ValePallet.objects.get(pk=vale.pk)
+        registrar_scan(vale.pk, vale.hash_seguranca, self.pj.usuario)
+        # O save da linha inteira volta o estado, mas o contador segue o que foi gravado
+        carregado.qtd_chepp = 4
+        carregado.save()
+        self.assertConsistentes()
+
+    @skipUnlessDBFeature('supports_nulls_distinct_unique_constraints')
+    def test_insercao_concorrente_da_mesma_chave_vira_update(self):
+        vale = criar_vale(self.pj, 1)
+        chave = chave_contador(ValePallet.objects.values(*ValePallet.CAMPOS_CONTADOR).get(pk=vale.pk))
+        update = QuerySet.update
+        chamadas = []
+
+        def update_sem_ver_a_linha(queryset, **campos):
+            # Simula a linha criada por outra transação ainda não visível no primeiro UPDATE
+            chamadas.append(campos)
+            return 0 if len(chamadas) == 1 else update(queryset, **campos)
+
+        with mock.patch.object(QuerySet, 'update', update_sem_ver_a_linha):
+            _somar(ContadorVales, CHAVE, chave, 1, 2, 3)
+        linhas = ContadorVales.objects.filter(**dict(zip(CHAVE, chave)))
+        self.assertEqual(list(linhas.values_list('qtd_vales', 'qtd_pbr', 'qtd_chepp')), [(2, 3, 4)])
+
+    def test_reconstrucao_e_comando_de_reconciliacao(self):
+        for numero in range(1, 4):
+            criar_vale(self.pj, numero)
+        ContadorVales.objects.update(qtd_vales=99)
+        self.assertNotEqual(divergencias_contadores(), [])
+
+        call_command('reconciliar_contadores', '--apenas-verificar', stdout=io.StringIO())
+        self.assertNotEqual(divergencias_contadores(), [])
+        call_command('reconciliar_contadores', stdout=io.StringIO())
+        self.assertConsistentes()
+
+        ContadorVales.objects.all().delete()
+        self.assertGreater(reconstruir_contadores(), 0)
+        self.assertConsistentes()
+
+
+@override_settings(TIME_ZONE='America/Sao_Paulo')
+class PeriodosDashboardTests(TestCase):
+    """Períodos e faixas de dias em aberto do dashboard, tirados de ResumoDiarioVales."""
+
+    HOJE = datetime.date(2026, 10, 14)  # quarta-feira
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.pj = criar_pessoa_juridica()
+        cls.numero = 0
+
+    def emitir(self, *datas_hora):
+        """Vales emitidos nas datas/horas locais informadas"""
+        for data_hora in datas_hora:
+            self.numero += 1
+            vale = criar_vale(self.pj, self.numero)
+            ValePallet.objects.filter(pk=vale.pk).update(data_emissao=timezone.make_aware(data_hora))
+        reconstruir_contadores()
+
+    def total(self, periodo):
+        inicio, fim = intervalo_periodo(periodo, self.HOJE)
+        return metricas_por_contadores(self.pj, self.HOJE, inicio, fim).total_vales
+
+    def test_limites_dos_periodos(self):
+        self.assertEqual(intervalo_periodo('hoje', self.HOJE), (self.HOJE, self.HOJE))
+        self.assertEqual(intervalo_periodo('semana', self.HOJE), (datetime.date(2026, 10, 11), datetime.date(2026, 10, 17)))
+        # Domingo abre a semana e sábado a fecha
+        for dia in (datetime.date(2026, 10, 11), datetime.date(2026, 10, 17)):
+            self.assertEqual(intervalo_periodo('semana', dia), (datetime.date(2026, 10, 11), datetime.date(2026, 10, 17)))
+        self.assertEqual(intervalo_periodo('mes', self.HOJE), (datetime.date(2026, 10, 1), datetime.date(2026, 10, 31)))
+        self.assertEqual(intervalo_periodo('mes', datetime.date(2026, 12, 5)), (datetime.date(2026, 12, 1), datetime.date(2026, 12, 31)))
+        self.assertIsNone(intervalo_periodo('todos', self.HOJE))
+
+    def test_periodos_seguem_a_meia_noite_local(self):
+        self.emitir(
+            datetime.datetime(2026, 10, 13, 23, 59),  # ontem, embora já 14/10 em UTC
+            datetime.datetime(2026, 10, 14, 0, 0),
+            datetime.datetime(2026, 10, 14, 23, 30),  # 15/10 em UTC
+            datetime.datetime(2026, 10, 10, 23, 59),  # sábado da semana anterior
+            datetime.datetime(2026, 10, 11, 0, 0),
+            datetime.datetime(2026, 9, 30, 23, 59),
+            datetime.datetime(2026, 10, 1, 0, 0),
+            datetime.datetime(2026, 10, 31, 23, 30),
+        )
+        self.assertEqual(self.total('hoje'), 2)
+        self.assertEqual(self.total('semana'), 4)
+        self.assertEqual(self.total('mes'), 7)
+        self.assertEqual(metricas_por_contadores(self.pj, self.HOJE).total_vales, 8)
+
+    def test_faixas_de_dias_em_aberto(self):
+        dias = (0, 10, 30, 31, 90, 91, 180, 181, 400)
+        self.emitir(*[
+            datetime.datetime.combine(self.HOJE - datetime.timedelta(days=dias_atras), datetime.time(12))
+            for dias_atras in dias
+        ])
+        metricas = metricas_por_contadores(self.pj, self.HOJE)
+        self.assertEqual(
+            (metricas.menos_30_dias, metricas.mais_30_dias, metricas.mais_90_dias, metricas.mais_180_dias),
+            (3, 2, 2, 2)
+        )
+        # Com período, as faixas dividem só os vales do período
+        inicio, fim = intervalo_periodo('trimestre', self.HOJE)
+        metricas = metricas_por_contadores(self.pj, self.HOJE, inicio, fim)
+        self.assertEqual(metricas.total_vales, 5)
+        self.assertEqual((metricas.menos_30_dias, metricas.mais_30_dias, metricas.mais_90_dias), (3, 2, 0))
+
+
+class EmissaoLoteTests(TestCase):
+    """Emissão de vales em lote: tudo ou nada, no escopo da PJ."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.pj = criar_pessoa_juridica()
+        cls.outra = criar_pessoa_juridica('outra', cnpj='45.723.174/0001-10')
+        cls.cliente, cls.motorista, cls.transportadora = criar_cadastros(cls.pj, 1)
+        cls.cliente_alheio, _, _ = criar_cadastros(cls.outra, 2)
+
+    def linha(self, numero, **campos):
+        linha = {
+            'numero_vale': numero,
+            'cliente': self.cliente.pk,
+            'motorista': self.motorista.pk,
+            'transportadora': self.transportadora.pk,
+            'data_validade': (timezone.localdate() + datetime.timedelta(days=10)).isoformat(),
+            'qtd_pbr': 3,
+            'qtd_chepp': 2,
+        }
+        linha.update(campos)
+        return linha
+
+    def test_linha_invalida_nao_grava_nada(self):
+        linhas = [self.linha('1'), self.linha('2', data_validade='31-12'), self.linha('1')]
+        with self.assertRaises(LoteInvalido) as erro:
+            emitir_vales(linhas, self.pj.usuario, self.pj)
+        self.assertEqual([item['linha'] for item in erro.exception.erros], [2, 3])
+        self.assertIn('numero_vale: 1 repetido no lote', erro.exception.erros[1]['erros'])
+        self.assertFalse(ValePallet.objects.exists())
+        self.assertFalse(Movimentacao.objects.exists())
+
+    def test_pj_so_usa_os_proprios_cadastros(self):
+        linhas = [
+            self.linha('1', cliente=self.cliente_alheio.pk),
+            self.linha('2', cliente='', cliente_cnpj=self.cliente_alheio.cnpj),
+            self.linha('3', cliente='', cliente_cnpj=self.cliente.cnpj),
+        ]
+        with self.assertRaises(LoteInvalido) as erro:
+            emitir_vales(linhas, self.pj.usuario, self.pj)
+        self.assertEqual([item['linha'] for item in erro.exception.erros], [1, 2])
+        for item in erro.exception.erros:
+            self.assertEqual(item['erros'], ['cliente: Cliente não encontrado'])
+        self.assertFalse(ValePallet.objects.exists())
+
+    def test_lote_emitido_com_movimentacoes_e_contadores(self):
+        criar_vale(self.pj, 'anterior')
+        vales = emitir_vales([self.linha(str(numero)) for numero in range(1, 6)], self.pj.usuario, self.pj)
+        self.assertEqual(len(vales), 5)
+        self.assertEqual(Movimentacao.objects.filter(vale__in=vales, tipo='EMITIDO').count(), 5)
+        self.assertEqual({vale.criado_por_id for vale in ValePallet.objects.filter(pk__in=[v.pk for v in vales])}, {self.pj.pk})
+        self.assertEqual(divergencias_contadores(), [])
+
+
+class TransicoesScanTests(TestCase):
+    """Máquina de estados do scan: EMITIDO -> SAIDA -> RETORNO, com repetições idempotentes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.pj = criar_pessoa_juridica()
+        cls.outra = criar_pessoa_juridica('outra', cnpj='45.723.174/0001-10')
+        cls.vale = criar_vale(cls.pj, 1)
+        cls.segundo = criar_vale(cls.pj, 2)
+
+    def scan(self, vale=None, agora=None, **kwargs):
+        vale = vale or self.vale
+        kwargs.setdefault('hash_seguranca', vale.hash_seguranca)
+        return registrar_scan(vale.pk, usuario=self.pj.usuario, agora=agora, **kwargs)
+
+    def test_emitido_saida_retorno(self):
+        agora = timezone.now()
+        saida = self.scan(agora=agora)
+        retorno = self.scan(agora=agora + INTERVALO_MINIMO_SCAN)
+        self.assertEqual((saida.transicao, retorno.transicao), ('SAIDA', 'RETORNO'))
+        fim = self.scan(agora=agora + 2 * INTERVALO_MINIMO_SCAN)
+        self.assertEqual((fim.estado, fim.transicao, fim.repetido), ('RETORNO', None, False))
+
+        self.vale.refresh_from_db()
+        self.assertEqual(self.vale.estado, 'RETORNO')
+        self.assertEqual((self.vale.data_saida, self.vale.data_retorno), (agora, agora + INTERVALO_MINIMO_SCAN))
+        self.assertEqual(
+            list(Movimentacao.objects.filter(vale=self.vale).order_by('id').values_list('tipo', flat=True)),
+            ['SAIDA', 'RETORNO'],
+        )
+        self.assertEqual(divergencias_contadores(), [])
+
+    def test_leitura_dupla_sem_chave_e_ignorada(self):
+        agora = timezone.now()
+        self.scan(agora=agora)
+        repetido = self.scan(agora=agora + INTERVALO_MINIMO_SCAN / 2)
+        self.assertEqual((repetido.estado, repetido.transicao, repetido.repetido), ('SAIDA', 'SAIDA', True))
+        self.vale.refresh_from_db()
+        self.assertEqual(self.vale.estado, 'SAIDA')
+        self.assertEqual(Movimentacao.objects.filter(vale=self.vale).count(), 1)
+
+    def test_scan_sem_chave_de_outro_usuario_nao_e_leitura_dupla(self):
+        agora = timezone.now()
+        self.scan(agora=agora)
+        # Outro usuário logo em seguida registra o retorno normalmente
+        retorno = registrar_scan(
+            self.vale.pk, self.vale.hash_seguranca, self.outra.usuario, agora=agora + INTERVALO_MINIMO_SCAN / 2
+        )
+        self.assertEqual((retorno.estado, retorno.transicao, retorno.repetido), ('RETORNO', 'RETORNO', False))
+        # A leitura dupla de quem registrou o retorno também é reconhecida
+        repetido = registrar_scan(
+            self.vale.pk, self.vale.hash_seguranca, self.outra.usuario, agora=agora + INTERVALO_MINIMO_SCAN
+        )
+        self.assertEqual((repetido.estado, repetido.transicao, repetido.repetido), ('RETORNO', 'RETORNO', True))
+        self.assertEqual(
+            list(Movimentacao.objects.filter(vale=self.vale).order_by('id').values_list('responsavel', 'tipo')),
+            [(self.pj.usuario.pk, 'SAIDA'), (self.outra.usuario.pk, 'RETORNO')],
+        )
+
+    def test_chave_repetida_devolve_o_resultado_original(self):
+        agora = timezone.now()
+        self.scan(chave='leitura-1', agora=agora)
+        # Mesmo fora da janela de leitura dupla, a chave identifica o mesmo scan
+        repetido = self.scan(chave='leitura-1', agora=agora + 2 * INTERVALO_MINIMO_SCAN)
+        self.assertEqual((repetido.estado, repetido.transicao, repetido.repetido), ('SAIDA', 'SAIDA', True))
+        self.assertEqual(Movimentacao.objects.filter(vale=self.vale).count(), 1)
+
+    def test_chave_de_outro_vale_nao_vale_para_este(self):
+        self.scan(chave='leitura-1')
+        resultado = self.scan(self.segundo, chave='leitura-1')
+        self.assertEqual((resultado.vale_id, resultado.transicao, resultado.repetido), (self.segundo.pk, 'SAIDA', False))
+        self.segundo.refresh_from_db()
+        self.assertEqual(self.segundo.estado, 'SAIDA')
+
+    def test_hash_errado_ou_pj_errada(self):
+        self.scan(chave='leitura-1')
+        # A chave já usada em outro vale não dispensa a conferência do hash
+        with self.assertRaises(ValePallet.DoesNotExist):
+            self.scan(self.segundo, hash_seguranca=self.vale.hash_seguranca, chave='leitura-1')
+        with self.assertRaises(PermissionDenied):
+            self.scan(self.segundo, pessoa_juridica=self.outra)
+        self.segundo.refresh_from_db()
+        self.assertEqual(self.segundo.estado, 'EMITIDO')
+        self.assertFalse(Movimentacao.objects.filter(vale=self.segundo).exists())
+
+
+class RegistroMovimentacoesTests(TestCase):
+    """Movimentações levam o vale ao estado delas com UPDATEs direcionados."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.pj = criar_pessoa_juridica()
+        cls.vales = [criar_vale(cls.pj, numero) for numero in range(1, 7)]
+
+    def movimentacao(self, vale, tipo):
+        return Movimentacao(vale_id=vale.pk, tipo=tipo, responsavel=self.pj.usuario)
+
+    def test_data_so_e_preenchida_se_vazia(self):
+        antes = timezone.now() - datetime.timedelta(days=3)
+        agora = timezone.now()
+        ja_saiu, sem_data = self.vales[:2]
+        ValePallet.objects.filter(pk=ja_saiu.pk).update(data_saida=antes)
+
+        registrar_movimentacoes([self.movimentacao(ja_saiu, 'SAIDA'), self.movimentacao(sem_data, 'SAIDA')], agora)
+        ja_saiu.refresh_from_db()
+        sem_data.refresh_from_db()
+        self.assertEqual((ja_saiu.estado, ja_saiu.data_saida), ('SAIDA', antes))
+        self.assertEqual((sem_data.estado, sem_data.data_saida), ('SAIDA', agora))
+
+    def test_vale_ja_no_estado_nao_e_atualizado(self):
+        vale = self.vales[0]
+        ValePallet.objects.filter(pk=vale.pk).update(estado='SAIDA')
+        movimentacoes = [self.movimentacao(vale, 'SAIDA'), self.movimentacao(self.vales[1], 'EMITIDO')]
+        with CaptureQueriesContext(connection) as consultas:
+            self.assertEqual(aplicar_estados(movimentacoes), 0)
+        self.assertFalse([consulta for consulta in consultas if consulta['sql'].startswith('UPDATE')])
+        vale.refresh_from_db()
+        self.assertIsNone(vale.data_saida)
+
+    def test_lote_de_movimentacoes_mantem_contadores(self):
+        vales = self.vales
+        registrar_movimentacoes(
+            [self.movimentacao(vale, 'SAIDA') for vale in vales[:4]]
+            + [self.movimentacao(vales[0], 'RETORNO'), self.movimentacao(vales[1], 'RETORNO')]
+            + [self.movimentacao(vales[5], 'SCAN')]
+        )
+        estados = dict(ValePallet.objects.filter(pk__in=[vale.pk for vale in vales]).values_list('numero_vale', 'estado'))
+        self.assertEqual(estados, {
+            '1': 'RETORNO', '2': 'RETORNO', '3': 'SAIDA', '4': 'SAIDA', '5': 'EMITIDO', '6': 'EMITIDO',
+        })
+        self.assertEqual(Movimentacao.objects.count(), 7)
+        self.assertEqual(divergencias_contadores(), [])
+
+
+class ImportacaoCadastrosTests(TestCase):
+    """Importação de cadastros por planilha, com relatório de erros por linha."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.pj = criar_pessoa_juridica()
+        Motorista.objects.create(nome='Já cadastrado', cpf='529.982.247-25', telefone='(11) 99999-9999', criado_por=cls.pj)
+
+    def importar(self, *linhas):
+        return importar_cadastros('motoristas', list(linhas), self.pj)
+
+    def test_linhas_com_erro_voltam_no_relatorio(self):
+        relatorio = self.importar(
+            {'nome': 'Ana', 'cpf': '111.444.777-35', 'telefone': '(11) 98888-7777', 'email': 'ana@teste.com'},
+            {'nome': '', 'cpf': '111.444.777-00', 'telefone': '123', 'email': 'sem-arroba'},
+        )
+        self.assertEqual((relatorio.total, relatorio.importados), (2, 1))
+        self.assertEqual(relatorio.erros, [{
+            'linha': 3,
+            'documento': '111.444.777-00',
+            'erros': [
+                'nome: obrigatório', 'cpf: CPF inválido',
+                'telefone: informe DDD + número (10 ou 11 dígitos)', 'email: e-mail inválido',
+            ],
+        }])
+        motorista = Motorista.objects.get(nome='Ana')
+        self.assertEqual((motorista.cpf, motorista.telefone, motorista.criado_por), ('111.444.777-35', '(11) 98888-7777', self.pj))
+
+    def test_documento_repetido_na_planilha_ou_ja_cadastrado(self):
+        relatorio = self.importar(
+            {'Nome': 'Bruno', 'CPF': '11144477735', 'Telefone': '11988887777'},
+            {'Nome': 'Bruno de novo', 'CPF': '111.444.777-35', 'Telefone': '11988887777'},
+            {'Nome': 'Outro', 'CPF': '52998224725', 'Telefone': '11988887777'},
+        )
+        self.assertEqual(relatorio.importados, 1)
+        self.assertEqual([(erro['linha'], erro['erros']) for erro in relatorio.erros], [
+            (3, ['cpf: repetido na planilha (linha 2)']),
+            (4, ['cpf: já cadastrado']),
+        ])
+
+    def test_celulas_numericas_sem_zeros_a_esquerda(self):
+        relatorio = self.importar(
+            # CPF 008.922.383-72 numa coluna numérica (o XLSX pode devolver float)
+            {'nome': 'Carla', 'cpf': 892238372, 'telefone': 11988887777},
+            {'nome': 'Davi', 'cpf': 11144477735.0, 'telefone': 1133334444.0},
+            # Telefone de 9 dígitos não vira (01) ...
+            {'nome': 'Eva', 'cpf': 52998224725, 'telefone': 988887777},
+        )
+        self.assertEqual(relatorio.importados, 2)
+        self.assertEqual(
+            dict(Motorista.objects.filter(nome__in=['Carla', 'Davi']).values_list('cpf', 'telefone')),
+            {'008.922.383-72': '(11) 98888-7777', '111.444.777-35': '(11) 3333-4444'},
+        )
+        self.assertEqual(relatorio.erros[0]['erros'], ['telefone: informe DDD + número (10 ou 11 dígitos)'])
+
+
+class ExportacaoTests(TestCase):
+    """Células seguras contra fórmulas e expiração dos arquivos gerados."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.pj = criar_pessoa_juridica()
+        cls.vale = criar_vale(cls.pj, 1, observacoes='=HYPERLINK("http://x")')
+        Cliente.objects.filter(pk=cls.vale.cliente_id).update(nome='@SUM(1+1)')
+
+    def setUp(self):
+        midia = tempfile.TemporaryDirectory()
+        self.addCleanup(midia.cleanup)
+        configuracao = override_settings(MEDIA_ROOT=midia.name)
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+
+    def test_texto_com_formula_sai_escapado(self):
+        for formato in ('csv', 'xlsx'):
+            linha = next(linhas_exportacao(consulta_exportacao(self.pj.usuario, 'vales', {}), formato))
+            self.assertIn('\'=HYPERLINK("http://x")', linha)
+            self.assertIn("'@SUM(1+1)", linha)
+            # Números (mesmo negativos) e documentos não mudam
+            self.assertIn(1, linha)
+            self.assertIn('11.444.777/0001-61', linha)
+
+    def tarefa_exportacao(self, concluida_ha):
+        nome = default_storage.save(f'{DIRETORIO_EXPORTACOES}/teste/vales.csv', ContentFile(b'ID\n'))
+        return Tarefa.objects.create(
+            funcao='app_controller.exportacao.gerar_arquivo_exportacao',
+            argumentos={'usuario_id': self.pj.usuario.id, 'tipo': 'vales', 'formato': 'csv', 'filtros': {}},
+            status='CONCLUIDA', resultado={'arquivo': nome},
+            concluido_em=timezone.now() - concluida_ha,
+        )
+
+    def test_limpeza_apaga_so_arquivos_vencidos(self):
+        recente = self.tarefa_exportacao(datetime.timedelta(hours=1))
+        vencida = self.tarefa_exportacao(datetime.timedelta(hours=settings.EXPORTACOES_VALIDADE_HORAS + 1))
+        arquivo_vencido = vencida.resultado['arquivo']
+
+        self.assertEqual(limpar_exportacoes(), 1)
+        self.assertFalse(default_storage.exists(arquivo_vencido))
+        self.assertTrue(default_storage.exists(recente.resultado['arquivo']))
+        vencida.refresh_from_db()
+        self.assertEqual(vencida.resultado, {'expirado': True})
+
+        self.client.force_login(self.pj.usuario)
+        resposta = self.client.get(f'/vales/exportacoes/{vencida.id}/')
+        self.assertEqual(resposta.status_code, 410)
+        resposta = self.client.get(f'/vales/exportacoes/{recente.id}/')
+        self.assertEqual(resposta.status_code, 200)
+        resposta.close()
+
+
+def tarefa_ok():
+    return {'ok': True}
+
+
+@override_settings(TAREFAS_PRAZO_EXECUCAO=60)
+class TarefasTests(TestCase):
+    """Tarefas abandonadas por um worker voltam para a fila dentro do limite de tentativas."""
+
+    def tarefa_abandonada(self, tentativas, **campos):
+        return Tarefa.objects.create(
+            funcao='app_controller.tests.tarefa_ok', status='EXECUTANDO', tentativas=tentativas,
+            iniciado_em=timezone.now() - datetime.timedelta(seconds=61), **campos
+        )
+
+    def test_tarefa_abandonada_volta_para_a_fila(self):
+        em_dia = Tarefa.objects.create(
+            funcao='app_controller.tests.tarefa_ok', status='EXECUTANDO', tentativas=1, iniciado_em=timezone.now()
+        )
+        abandonada = self.tarefa_abandonada(1)
+
+        tarefa = reservar_proxima()
+        self.assertEqual((tarefa.pk, tarefa.status, tarefa.tentativas), (abandonada.pk, 'EXECUTANDO', 2))
+        self.assertIsNone(reservar_proxima())
+        self.assertTrue(executar(tarefa))
+        abandonada.refresh_from_db()
+        self.assertEqual((abandonada.status, abandonada.resultado), ('CONCLUIDA', {'ok': True}))
+        em_dia.refresh_from_db()
+        self.assertEqual(em_dia.status, 'EXECUTANDO')
+
+    def test_sem_tentativas_restantes_vira_erro(self):
+        abandonada = self.tarefa_abandonada(3, max_tentativas=3)
+        self.assertIsNone(reservar_proxima())
+        abandonada.refresh_from_db()
+        self.assertEqual((abandonada.status, abandonada.erro), ('ERRO', 'Tempo de execução esgotado'))
+        self.assertIsNotNone(abandonada.concluido_em)
+
+    def test_worker_atrasado_nao_sobrescreve_a_nova_tentativa(self):
+        abandonada = self.tarefa_abandonada(1)
+        atrasada = Tarefa.objects.get(pk=abandonada.pk)
+        reservar_proxima()
+
+        self.assertFalse(executar(atrasada))
+        abandonada.refresh_from_db()
+        self.assertEqual((abandonada.status, abandonada.tentativas), ('EXECUTANDO', 2))
+
+
+class QrCodeValeTests(TestCase):
+    """QR Code sob demanda: formatos, ETag/304, escopo da PJ e cache em memória."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.pj = criar_pessoa_juridica()
+        cls.outra = criar_pessoa_juridica('outra', cnpj='45.723.174/0001-10')
+        cls.vale = criar_vale(cls.pj, 1)
+
+    def setUp(self):
+        self.client.force_login(self.pj.usuario)
+
+    def test_png_e_svg_com_etag(self):
+        etags = set()
+        for formato, tipo in (('png', 'image/png'), ('svg', 'image/svg+xml')):
+            resposta = self.client.get(f'/vales/{self.vale.id}/qrcode.{formato}')
+            self.assertEqual(resposta.status_code, 200)
+            self.assertEqual(resposta['Content-Type'], tipo)
+            self.assertTrue(resposta['ETag'].startswith('"'))
+            self.assertIn('private', resposta['Cache-Control'])
+            etags.add(resposta['ETag'])
+        self.assertEqual(len(etags), 2)
+        self.assertTrue(self.client.get(f'/vales/{self.vale.id}/qrcode.png').content.startswith(b'\x89PNG'))
+
+    def test_if_none_match_responde_304(self):
+        etag = self.client.get(f'/vales/{self.vale.id}/qrcode.png')['ETag']
+        resposta = self.client.get(f'/vales/{self.vale.id}/qrcode.png', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resposta.status_code, 304)
+        self.assertEqual(resposta.content, b'')
+        self.assertEqual(resposta['ETag'], etag)
+
+    def test_vale_de_outra_pj_e_formato_invalido_dao_404(self):
+        self.client.force_login(self.outra.usuario)
+        self.assertEqual(self.client.get(f'/vales/{self.vale.id}/qrcode.png').status_code, 404)
+        self.client.force_login(self.pj.usuario)
+        self.assertEqual(self.client.get(f'/vales/{self.vale.id}/qrcode.gif').status_code, 404)
+
+    def test_renderizacao_repetida_vem_do_lru_cache(self):
+        renderizar_qr_code.cache_clear()
+        self.client.get(f'/vales/{self.vale.id}/qrcode.png')
+        with mock.patch('app_controller.utils.generate_qr_code', side_effect=AssertionError):
+            resposta = self.client.get(f'/vales/{self.vale.id}/qrcode.png')
+        self.assertEqual(resposta.status_code, 200)
+        info = renderizar_qr_code.cache_info()
+        self.assertEqual((info.misses, info.hits), (1, 1))
+
+
+class PaginacaoCursorTests(TestCase):
+    """Paginação por cursor: empate em data_emissao desfeito pelo id e cursores inválidos."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.pj = criar_pessoa_juridica()
+        vales = [criar_vale(cls.pj, numero) for numero in range(1, 26)]
+        # Blocos de 5 vales com a mesma data de emissão: a ordem depende do id
+        base = timezone.now().replace(microsecond=0)
+        for indice, vale in enumerate(vales):
+            ValePallet.objects.filter(pk=vale.pk).update(data_emissao=base - datetime.timedelta(hours=indice // 5))
+        cls.esperado = list(ValePallet.objects.order_by('-data_emissao', '-id').values_list('id', flat=True))
+
+    def ids(self, pagina):
+        return [vale.id for vale in pagina]
+
+    def test_avanca_e_volta_sem_repetir_nem_pular(self):
+        paginas = [paginar_por_cursor(ValePallet.objects.all(), None, por_pagina=7)]
+        while paginas[-1].has_next:
+            paginas.append(paginar_por_cursor(ValePallet.objects.all(), paginas[-1].proximo_cursor, por_pagina=7))
+        self.assertEqual([id for pagina in paginas for id in self.ids(pagina)], self.esperado)
+        self.assertEqual([len(pagina) for pagina in paginas], [7, 7, 7, 4])
+        self.assertFalse(paginas[0].has_previous)
+
+        anterior = paginar_por_cursor(ValePallet.objects.all(), paginas[2].cursor_anterior, por_pagina=7)
+        self.assertEqual(self.ids(anterior), self.ids(paginas[1]))
+        self.assertTrue(anterior.has_previous and anterior.has_next)
+
+    def test_cursor_adulterado_ou_vencido_volta_para_a_primeira_pagina(self):
+        primeira = paginar_por_cursor(ValePallet.objects.all(), None, por_pagina=7)
+        cursor = primeira.proximo_cursor
+        adulterado = cursor[:-2] + ('AA' if not cursor.endswith('AA') else 'BB')
+        self.assertEqual(self.ids(paginar_por_cursor(ValePallet.objects.all(), adulterado, por_pagina=7)), self.ids(primeira))
+
+        depois = time.time() + VALIDADE_CURSOR + 1
+        with mock.patch('django.core.signing.time.time', return_value=depois):
+            vencido = paginar_por_cursor(ValePallet.objects.all(), cursor, por_pagina=7)
+        self.assertEqual(self.ids(vencido), self.ids(primeira))
+
+    def test_links_de_pagina_codificam_os_filtros(self):
+        self.client.force_login(self.pj.usuario)
+        # Parâmetro sem filtro correspondente: a listagem tem todos os vales e o link o repassa
+        resposta = self.client.get('/vales/', {'paginacao': 'cursor', 'origem': 'a&b #1'})
+        self.assertEqual(resposta.status_code, 200)
+        proximo = re.search(r'href="\?cursor=([^"&]+)&paginacao=cursor&([^"]*)" aria-label="Next"', resposta.content.decode())
+        self.assertIsNotNone(proximo)
+        self.assertEqual(proximo.group(2), 'origem=a%26b+%231')
+
+
+class ModalDashboardTests(TestCase):
+    """Endpoint do modal do dashboard: páginas por cursor e streaming NDJSON."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.pj = criar_pessoa_juridica()
+        cls.staff = Usuario.objects.create_user(username='staff', email='staff@teste.com', password='senha', is_staff=True)
+        base = timezone.now().replace(microsecond=0)
+        for numero in range(1, 13):
+            vencido = numero % 3 == 0
+            vale = criar_vale(
+                cls.pj, numero, estado='SAIDA' if vencido else 'EMITIDO',
+                data_validade=base - datetime.timedelta(days=5) if vencido else base + datetime.timedelta(days=10),
+            )
+            # Pares com a mesma data de emissão
+            ValePallet.objects.filter(pk=vale.pk).update(data_emissao=base - datetime.timedelta(hours=numero // 2))
+        cls.esperado = list(ValePallet.objects.order_by('-data_emissao', '-id').values_list('numero_vale', flat=True))
+
+    def setUp(self):
+        self.client.force_login(self.staff)
+
+    def test_paginas_nao_repetem_nem_pulam_vales(self):
+        numeros, cursor, paginas = [], None, 0
+        while True:
+            parametros = {'tipo': 'todos', 'limite': 5}
+            if cursor:
+                parametros['cursor'] = cursor
+            dados = self.client.get('/movimentacoes/filtrar/', parametros).json()
+            numeros += [vale['numero_vale'] for vale in dados['vales']]
+            paginas += 1
+            cursor = dados['proximo_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(paginas, 3)
+        self.assertEqual(numeros, self.esperado)
+        self.assertEqual(dados['total'], 12)
+
+    def test_ndjson_transmite_um_vale_por_linha_com_filtros(self):
+        resposta = self.client.get('/movimentacoes/filtrar/', {'tipo': 'vencidos', 'formato': 'ndjson', 'limite': 3})
+        self.assertIsInstance(resposta, StreamingHttpResponse)
+        self.assertEqual(resposta['Content-Type'], 'application/x-ndjson')
+        linhas = [json.loads(linha) for linha in b''.join(resposta.streaming_content).decode().splitlines()]
+        vencidos = [numero for numero in self.esperado if int(numero) % 3 == 0]
+        self.assertEqual([linha['numero_vale'] for linha in linhas[:-1]], vencidos[:3])
+        self.assertTrue(all(linha['estado'] == 'SAIDA' for linha in linhas[:-1]))
+
+        resposta = self.client.get('/movimentacoes/filtrar/', {
+            'tipo': 'vencidos', 'formato': 'ndjson', 'cursor': linhas[-1]['proximo_cursor'],
+        })
+        resto = [json.loads(linha) for linha in b''.join(resposta.streaming_content).decode().splitlines()]
+        self.assertEqual([linha['numero_vale'] for linha in resto], vencidos[3:])
+
+
+class ListagemCadastrosTests(TestCase):
+    """Listagens de cadastros paginadas por cursor, com busca por prefixo."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.pj = criar_pessoa_juridica()
+        outra = criar_pessoa_juridica('outra', cnpj='45.723.174/0001-10')
+        Motorista.objects.bulk_create([
+            Motorista(nome=f'Motorista {i:03d}', cpf=formatar_cpf(f'{i:011d}'),
+                      telefone='(11) 99999-9999', criado_por=cls.pj)
+            for i in range(120)
+        ] + [Motorista(nome='Alheio', cpf='529.982.247-25', telefone='(11) 99999-9999', criado_por=outra)])
+
+    def setUp(self):
+        self.client.force_login(self.pj.usuario)
+
+    def test_pagina_so_mostra_motoristas_da_pj(self):
+        pagina = self.client.get('/motoristas/').context['pagina']
+        self.assertEqual(len(pagina), POR_PAGINA_CADASTROS)
+        self.assertEqual(pagina.total, 120)
+        self.assertNotIn('Alheio', [motorista.nome for motorista in pagina])
+
+    def test_proxima_pagina_continua_da_anterior(self):
+        primeira = self.client.get('/motoristas/', {'ordem': '-nome'}).context['pagina']
+        segunda = self.client.get('/motoristas/', {'ordem': '-nome', 'cursor': primeira.proximo_cursor}).context['pagina']
+        self.assertEqual(primeira.object_list[-1].nome, 'Motorista 070')
+        self.assertEqual(segunda.object_list[0].nome, 'Motorista 069')
+
+    def test_busca_por_prefixo_de_nome_e_de_documento(self):
+        por_nome = self.client.get('/motoristas/', {'busca': 'motorista 11'}).context['pagina']
+        self.assertEqual([motorista.nome for motorista in por_nome], [f'Motorista {i}' for i in range(110, 120)])
+        # Dígitos sem máscara casam com o CPF gravado formatado
+        por_cpf = self.client.get('/motoristas/', {'busca': '0000000011'}).context['pagina']
+        self.assertEqual([motorista.nome for motorista in por_cpf], [f'Motorista {i}' for i in range(110, 120)])
+
+    def test_custo_da_pagina_nao_depende_do_tamanho_do_cadastro(self):
+        with self.assertNumQueries(5):
+            self.client.get('/motoristas/')
+        Motorista.objects.bulk_create([
+            Motorista(nome=f'Extra {i:03d}', cpf=formatar_cpf(f'{i + 1000:011d}'),
+                      telefone='(11) 99999-9999', criado_por=self.pj)
+            for i in range(200)
+        ])
+        with self.assertNumQueries(5):
+            self.client.get('/motoristas/')
+
+
+class AutocompletarTests(TestCase):
+    """Campos de cadastro do formulário de vale buscados sob demanda."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.pj = criar_pessoa_juridica()
+        outra = criar_pessoa_juridica('outra', cnpj='45.723.174/0001-10')
+        Motorista.objects.bulk_create([
+            Motorista(nome=f'Motorista {i:03d}', cpf=formatar_cpf(f'{i:011d}'),
+                      telefone='(11) 99999-9999', criado_por=cls.pj)
+            for i in range(50)
+        ] + [Motorista(nome='Motorista alheio', cpf='529.982.247-25', telefone='(11) 99999-9999', criado_por=outra)])
+
+    def setUp(self):
+        self.client.force_login(self.pj.usuario)
+
+    def test_resultados_limitados_e_no_escopo_da_pj(self):
+        resultados = self.client.get('/cadastros/autocompletar/motoristas/', {'q': 'motorista'}).json()['resultados']
+        self.assertEqual(len(resultados), LIMITE_AUTOCOMPLETAR)
+        self.assertEqual(resultados[0]['texto'], 'Motorista 000 - 000.000.000-00')
+        self.assertNotIn('Motorista alheio', [resultado['texto'] for resultado in resultados])
+
+    def test_pessoas_juridicas_so_para_staff(self):
+        self.assertEqual(self.client.get('/cadastros/autocompletar/pessoas_juridicas/').status_code, 403)
+
+    def test_formulario_nao_renderiza_o_catalogo(self):
+        motorista = Motorista.objects.get(nome='Motorista 010')
+        form = ValePalletForm(initial={'motorista': motorista.pk}, user=self.pj.usuario)
+        html = str(form['motorista'])
+        self.assertIn('Motorista 010 - 000.000.000-10', html)
+        self.assertEqual(html.count('<option'), 2)
+
+
+class OpcoesFiltrosTests(TestCase):
+    """Opções dos filtros da listagem de vales em cache, por PJ."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.pj = criar_pessoa_juridica()
+        cls.outra = criar_pessoa_juridica('outra', cnpj='45.723.174/0001-10')
+        Cliente.objects.create(nome='Cliente da PJ', cnpj='11.444.777/0001-61', telefone='(11) 99999-9999', criado_por=cls.pj)
+        Cliente.objects.create(nome='Cliente alheio', cnpj='19.131.243/0001-97', telefone='(11) 99999-9999', criado_por=cls.outra)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_opcoes_no_escopo_da_pj_e_em_cache(self):
+        opcoes = opcoes_filtros(self.pj.usuario)
+        self.assertEqual([nome for _, nome in opcoes['clientes']], ['Cliente da PJ'])
+        self.assertEqual(opcoes['responsaveis'], [(self.pj.id, self.pj.razao_social)])
+        with self.assertNumQueries(0):
+            opcoes_filtros(self.pj.usuario)
+
+    def test_cadastro_salvo_invalida_o_escopo(self):
+        opcoes_filtros(self.pj.usuario)
+        Cliente.objects.create(nome='Novo cliente', cnpj='45.997.418/0001-53', telefone='(11) 99999-9999', criado_por=self.pj)
+        self.assertIn('Novo cliente', [nome for _, nome in opcoes_filtros(self.pj.usuario)['clientes']])
+
+
+class DetalhesValeTests(TestCase):
+    """Página de detalhes do vale com movimentações e documentos em prefetch."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.pj = criar_pessoa_juridica()
+        cls.vale = criar_vale(cls.pj, 1)
+
+    def setUp(self):
+        self.client.force_login(self.pj.usuario)
+
+    def adicionar_historico(self, quantidade):
+        for _ in range(quantidade):
+            Movimentacao.objects.create(vale=self.vale, tipo='EMITIDO', responsavel=self.pj.usuario)
+            DocumentoVale.objects.create(
+                vale=self.vale, arquivo='vales/documentos/nota.pdf', nome_original='nota.pdf', usuario=self.pj.usuario
+            )
+
+    def consultas_da_pagina(self):
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.get(f'/vales/detalhes/{self.vale.id}/')
+        self.assertEqual(response.status_code, 200)
+        return len(consultas)
+
+    def test_consultas_nao_crescem_com_o_historico(self):
+        self.adicionar_historico(1)
+        poucas = self.consultas_da_pagina()
+        self.adicionar_historico(20)
+        self.assertEqual(self.consultas_da_pagina(), poucas)
+
+
+class MonitorConsultasTests(TestCase):
+    """Orçamento de consultas por view e detecção de consultas repetidas (N+1)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.pj = criar_pessoa_juridica()
+        cls.vales = [criar_vale(cls.pj, numero) for numero in range(1, 8)]
+
+    def test_consultas_de_mesma_forma_sao_agrupadas(self):
+        with registrar_consultas() as registro:
+            for vale in ValePallet.objects.filter(pk__in=[vale.pk for vale in self.vales]):
+                vale.cliente.nome
+        forma, vezes = registro.mais_repetida()
+        self.assertEqual(vezes, len(self.vales))
+        self.assertIn('app_controller_cliente', forma)
+        self.assertEqual(
+            forma_consulta('SELECT 1 FROM t WHERE id IN (%s, %s) AND nome = \'a\''),
+            forma_consulta('SELECT 2 FROM t WHERE id IN (%s) AND nome = \'b\''),
+        )
+
+    def test_str_nao_carrega_relacionamentos(self):
+        movimentacao = Movimentacao.objects.create(vale=self.vales[0], tipo='EMITIDO', responsavel=self.pj.usuario)
+        vale = ValePallet.objects.get(pk=self.vales[0].pk)
+        movimentacao = Movimentacao.objects.get(pk=movimentacao.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(str(vale), 'Vale 1')
+            str(movimentacao)
+
+    def test_view_acima_do_orcamento_falha(self):
+        self.client.force_login(self.pj.usuario)
+        with override_settings(ORCAMENTO_CONSULTAS={'valepallet_listar': 1}):
+            with self.assertRaises(OrcamentoConsultasExcedido):
+                self.client.get('/vales/')
+
+
+class OrcamentoViewsTests(TestCase):
+    """Cada view com orçamento, em GET e POST, cabe no orçamento configurado."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.pj = criar_pessoa_juridica()
+        cls.vale = criar_vale(cls.pj, 1)
+        Cliente.objects.update(criado_por=cls.pj)
+        Motorista.objects.update(criado_por=cls.pj)
+        Transportadora.objects.update(criado_por=cls.pj)
+        cls.staff = Usuario.objects.create_user(username='staff', password='senha', is_staff=True)
+
+    def dados_vale(self, numero, dias=5, pj=None):
+        pj = pj or self.pj
+        return {
+            'numero_vale': numero,
+            'cliente': Cliente.objects.get(criado_por=pj).pk,
+            'motorista': Motorista.objects.get(criado_por=pj).pk,
+            'transportadora': Transportadora.objects.get(criado_por=pj).pk,
+            'data_validade': (timezone.localdate() + datetime.timedelta(days=dias)).isoformat(),
+            'qtd_pbr': 2,
+            'qtd_chepp': 1,
+        }
+
+    def requisitar(self, usuario, metodo, url, dados=None, status=200):
+        self.client.force_login(usuario)
+        with CaptureQueriesContext(connection) as consultas:
+            response = getattr(self.client, metodo)(url, dados or {})
+        self.assertEqual(response.status_code, status, url)
+        view = response.resolver_match.view_name
+        limite = orcamento(view, metodo.upper())
+        self.assertIsNotNone(limite, f'{view} ({metodo.upper()}) sem orçamento')
+        self.assertLessEqual(len(consultas), limite, f'{view} ({metodo.upper()})')
+        return view
+
+    def test_views_cabem_no_orcamento(self):
+        usuario, vale = self.pj.usuario, self.vale
+        # Primeiro vale de uma PJ nova: cria as linhas de contador e de resumo
+        nova = criar_pessoa_juridica('nova', cnpj='45.723.174/0001-10')
+        Cliente.objects.create(nome='Cliente novo', cnpj='45.997.418/0001-53', telefone='(11) 99999-9999', criado_por=nova)
+        Motorista.objects.create(nome='Motorista novo', cpf='111.444.777-35', telefone='(11) 99999-9999', criado_por=nova)
+        Transportadora.objects.create(nome='Transp. nova', cnpj='11.222.333/0001-81', telefone='(11) 99999-9999', criado_por=nova)
+        primeiro_da_pj = self.dados_vale('500', pj=nova)
+
+        testadas = {
+            self.requisitar(usuario, 'get', '/painel/'),
+            self.requisitar(usuario, 'get', '/clientes/'),
+            self.requisitar(usuario, 'get', '/motoristas/'),
+            self.requisitar(usuario, 'get', '/transportadoras/'),
+            self.requisitar(usuario, 'get', '/cadastros/autocompletar/clientes/', {'q': 'cli'}),
+            self.requisitar(usuario, 'get', '/vales/'),
+            self.requisitar(self.staff, 'get', '/vales/'),
+            self.requisitar(usuario, 'get', '/vales/cadastrar/'),
+            self.requisitar(usuario, 'post', '/vales/cadastrar/', self.dados_vale('2'), status=302),
+            # Inválido (número repetido): o formulário volta preenchido
+            self.requisitar(usuario, 'post', '/vales/cadastrar/', self.dados_vale('1')),
+            self.requisitar(nova.usuario, 'post', '/vales/cadastrar/', primeiro_da_pj, status=302),
+            self.requisitar(usuario, 'get', f'/vales/editar/{vale.id}/'),
+            self.requisitar(usuario, 'post', f'/vales/editar/{vale.id}/', self.dados_vale('1', dias=30), status=302),
+            self.requisitar(usuario, 'post', f'/vales/editar/{vale.id}/', self.dados_vale('2')),
+            self.requisitar(usuario, 'get', f'/vales/detalhes/{vale.id}/'),
+            self.requisitar(usuario, 'get', f'/vales/{vale.id}/detalhes/'),
+            self.requisitar(self.staff, 'get', '/movimentacoes/'),
+            self.requisitar(usuario, 'get', '/dashboard/filtrar/', {'periodo': 'todos'}),
+            self.requisitar(usuario, 'get', '/dashboard/filtrar/', {'periodo': 'mes'}),
+            self.requisitar(self.staff, 'get', '/dashboard/filtrar/', {'periodo': 'semana'}),
+        }
+        # Toda view com orçamento precisa estar coberta aqui
+        self.assertEqual(testadas, set(settings.ORCAMENTO_CONSULTAS))
+
+
+@override_settings(CONSULTA_CNPJ_BACKEND='local')
+class ConsultaCNPJTests(TestCase):
+    """Cache, cache negativo e circuit breaker da consulta de CNPJ."""
+
+    CNPJ = '11444777000161'
+
+    def setUp(self):
+        cache.clear()
+        consultas.disjuntor_cnpj.reiniciar()
+        self.addCleanup(consultas.disjuntor_cnpj.reiniciar)
+
+    def test_consulta_repetida_nao_chama_servico_nem_banco(self):
+        dados = consultas.consultar_cnpj(self.CNPJ)
+        self.assertTrue(dados['valido'])
+        with mock.patch.dict(consultas.BACKENDS_CNPJ, local=mock.Mock(side_effect=AssertionError)):
+            with self.assertNumQueries(0):
+                self.assertEqual(consultas.consultar_cnpj(self.CNPJ), dados)
+
+    def test_cnpj_nao_encontrado_fica_em_cache_por_menos_tempo(self):
+        backend = mock.Mock(return_value={'valido': False, 'erro': 'CNPJ não encontrado'})
+        with mock.patch.dict(consultas.BACKENDS_CNPJ, local=backend):
+            consultas.consultar_cnpj(self.CNPJ)
+            cache.clear()
+            consultas.consultar_cnpj(self.CNPJ)
+        backend.assert_called_once_with(self.CNPJ)
+        gravada = ConsultaExterna.objects.get(servico='cnpj', chave=self.CNPJ)
+        self.assertFalse(gravada.encontrado)
+        self.assertLessEqual(gravada.expira_em - gravada.consultado_em, consultas.TTL_CNPJ_NAO_ENCONTRADO)
+
+    def test_circuito_abre_e_usa_resultado_vencido(self):
+        consultas.consultar_cnpj(self.CNPJ)
+        ConsultaExterna.objects.update(expira_em=timezone.now())
+        cache.clear()
+
+        backend = mock.Mock(side_effect=consultas.ServicoIndisponivel('fora do ar'))
+        with mock.patch.dict(consultas.BACKENDS_CNPJ, local=backend):
+            for _ in range(consultas.disjuntor_cnpj.limite_falhas + 2):
+                self.assertTrue(consultas.consultar_cnpj(self.CNPJ)['valido'])
+            self.assertTrue(consultas.disjuntor_cnpj.aberto)
+            self.assertEqual(backend.call_count, consultas.disjuntor_cnpj.limite_falhas)
+
+            with self.assertRaises(consultas.ServicoIndisponivel):
+                consultas.consultar_cnpj('19131243000197')
+
+    async def test_view_async_consulta_uma_vez(self):
+        backend = mock.Mock(side_effect=consultas._cnpj_local)
+        with mock.patch.dict(consultas.BACKENDS_CNPJ, local=backend):
+            for _ in range(3):
+                response = await self.async_client.get('/api/validarCNPJ/', {'cnpj': '11.444.777/0001-61'})
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response.json()['valido'])
+        backend.assert_called_once_with(self.CNPJ)
+
+    async def test_consultas_async_simultaneas_chamam_o_servico_uma_vez(self):
+        chamadas = []
+
+        async def backend(cnpj):
+            chamadas.append(cnpj)
+            await asyncio.sleep(0.05)
+            return consultas._cnpj_local(cnpj)
+
+        with mock.patch.dict(consultas.BACKENDS_CNPJ_ASYNC, local=backend):
+            resultados = await asyncio.gather(*[consultas.aconsultar_cnpj(self.CNPJ) for _ in range(5)])
+        self.assertEqual(chamadas, [self.CNPJ])
+        self.assertTrue(all(dados == resultados[0] for dados in resultados))
+
+
+class ClienteHttpAsyncTests(TestCase):
+    """Um httpx.AsyncClient por event loop, aberto e fechado pelo lifespan do ASGI."""
+
+    async def test_lifespan_abre_e_fecha_o_cliente_compartilhado(self):
+        from pallet_controller.asgi import application
+
+        fila = asyncio.Queue()
+        enviadas = []
+
+        async def enviar(mensagem):
+            enviadas.append(mensagem['type'])
+
+        servidor = asyncio.ensure_future(application({'type': 'lifespan'}, fila.get, enviar))
+        await fila.put({'type': 'lifespan.startup'})
+        while not enviadas:
+            await asyncio.sleep(0)
+
+        async with consultas.cliente_http_async() as primeiro, consultas.cliente_http_async() as segundo:
+            self.assertIs(primeiro, segundo)
+        self.assertFalse(primeiro.is_closed)
+
+        await fila.put({'type': 'lifespan.shutdown'})
+        await servidor
+        self.assertEqual(enviadas, ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+        self.assertTrue(primeiro.is_closed)
+        self.assertNotIn(asyncio.get_running_loop(), consultas._clientes_async)
+
+    async def test_sem_lifespan_o_cliente_vale_so_para_a_chamada(self):
+        async with consultas.cliente_http_async() as cliente:
+            self.assertFalse(cliente.is_closed)
+        self.assertTrue(cliente.is_closed)
+
+
+class ConsultaCEPTests(TestCase):
+    """Base local de CEPs com o ViaCEP só como fallback."""
+
+    ENDERECO = {
+        'logradouro': 'Praça da Sé', 'complemento': 'lado ímpar', 'bairro': 'Sé',
+        'cidade': 'São Paulo', 'uf': 'SP', 'codigo_ibge': '3550308',
+    }
+
+    def setUp(self):
+        consultas.limpar_cache_ceps()
+        consultas.disjuntor_viacep.reiniciar()
+
+    def test_cep_da_base_local_nao_chama_viacep(self):
+        Cep.objects.create(cep='01001000', **self.ENDERECO)
+        with mock.patch.object(consultas, '_cep_viacep', side_effect=AssertionError):
+            self.assertEqual(consultas.consultar_cep('01001000')['DsEnderecoCidade'], 'São Paulo')
+            with self.assertNumQueries(0):
+                consultas.consultar_cep('01001000')
+
+    def test_cep_do_viacep_e_gravado_na_base(self):
+        with mock.patch.object(consultas, '_cep_viacep', return_value=self.ENDERECO) as viacep:
+            consultas.consultar_cep('01001000')
+            consultas.limpar_cache_ceps()
+            consultas.consultar_cep('01001000')
+        viacep.assert_called_once_with('01001000')
+        self.assertEqual(Cep.objects.get(pk='01001000').origem, 'VIACEP')
+
+
+class LocalidadesTests(TestCase):
+    """Estados e municípios servidos das tabelas locais, com ETag e carga inicial do IBGE."""
+
+    def setUp(self):
+        localidades.limpar_cache_localidades()
+        localidades.disjuntor_ibge.reiniciar()
+        self.addCleanup(localidades.limpar_cache_localidades)
+        self.addCleanup(localidades.disjuntor_ibge.reiniciar)
+
+    def ibge(self, **kwargs):
+        return mock.patch.object(localidades, '_baixar_localidades', **kwargs)
+
+    def localidades_ibge(self):
+        return (
+            [Estado(id=35, sigla='SP', nome='São Paulo'), Estado(id=33, sigla='RJ', nome='Rio de Janeiro')],
+            [
+                Municipio(id=3550308, nome='São Paulo', estado_id=35),
+                Municipio(id=3509502, nome='Campinas', estado_id=35),
+                Municipio(id=3304557, nome='Rio de Janeiro', estado_id=33),
+            ],
+        )
+
+    def test_tabelas_preenchidas_nao_chamam_o_ibge(self):
+        estados, municipios = self.localidades_ibge()
+        Estado.objects.bulk_create(estados)
+        Municipio.objects.bulk_create(municipios)
+
+        with self.ibge(side_effect=AssertionError):
+            resposta = self.client.get('/api/estados/')
+            self.assertEqual(resposta.status_code, 200)
+            self.assertEqual([estado['sigla'] for estado in resposta.json()['estados']], ['RJ', 'SP'])
+
+            resposta = self.client.get('/api/municipios/sp/')
+            self.assertEqual([municipio['nome'] for municipio in resposta.json()['municipios']], ['Campinas', 'São Paulo'])
+            with self.assertNumQueries(0):
+                self.assertEqual(self.client.get('/api/municipios/xx/').status_code, 404)
+
+    def test_etag_e_if_none_match(self):
+        with self.ibge(return_value=self.localidades_ibge()):
+            etag = self.client.get('/api/estados/')['ETag']
+            resposta = self.client.get('/api/estados/', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(resposta.status_code, 304)
+            self.assertEqual(resposta['ETag'], etag)
+            etag_sp = self.client.get('/api/municipios/SP/')['ETag']
+            self.assertNotEqual(etag_sp, etag)
+            self.assertEqual(self.client.get('/api/municipios/sp/', HTTP_IF_NONE_MATCH=etag_sp).status_code, 304)
+
+    def test_tabelas_vazias_sao_carregadas_uma_vez(self):
+        with self.ibge(return_value=self.localidades_ibge()) as baixar:
+            self.assertEqual(self.client.get('/api/estados/').status_code, 200)
+            self.assertEqual(self.client.get('/api/municipios/RJ/').status_code, 200)
+        baixar.assert_called_once_with()
+        self.assertEqual((Estado.objects.count(), Municipio.objects.count()), (2, 3))
+
+    def test_ibge_indisponivel_responde_503(self):
+        with self.ibge(side_effect=consultas.ServicoIndisponivel('ibge: fora do ar')):
+            resposta = self.client.get('/api/estados/')
+            self.assertEqual(resposta.status_code, 503)
+            self.assertEqual(resposta.json(), {'erro': 'Serviço indisponível'})
+            self.assertEqual(self.client.get('/api/municipios/SP/').status_code, 503)
+        self.assertFalse(Estado.objects.exists())
+
+
+def _pdf_falso(html, base_url=None):
+    return b'%PDF-' + html.encode('utf-8')[-64:]
+
+
+@override_settings(PDF_PROCESSOS=0)
+class DocumentosPdfTests(TestCase):
+    """PDFs versionados pelo conteúdo e documentos em lote (ZIP/PDF único), sem WeasyPrint."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.pj = criar_pessoa_juridica()
+        cls.vales = [criar_vale(cls.pj, numero) for numero in (101, 102, 103)]
+        criar_vale(cls.pj, 104, estado='SAIDA')
+
+    def setUp(self):
+        midia = tempfile.TemporaryDirectory()
+        self.addCleanup(midia.cleanup)
+        configuracao = override_settings(MEDIA_ROOT=midia.name)
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+
+        escrever = mock.patch.object(pdfs, '_escrever_pdf', side_effect=_pdf_falso)
+        self.escrever = escrever.start()
+        self.addCleanup(escrever.stop)
+        self.client.force_login(self.pj.usuario)
+
+    def versoes(self, vale):
+        try:
+            return default_storage.listdir(f'{pdfs.DIRETORIO_PDFS}/vales/{vale.id}')[1]
+        except FileNotFoundError:
+            return []
+
+    def test_pdf_reaproveitado_ate_o_vale_mudar(self):
+        vale = self.vales[0]
+        url = f'/vales/{vale.id}/documento/retirada.pdf'
+        primeira = self.client.get(url)
+        self.assertEqual(primeira.status_code, 200)
+        self.assertEqual(b''.join(primeira.streaming_content)[:5], b'%PDF-')
+        segunda = self.client.get(url)
+        b''.join(segunda.streaming_content)
+        self.assertEqual(segunda['ETag'], primeira['ETag'])
+        self.assertEqual(self.escrever.call_count, 1)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=primeira['ETag']).status_code, 304)
+        versao_antiga = self.versoes(vale)
+        self.assertEqual(len(versao_antiga), 1)
+
+        vale.qtd_pbr = 40
+        vale.save()
+        terceira = self.client.get(url)
+        b''.join(terceira.streaming_content)
+        self.assertNotEqual(terceira['ETag'], primeira['ETag'])
+        self.assertEqual(self.escrever.call_count, 2)
+        versoes = self.versoes(vale)
+        self.assertEqual(len(versoes), 1)
+        self.assertNotEqual(versoes, versao_antiga)
+
+    def test_zip_com_um_pdf_por_vale_filtrado(self):
+        resposta = self.client.get('/vales/documentos/', {'tipo': 'retirada', 'formato': 'zip', 'estado': 'EMITIDO'})
+        self.assertEqual(resposta.status_code, 200)
+        self.assertIsInstance(resposta, StreamingHttpResponse)
+        with zipfile.ZipFile(io.BytesIO(b''.join(resposta.streaming_content))) as arquivo:
+            self.assertEqual(
+                arquivo.namelist(),
+                [f'vale_{numero}_retirada.pdf' for numero in (101, 102, 103)]
+            )
+        # As versões gravadas são reaproveitadas no próximo lote
+        self.assertEqual(self.escrever.call_count, 3)
+        b''.join(self.client.get('/vales/documentos/', {'formato': 'zip', 'estado': 'EMITIDO'}).streaming_content)
+        self.assertEqual(self.escrever.call_count, 3)
+
+    def test_pdf_unico_dentro_do_limite(self):
+        with mock.patch.object(pdfs, '_escrever_pdf_unico', return_value=b'%PDF-unico') as escrever_unico:
+            resposta = self.client.get('/vales/documentos/', {'formato': 'pdf', 'estado': 'EMITIDO'})
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta.content, b'%PDF-unico')
+        self.assertEqual(len(escrever_unico.call_args.args[0]), 3)
+
+        with mock.patch('app_controller.views.LIMITE_PDF_UNICO', 2):
+            resposta = self.client.get('/vales/documentos/', {'formato': 'pdf', 'estado': 'EMITIDO'})
+        self.assertEqual(resposta.status_code, 400)
+
+    def test_filtro_vazio_responde_404(self):
+        resposta = self.client.get('/vales/documentos/', {'formato': 'zip', 'estado': 'RETORNO'})
+        self.assertEqual(resposta.status_code, 404)
+        self.escrever.assert_not_called()
+
+    def test_lote_grande_vira_tarefa(self):
+        with mock.patch('app_controller.views.LIMITE_DOCUMENTOS_DIRETO', 2):
+            resposta = self.client.get('/vales/documentos/', {'formato': 'zip', 'estado': 'EMITIDO'})
+        self.assertEqual(resposta.status_code, 202)
+        tarefa = Tarefa.objects.get(pk=resposta.json()['tarefa'])
+        self.assertEqual(tarefa.funcao, 'app_controller.documentos.gerar_arquivo_documentos')
+        self.assertEqual(tarefa.argumentos['filtros'], {'estado': 'EMITIDO'})
+        self.escrever.assert_not_called()
@@ -0,0 +1,133 @@
+"""
+Máquina de estados do vale para o scan do QR Code.
+
+EMITIDO -> SAIDA -> RETORNO. Cada transição é feita com a linha do vale
+travada (``select_for_update``) e gravada com um ``UPDATE ... WHERE estado
+= <origem>`` condicional, de modo que dois leitores escaneando o mesmo QR
+ao mesmo tempo não registram a mesma transição duas vezes.
+
+Repetições são tratadas como idempotentes:
+
+* com ``chave`` (enviada pelo leitor, uma por scan), um scan já processado
+  no mesmo vale devolve o resultado original sem nova transição. A chave é
+  conferida com o vale travado e depois das verificações de hash e de PJ,
+  e só vale para aquele vale: a mesma chave em outro vale não o afeta;
+* sem chave, o mesmo usuário escaneando de novo logo após a transição que
+  ele acabou de registrar (dentro de ``INTERVALO_MINIMO_SCAN``) é
+  considerado leitura dupla e recebe o resultado daquela transição, em vez
+  de pular direto para RETORNO. Scans de outros usuários seguem normalmente.
+"""
+import datetime
+from dataclasses import dataclass
+
+from django.core.exceptions import PermissionDenied
+from django.db import transaction
+from django.utils import timezone
+
+from .contadores import atualizar_contadores
+from .models import Movimentacao, ValePallet
+
+
+INTERVALO_MINIMO_SCAN = datetime.timedelta(minutes=2)
+
+# Estado de origem -> (estado de destino, campo de data, campo de usuário, observação)
+TRANSICOES = {
+    'EMITIDO': ('SAIDA', 'data_saida', 'usuario_saida', 'Saída registrada via QR Code'),
+    'SAIDA': ('RETORNO', 'data_retorno', 'usuario_retorno', 'Retorno registrado via QR Code'),
+}
+
+# Estado de destino -> (campo de data, campo de usuário) da transição que levou a ele
+CAMPOS_DESTINO = {
+    destino: (campo_data, campo_usuario)
+    for destino, campo_data, campo_usuario, _ in TRANSICOES.values()
+}
+
+
+@dataclass
+class ResultadoScan:
+    vale_id: int
+    estado: str
+    # Tipo da movimentação registrada (SAIDA/RETORNO); None se nada mudou
+    transicao: str = None
+    # True quando o scan foi reconhecido como repetição de um anterior
+    repetido: bool = False
+
+
+def _leitura_dupla(vale, usuario, agora):
+    """
+    Scan sem chave que repete, pelo mesmo usuário e dentro de
+    ``INTERVALO_MINIMO_SCAN``, a transição que levou o vale ao estado atual
+    """
+    if vale.estado not in CAMPOS_DESTINO:
+        return False
+    campo_data, campo_usuario = CAMPOS_DESTINO[vale.estado]
+    quando = getattr(vale, campo_data)
+    return (
+        quando is not None
+        and agora - quando < INTERVALO_MINIMO_SCAN
+        and getattr(vale, f'{campo_usuario}_id') == usuario.pk
+    )
+
+
+def _resultado_da_chave(vale, chave):
+    movimentacao = Movimentacao.objects.filter(vale_id=vale.pk, chave_idempotencia=chave).first()
+    if movimentacao is None:
+        return None
+    return ResultadoScan(vale.id, vale.estado, movimentacao.tipo, repetido=True)
+
+
+def registrar_scan(vale_id, hash_seguranca, usuario, pessoa_juridica=None, chave=None, agora=None):
+    """
+    Aplica a próxima transição do vale. ``pessoa_juridica`` restringe o scan
+    aos vales da PJ (``None`` para staff). Levanta ``ValePallet.DoesNotExist``
+    para vale/hash inexistente e ``PermissionDenied`` para vale de outra PJ.
+    """
+    agora = agora or timezone.now()
+
+    with transaction.atomic():
+        vale = ValePallet.objects.select_for_update().get(pk=vale_id, hash_seguranca=hash_seguranca)
+        if pessoa_juridica is not None and vale.criado_por_id != pessoa_juridica.pk:
+            raise PermissionDenied
+
+        # Com o vale travado, um scan concorrente com a mesma chave só chega
+        # aqui depois que o primeiro gravou a movimentação
+        if chave:
+            resultado = _resultado_da_chave(vale, chave)
+            if resultado is not None:
+                return resultado
+        elif _leitura_dupla(vale, usuario, agora):
+            # Mesmo formato da repetição por chave: a transição original
+            return ResultadoScan(vale.id, vale.estado, vale.estado, repetido=True)
+
+        if vale.estado not in TRANSICOES:
+            return ResultadoScan(vale.id, vale.estado)
+
+        origem = vale.estado
+        destino, campo_data, campo_usuario, observacao = TRANSICOES[origem]
+        anterior = vale._snapshot_contador()
+
+        atualizados = ValePallet.objects.filter(pk=vale.pk, estado=origem).update(**{
+            'estado': destino,
+            campo_data: agora,
+            campo_usuario: usuario,
+        })
+        if not atualizados:
+            # Outro scan aplicou esta mesma transição antes
+            return ResultadoScan(vale.id, destino, destino, repetido=True)
+
+        vale.estado = destino
+        setattr(vale, campo_data, agora)
+        setattr(vale, campo_usuario, usuario)
+        atual = vale._snapshot_contador()
+        # O UPDATE direto não passa por ValePallet.save
+        atualizar_contadores(anterior, atual)
+
+        # O vale já está no estado de destino: a movimentação não o regrava
+        Movimentacao.objects.create(
+            vale=vale,
+            tipo=destino,
+            responsavel=usuario,
+            observacao=observacao,
+            chave_idempotencia=chave or None,
+        )
+        return ResultadoScan(vale.id, destino, destino)
@@ -1,8 +1,15 @@
+import hashlib
 import qrcode
+import qrcode.image.svg
+from functools import lru_cache
 from io import BytesIO
 import json
 
-def generate_qr_code(data):
+# Quantidade de QR Codes renderizados mantidos em memória (cada PNG tem ~1 KB)
+QR_CODE_CACHE_MAX = 512
+
+
+def generate_qr_code(data, formato='png'):
     qr = qrcode.QRCode(
         version=1,
         error_correction=qrcode.constants.ERROR_CORRECT_L,
@@ -17,8 +24,36 @@ def generate_qr_code(data):
     qr.add_data(data)
     qr.make(fit=True)
     
-    img = qr.make_image(fill_color="black", back_color="white")
     buffer = BytesIO()
-    img.save(buffer, format="PNG")
+    if formato == 'svg':
+        img = qr.make_image(image_factory=qrcode.image.svg.SvgPathImage)
+        img.save(buffer)
+    else:
+        img = qr.make_image(fill_color="black", back_color="white")
+        img.save(buffer, format="PNG")
     buffer.seek(0)
-    return buffer
\ No newline at end of file
+    return buffer
+
+
+def dados_qr_code_vale(vale, scan_url):
+    """Conteúdo (JSON) codificado no QR Code de um vale"""
+    return json.dumps({
+        "id": vale.id,
+        "hash": vale.hash_seguranca,
+        "numero_vale": vale.numero_vale,
+        "url": scan_url
+    })
+
+
+def etag_qr_code(dados, formato):
+    """ETag forte: o QR Code depende apenas dos dados e do formato"""
+    return hashlib.sha256(f'{formato}:{dados}'.encode()).hexdigest()[:32]
+
+
+@lru_cache(maxsize=QR_CODE_CACHE_MAX)
+def renderizar_qr_code(dados, formato='png'):
+    """
+    Bytes do QR Code, renderizados sob demanda. Os mais recentes ficam num
+    cache LRU limitado a QR_CODE_CACHE_MAX entradas.
+    """
+    return generate_qr_code(dados, formato).getvalue()
@@ -2,31 +2,70 @@ from django.urls import reverse
 from django.core.exceptions import PermissionDenied
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, Http404, StreamingHttpResponse, FileResponse
 from django.utils.crypto import get_random_string
 from django.db import transaction
 from django.views.decorators.http import require_http_methods, require_GET, require_POST
 from django.urls import reverse
 from django.utils import timezone
 from django.contrib.auth import authenticate, login as auth_login, logout
-from .models import Cliente, Motorista, Transportadora, ValePallet, Movimentacao, PessoaJuridica, Usuario, DocumentoVale
+from .models import Cliente, Motorista, Transportadora, ValePallet, Movimentacao, PessoaJuridica, Usuario, DocumentoVale, Tarefa
 from .forms import ClienteForm, MotoristaForm, TransportadoraForm, ValePalletForm, MovimentacaoForm, UsuarioPJForm, PessoaJuridicaForm
-from .utils import generate_qr_code
+from .dashboard import intervalo_periodo, metricas_por_contadores
+from .paginacao import contar_com_limite, continuar_do_cursor, cursor_apos, paginar_por_cursor
+from .filtros import extrair_filtros, filtrar_vales, opcoes_filtros
+from .exportacao import (
+    COLUNAS as COLUNAS_EXPORTACAO, FORMATOS as FORMATOS_EXPORTACAO, consulta_exportacao,
+    csv_em_partes, escrever_xlsx, linhas_exportacao, nome_arquivo,
+)
+from .planilhas import ler_planilha, xlsx_disponivel
+from .tarefas import enfileirar
+from .emissao import LoteInvalido, emitir_vales, ler_linhas
+from .importacao import CADASTROS as CADASTROS_IMPORTACAO, importar_cadastros
+from .listagens import CADASTROS as CADASTROS_LISTAGEM, autocompletar_cadastros, listar_cadastros
+from .transicoes import registrar_scan
+from .consultas import ServicoIndisponivel, aconsultar_cep, aconsultar_cnpj
+from .localidades import aresposta_estados, aresposta_municipios
+from .utils import dados_qr_code_vale, etag_qr_code, renderizar_qr_code
 import logging
-import requests
+import os
 from django.db import IntegrityError
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.decorators import user_passes_test, login_required
-from django.db.models import F, Q, Count, Sum
+from django.db.models import Q, Prefetch
 from datetime import timedelta
-import datetime
 import json
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from django.core.files.storage import default_storage
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
 
 
 
 logger = logging.getLogger(__name__)
 
+QR_CODE_CONTENT_TYPES = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+QR_CODE_MAX_AGE = 60 * 60 * 24
+# Estados e municípios mudam raramente: o navegador revalida pelo ETag
+LOCALIDADES_MAX_AGE = 60 * 60 * 24 * 7
+
+# Modal de vales do dashboard (movimentacoes_filtrar)
+CAMPOS_MODAL = (
+    'id', 'numero_vale', 'cliente__nome', 'transportadora__nome', 'motorista__nome',
+    'data_emissao', 'data_validade', 'estado', 'qtd_pbr', 'qtd_chepp',
+    'criado_por__usuario__username',
+)
+ORDENACAO_MODAL = ('-data_emissao', '-id')
+MODAL_POR_PAGINA = 200
+MODAL_LIMITE_MAXIMO = 1000
+MODAL_CHUNK = 500
+
+# Acima disso a exportação roda como tarefa em segundo plano
+LIMITE_EXPORTACAO_DIRETA = 100000
+
 
 def staff_required(view_func=None, redirect_url='painel_usuario'):
     """
@@ -40,37 +79,117 @@ def staff_required(view_func=None, redirect_url='painel_usuario'):
     return user_passes_test(check_staff, login_url=redirect_url)
 
 
-from django.template.loader import render_to_string
-from weasyprint import HTML
+from django.template import TemplateDoesNotExist
 import tempfile
-from django.shortcuts import get_object_or_404
-from .models import ValePallet
+from .pdfs import documento_pdf
+from .documentos import (
+    FORMATOS as FORMATOS_DOCUMENTOS, LIMITE_PDF_UNICO, consulta_documentos, html_documento,
+    nome_arquivo as nome_arquivo_documentos, pdf_unico, template_documento, zip_em_partes,
+)
+
+# Acima disso os documentos em lote são gerados em segundo plano
+LIMITE_DOCUMENTOS_DIRETO = 100
+
+# Tarefas cujo arquivo é baixado em ``exportacao_baixar`` e os tipos de conteúdo
+TAREFAS_EXPORTACAO = {
+    'app_controller.exportacao.gerar_arquivo_exportacao': FORMATOS_EXPORTACAO,
+    'app_controller.documentos.gerar_arquivo_documentos': FORMATOS_DOCUMENTOS,
+}
+
+
+@login_required
+@require_GET
 def valepallet_gerar_documento(request, vale_id, tipo):
-    vale = get_object_or_404(ValePallet, id=vale_id)
-    
-    # Renderiza o template HTML
-    html_string = render_to_string(f'vales/documento_{tipo}.html', {
-        'vale': vale,
-        'user': request.user
-    })
-    
-    # Cria um arquivo PDF
-    html = HTML(string=html_string)
-    result = html.write_pdf()
-    
-    # Cria a resposta HTTP
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="vale_{vale.numero_vale}_{tipo}.pdf"'
-    response['Content-Transfer-Encoding'] = 'binary'
-    
-    # Escreve o PDF na resposta
-    with tempfile.NamedTemporaryFile(delete=True) as output:
-        output.write(result)
-        output.flush()
-        output = open(output.name, 'rb')
-        response.write(output.read())
-    
+    """
+    PDF do documento ``tipo`` do vale (template ``vales/documento_<tipo>.html``).
+    O PDF só é renderizado quando o conteúdo muda; downloads repetidos
+    reaproveitam o arquivo gerado e respondem 304 pelo ETag.
+    """
+    try:
+        template = template_documento(tipo)
+    except TemplateDoesNotExist:
+        raise Http404('Tipo de documento inválido')
+
+    vale = get_object_or_404(
+        ValePallet.objects.select_related('cliente', 'motorista', 'transportadora', 'criado_por'),
+        id=vale_id
+    )
+    if not request.user.is_staff and (not hasattr(request.user, 'pessoa_juridica') or
+                                      vale.criado_por_id != request.user.pessoa_juridica.id):
+        raise PermissionDenied
+
+    documento = documento_pdf(f'vales/{vale.id}', tipo, html_documento(template, vale, request.user))
+    etag = quote_etag(documento.versao)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = FileResponse(
+            documento.abrir(),
+            as_attachment=True,
+            filename=f'vale_{vale.numero_vale}_{tipo}.pdf',
+            content_type='application/pdf'
+        )
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
     return response
+
+
+@login_required
+@require_GET
+def valepallet_documentos_lote(request):
+    """
+    Documentos ``tipo`` de todos os vales que passam nos filtros da listagem:
+    um ZIP com um PDF por vale (transmitido à medida que os PDFs ficam
+    prontos) ou, com ``formato=pdf``, um PDF único. Lotes grandes, ou
+    pedidos com ``segundo_plano=1``, viram uma tarefa baixada depois em
+    ``exportacao_baixar``.
+    """
+    tipo = request.GET.get('tipo', 'retirada')
+    formato = request.GET.get('formato', 'zip')
+    try:
+        template_documento(tipo)
+    except TemplateDoesNotExist:
+        return JsonResponse({'erro': 'Tipo de documento inválido'}, status=400)
+    if formato not in FORMATOS_DOCUMENTOS:
+        return JsonResponse({'erro': 'Formato inválido'}, status=400)
+
+    filtros = extrair_filtros(request.GET)
+    try:
+        vales = consulta_documentos(request.user, filtros)
+    except PermissionDenied:
+        return JsonResponse({'erro': 'Acesso não autorizado'}, status=403)
+
+    # O total é truncado no limite: ``excedeu`` indica que há mais vales
+    total, excedeu = contar_com_limite(vales, max(LIMITE_PDF_UNICO, LIMITE_DOCUMENTOS_DIRETO))
+    if not total:
+        return JsonResponse({'erro': 'Nenhum vale encontrado com esses filtros'}, status=404)
+    if formato == 'pdf' and (excedeu or total > LIMITE_PDF_UNICO):
+        return JsonResponse(
+            {'erro': f'PDF único limitado a {LIMITE_PDF_UNICO} vales; use formato=zip'}, status=400
+        )
+
+    if excedeu or total > LIMITE_DOCUMENTOS_DIRETO or request.GET.get('segundo_plano'):
+        tarefa = enfileirar(
+            'app_controller.documentos.gerar_arquivo_documentos',
+            usuario_id=request.user.id, tipo=tipo, formato=formato, filtros=filtros
+        )
+        return JsonResponse({
+            'tarefa': tarefa.id,
+            'status': tarefa.status,
+            'download': reverse('exportacao_baixar', args=[tarefa.id]),
+        }, status=202)
+
+    nome = nome_arquivo_documentos(tipo, formato)
+    if formato == 'pdf':
+        response = HttpResponse(pdf_unico(vales, tipo, request.user), content_type=FORMATOS_DOCUMENTOS[formato])
+    else:
+        response = StreamingHttpResponse(
+            zip_em_partes(vales, tipo, request.user),
+            content_type=FORMATOS_DOCUMENTOS[formato]
+        )
+    response['Content-Disposition'] = f'attachment; filename="{nome}"'
+    return response
+
+
 # ==============================================
 # PÁGINA INICIAL E AUTENTICAÇÃO
 # ==============================================
@@ -185,6 +304,45 @@ def painel_usuario(request):
     }
     return render(request, 'cadastro/painel_usuario.html', context)
 # ==============================================
+# LISTAGENS DE CADASTROS
+# ==============================================
+def _listar_cadastros(request, tipo, template, contexto):
+    """
+    Listagem paginada por cursor, com busca por prefixo (``busca``) e
+    ordenação (``ordem``), comum a clientes, motoristas e transportadoras.
+    """
+    resultado = listar_cadastros(request.user, tipo, request.GET)
+    if resultado is None:
+        messages.error(request, 'Acesso não autorizado')
+        return redirect('painel_usuario')
+
+    pagina, busca, ordem = resultado
+    return render(request, template, {
+        tipo: pagina,
+        'pagina': pagina,
+        'busca': busca,
+        'ordem': ordem,
+        'is_staff': request.user.is_staff,
+        **contexto
+    })
+
+
+@login_required
+@require_GET
+def autocompletar(request, tipo):
+    """
+    Opções para os campos de cadastro do formulário de vale: até
+    ``LIMITE_AUTOCOMPLETAR`` cadastros cujo nome ou documento começa com ``q``.
+    """
+    if tipo not in CADASTROS_LISTAGEM and tipo != 'pessoas_juridicas':
+        return JsonResponse({'erro': 'Tipo de cadastro inválido'}, status=404)
+
+    opcoes = autocompletar_cadastros(request.user, tipo, request.GET.get('q', ''))
+    if opcoes is None:
+        return JsonResponse({'erro': 'Acesso não autorizado'}, status=403)
+    return JsonResponse({'resultados': opcoes})
+
+# ==============================================
 # CRUD CLIENTES
 # ==============================================
 
@@ -192,17 +350,7 @@ def painel_usuario(request):
 @require_http_methods(["GET"])
 def cliente_listar(request):
     """Lista clientes - todos veem, mas staff veem mais"""
-    if request.user.is_staff:
-        clientes = Cliente.objects.all().order_by('nome')
-    elif hasattr(request.user, 'pessoa_juridica'):
-        clientes = Cliente.objects.filter(criado_por=request.user.pessoa_juridica).order_by('nome')
-    else:
-        messages.error(request, 'Acesso não autorizado')
-        return redirect('painel_usuario')
-    
-    return render(request, 'cadastro/cliente/listar.html', {
-        'clientes': clientes,
-        'is_staff': request.user.is_staff,
+    return _listar_cadastros(request, 'clientes', 'cadastro/cliente/listar.html', {
         'titulo': 'Clientes',
         'url_cadastro': 'cliente_cadastrar',
         'url_edicao': 'cliente_editar'
@@ -294,17 +442,7 @@ def cliente_remover(request, id):
 @require_http_methods(["GET"])
 def motorista_listar(request):
     """Lista motoristas vinculados à PJ do usuário ou todos se staff"""
-    if request.user.is_staff:
-        motoristas = Motorista.objects.all().order_by('nome')
-    elif hasattr(request.user, 'pessoa_juridica'):
-        motoristas = Motorista.objects.filter(criado_por=request.user.pessoa_juridica).order_by('nome')
-    else:
-        messages.error(request, 'Acesso não autorizado')
-        return redirect('painel_usuario')
-        
-    return render(request, 'cadastro/motorista/listar.html', {
-        'motoristas': motoristas,
-        'is_staff': request.user.is_staff,
+    return _listar_cadastros(request, 'motoristas', 'cadastro/motorista/listar.html', {
         'titulo': 'Motoristas',
         'url_cadastro': 'motorista_cadastrar',
         'url_edicao': 'motorista_editar'
@@ -396,17 +534,7 @@ def motorista_remover(request, id):
 @require_http_methods(["GET"])
 def transportadora_listar(request):
     """Lista transportadoras vinculadas à PJ do usuário ou todas se staff"""
-    if request.user.is_staff:
-        transportadoras = Transportadora.objects.all().order_by('nome')
-    elif hasattr(request.user, 'pessoa_juridica'):
-        transportadoras = Transportadora.objects.filter(criado_por=request.user.pessoa_juridica).order_by('nome')
-    else:
-        messages.error(request, 'Acesso não autorizado')
-        return redirect('painel_usuario')
-        
-    return render(request, 'cadastro/transportadora/listar.html', {
-        'transportadoras': transportadoras,
-        'is_staff': request.user.is_staff,
+    return _listar_cadastros(request, 'transportadoras', 'cadastro/transportadora/listar.html', {
         'titulo': 'Transportadoras',
         'url_cadastro': 'transportadora_cadastrar',
         'url_edicao': 'transportadora_editar'
@@ -513,86 +641,122 @@ def valepallet_listar(request):
         messages.error(request, 'Acesso não autorizado')
         return redirect('painel_usuario')
 
-    # Obter filtros do GET
-    search = request.GET.get('search', '')
-    estado = request.GET.get('estado', '')
-    responsavel = request.GET.get('responsavel', '')
-    transportadora = request.GET.get('transportadora', '')
-    cliente = request.GET.get('cliente', '')
-    data_emissao = request.GET.get('data_emissao', '')
-    data_inicio = request.GET.get('data_inicio', '')
-    data_fim = request.GET.get('data_fim', '')
-    
-    # Filtro de busca
-    if search:
-        vales = vales.filter(
-            Q(numero_vale__icontains=search) |
-            Q(cliente__nome__icontains=search) |
-            Q(motorista__nome__icontains=search)
-        )
-    
-    # Filtro por status
-    if estado:
-        vales = vales.filter(estado=estado)
-    
-    # Filtro por responsável
-    if responsavel:
-        vales = vales.filter(criado_por_id=responsavel)
-    
-    # Filtro por transportadora
-    if transportadora:
-        vales = vales.filter(transportadora_id=transportadora)
-    
-    # Filtro por cliente
-    if cliente:
-        vales = vales.filter(cliente_id=cliente)
-    
-    # Filtro por data de emissão
-    if data_emissao:
-        hoje = timezone.now().date()
-        if data_emissao == 'today':
-            vales = vales.filter(data_emissao=hoje)
-        elif data_emissao == 'week':
-            semana_passada = hoje - timedelta(days=7)
-            vales = vales.filter(data_emissao__range=[semana_passada, hoje])
-        elif data_emissao == 'month':
-            mes_passado = hoje - timedelta(days=30)
-            vales = vales.filter(data_emissao__range=[mes_passado, hoje])
-        elif data_emissao == 'custom' and data_inicio and data_fim:
-            try:
-                # Converter strings para objetos date
-                data_inicio_obj = datetime.strptime(data_inicio, '%Y-%m-%d').date()
-                data_fim_obj = datetime.strptime(data_fim, '%Y-%m-%d').date()
-                vales = vales.filter(data_emissao__range=[data_inicio_obj, data_fim_obj])
-            except ValueError:
-                messages.error(request, 'Formato de data inválido')
-
-    # Obter listas para os dropdowns
-    usuarios = Usuario.objects.all().order_by('username')
-    transportadoras = Transportadora.objects.all().order_by('nome')
-    clientes = Cliente.objects.all().order_by('nome')
-
-    # Paginação
-    page = request.GET.get('page', 1)
-    paginator = Paginator(vales, 20) 
-    try:
-        vales_paginados = paginator.page(page)
-    except PageNotAnInteger:
-        vales_paginados = paginator.page(1)
-    except EmptyPage:
-        vales_paginados = paginator.page(paginator.num_pages)
+    modo_cursor = request.GET.get('paginacao') == 'cursor' or 'cursor' in request.GET
+
+    # Filtros do GET (busca ordenada por relevância, exceto na paginação por cursor)
+    vales, erros = filtrar_vales(vales, request.GET, ordenar_por_relevancia=not modo_cursor)
+    for erro in erros:
+        messages.error(request, erro)
+
+    # Opções dos selects de filtro (em cache, no escopo do usuário)
+    opcoes = opcoes_filtros(request.user)
+
+    # Paginação (opcionalmente por cursor, sem COUNT completo nem OFFSET)
+    if modo_cursor:
+        vales_paginados = paginar_por_cursor(vales, request.GET.get('cursor'), por_pagina=20)
+    else:
+        page = request.GET.get('page', 1)
+        paginator = Paginator(vales, 20)
+        try:
+            vales_paginados = paginator.page(page)
+        except PageNotAnInteger:
+            vales_paginados = paginator.page(1)
+        except EmptyPage:
+            vales_paginados = paginator.page(paginator.num_pages)
+
+    # Filtros atuais para os links de paginação, já codificados para a URL
+    filtros_query = request.GET.copy()
+    for chave in ('page', 'cursor', 'paginacao'):
+        filtros_query.pop(chave, None)
 
     return render(request, 'cadastro/valepallet/listar.html', {
         'vales': vales_paginados,
-        'usuarios': usuarios,
-        'transportadoras': transportadoras,
-        'clientes': clientes,
+        'modo_cursor': modo_cursor,
+        'filtros_query': filtros_query.urlencode(),
+        'responsaveis': opcoes['responsaveis'],
+        'transportadoras': opcoes['transportadoras'],
+        'clientes': opcoes['clientes'],
         'is_staff': request.user.is_staff,
         'titulo': 'Vales Pallets',
         'url_cadastro': 'valepallet_cadastrar',
         'url_edicao': 'valepallet_editar'
     })
 
+@login_required
+@require_GET
+def exportar_vales(request):
+    """
+    Exporta vales (ou, com ``tipo=movimentacoes``, as movimentações deles)
+    com os mesmos filtros da listagem, em CSV ou XLSX. Exportações grandes,
+    ou pedidas com ``segundo_plano=1``, viram uma tarefa e o arquivo é
+    baixado depois em ``exportacao_baixar``.
+    """
+    tipo = request.GET.get('tipo', 'vales')
+    formato = request.GET.get('formato', 'csv')
+    if tipo not in COLUNAS_EXPORTACAO or formato not in FORMATOS_EXPORTACAO:
+        return JsonResponse({'erro': 'Tipo ou formato de exportação inválido'}, status=400)
+    if formato == 'xlsx' and not xlsx_disponivel():
+        return JsonResponse({'erro': 'Exportação XLSX indisponível neste servidor'}, status=501)
+
+    filtros = extrair_filtros(request.GET)
+    try:
+        consulta = consulta_exportacao(request.user, tipo, filtros)
+    except PermissionDenied:
+        return JsonResponse({'erro': 'Acesso não autorizado'}, status=403)
+
+    _, grande = contar_com_limite(consulta, LIMITE_EXPORTACAO_DIRETA)
+    if grande or request.GET.get('segundo_plano'):
+        tarefa = enfileirar(
+            'app_controller.exportacao.gerar_arquivo_exportacao',
+            usuario_id=request.user.id, tipo=tipo, formato=formato, filtros=filtros
+        )
+        return JsonResponse({
+            'tarefa': tarefa.id,
+            'status': tarefa.status,
+            'download': reverse('exportacao_baixar', args=[tarefa.id]),
+        }, status=202)
+
+    nome = nome_arquivo(tipo, formato)
+    if formato == 'xlsx':
+        arquivo = tempfile.TemporaryFile()
+        escrever_xlsx(tipo, linhas_exportacao(consulta, formato), arquivo)
+        arquivo.seek(0)
+        return FileResponse(arquivo, as_attachment=True, filename=nome, content_type=FORMATOS_EXPORTACAO[formato])
+
+    response = StreamingHttpResponse(
+        csv_em_partes(tipo, linhas_exportacao(consulta, formato)),
+        content_type=FORMATOS_EXPORTACAO[formato]
+    )
+    response['Content-Disposition'] = f'attachment; filename="{nome}"'
+    return response
+
+
+@login_required
+@require_GET
+def exportacao_baixar(request, id):
+    """Status de uma exportação em segundo plano, ou o arquivo quando pronto"""
+    tarefa = get_object_or_404(Tarefa, pk=id, funcao__in=TAREFAS_EXPORTACAO)
+    if not request.user.is_staff and tarefa.argumentos.get('usuario_id') != request.user.id:
+        return JsonResponse({'erro': 'Acesso não autorizado'}, status=403)
+
+    if tarefa.status != 'CONCLUIDA':
+        return JsonResponse(
+            {'tarefa': tarefa.id, 'status': tarefa.status, 'erro': tarefa.erro},
+            status=500 if tarefa.status == 'ERRO' else 202
+        )
+
+    nome = (tarefa.resultado or {}).get('arquivo')
+    if nome is None:
+        # Arquivo já apagado por limpar_exportacoes
+        return JsonResponse({'tarefa': tarefa.id, 'status': tarefa.status, 'erro': 'Exportação expirada'}, status=410)
+    return FileResponse(
+        default_storage.open(nome, 'rb'),
+        as_attachment=True,
+        filename=os.path.basename(nome),
+        content_type=TAREFAS_EXPORTACAO[tarefa.funcao][tarefa.argumentos['formato']]
+    )
+
+
 @transaction.atomic
 @login_required
 @require_http_methods(["GET", "POST"])
@@ -604,15 +768,6 @@ def valepallet_cadastrar(request):
 
     if request.method == 'POST':
         form = ValePalletForm(request.POST, user=request.user)
-        
-        # Configura os querysets para o staff
-        if request.user.is_staff:
-            form.fields['cliente'].queryset = Cliente.objects.all().order_by('nome')
-            form.fields['motorista'].queryset = Motorista.objects.all().order_by('nome')
-            form.fields['transportadora'].queryset = Transportadora.objects.all().order_by('nome')
-            form.fields['criado_por'].queryset = PessoaJuridica.objects.all().order_by('razao_social')
-            form.fields['criado_por'].required = False
-
         if not form.is_valid():
             messages.error(request, 'Por favor, corrija os erros no formulário.')
             return render(request, 'cadastro/valepallet/form.html', {
@@ -651,30 +806,6 @@ def valepallet_cadastrar(request):
                     observacao=f'Vale {vale.numero_vale} criado'
                 )
 
-                # Gerar QR Code
-                try:
-                    scan_url = request.build_absolute_uri(
-                        reverse('valepallet_processar', args=[vale.id, vale.hash_seguranca])
-                    )
-                    qr_data = {
-                        "id": vale.id,
-                        "hash": vale.hash_seguranca,
-                        "numero_vale": vale.numero_vale,
-                        "url": scan_url
-                    }
-                    qr_code = generate_qr_code(qr_data)
-                    
-                    if qr_code:
-                        from django.core.files.base import ContentFile
-                        from io import BytesIO
-                        
-                        filename = f'vale_{vale.id}_{vale.numero_vale}.png'
-                        file_content = ContentFile(qr_code.getvalue())
-                        vale.qr_code.save(filename, file_content, save=True)
-                except Exception as e:
-                    logger.error(f"Erro ao gerar QR code: {str(e)}")
-                    messages.warning(request, 'Erro ao gerar QR code. O vale foi criado, mas sem QR code.')
-
                 messages.success(request, 'Vale pallet criado com sucesso!')
                 return redirect('valepallet_detalhes', id=vale.id)
 
@@ -686,19 +817,6 @@ def valepallet_cadastrar(request):
             messages.error(request, 'Erro ao criar o vale pallet.')
     else:
         form = ValePalletForm(user=request.user)
-        
-        # Configura os querysets baseado no tipo de usuário
-        if request.user.is_staff:
-            form.fields['cliente'].queryset = Cliente.objects.all().order_by('nome')
-            form.fields['motorista'].queryset = Motorista.objects.all().order_by('nome')
-            form.fields['transportadora'].queryset = Transportadora.objects.all().order_by('nome')
-            form.fields['criado_por'].queryset = PessoaJuridica.objects.all().order_by('razao_social')
-            form.fields['criado_por'].required = False
-        elif hasattr(request.user, 'pessoa_juridica'):
-            pj = request.user.pessoa_juridica
-            form.fields['cliente'].queryset = Cliente.objects.filter(criado_por=pj).order_by('nome')
-            form.fields['motorista'].queryset = Motorista.objects.filter(criado_por=pj).order_by('nome')
-            form.fields['transportadora'].queryset = Transportadora.objects.filter(criado_por=pj).order_by('nome')
 
     return render(request, 'cadastro/valepallet/form.html', {
         'form': form,
@@ -707,39 +825,51 @@ def valepallet_cadastrar(request):
     })
 
 
+def vales_com_historico():
+    """Vales com cadastros, movimentações (e responsável) e documentos (e usuário) já carregados"""
+    return ValePallet.objects.select_related(
+        'cliente',
+        'motorista',
+        'transportadora',
+        'criado_por'
+    ).prefetch_related(
+        Prefetch(
+            'movimentacao_set',
+            queryset=Movimentacao.objects.select_related('responsavel').order_by('-data_hora', '-id'),
+            to_attr='lista_movimentacoes'
+        ),
+        Prefetch(
+            'documentos',
+            queryset=DocumentoVale.objects.select_related('usuario').order_by('-data_upload', '-id'),
+            to_attr='lista_documentos'
+        ),
+    )
+
+
 @login_required
 @require_http_methods(["GET"])
 def valepallet_detalhes(request, id):
-    """Exibe detalhes de um vale pallet específico."""
+    """
+    Exibe detalhes de um vale pallet específico. Movimentações e documentos
+    vêm prontos (com responsável e usuário) em duas consultas de prefetch,
+    então o número de consultas não cresce com o histórico do vale.
+    """
     try:
-        vale = get_object_or_404(
-            ValePallet.objects.select_related(
-                'cliente', 
-                'motorista', 
-                'transportadora',
-                'criado_por'
-            ),
-            pk=id
-        )
+        vale = get_object_or_404(vales_com_historico(), pk=id)
 
         # Verificação de permissão
-        if not request.user.is_staff and (not hasattr(request.user, 'pessoa_juridica') or 
-                                        vale.criado_por != request.user.pessoa_juridica):
+        pode_editar = request.user.is_staff or (hasattr(request.user, 'pessoa_juridica') and
+                                                vale.criado_por_id == request.user.pessoa_juridica.id)
+        if not pode_editar:
             messages.error(request, 'Você não tem permissão para acessar este vale.')
             return redirect('valepallet_listar')
 
-        movimentacoes = Movimentacao.objects.filter(vale=vale).order_by('-data_hora')
-
-        # Tratamento simplificado do QR Code
-        qr_code_url = vale.qr_code.url if vale.qr_code else None
-
         context = {
             'vale': vale,
-            'movimentacoes': movimentacoes,
-            'qr_code_url': qr_code_url,
+            'movimentacoes': vale.lista_movimentacoes,
+            'documentos': vale.lista_documentos,
             'titulo': f'Detalhes do Vale {vale.numero_vale}',
-            'pode_editar': request.user.is_staff or (hasattr(request.user, 'pessoa_juridica') and 
-                                                    vale.criado_por == request.user.pessoa_juridica)
+            'pode_editar': pode_editar
         }
 
         return render(request, 'cadastro/valepallet/detalhes.html', context)
@@ -750,12 +880,122 @@ def valepallet_detalhes(request, id):
         return redirect('valepallet_listar')
 
 
+@login_required
+@require_POST
+def valepallet_emitir_lote(request):
+    """
+    Emite vários vales de uma vez. Aceita um arquivo CSV/JSON no campo
+    ``arquivo`` ou uma lista JSON no corpo da requisição.
+    """
+    if not request.user.is_staff and not hasattr(request.user, 'pessoa_juridica'):
+        return JsonResponse({'erro': 'Usuário não autorizado'}, status=403)
+
+    try:
+        arquivo = request.FILES.get('arquivo')
+        if arquivo:
+            formato = 'json' if arquivo.name.lower().endswith('.json') else 'csv'
+            linhas = ler_linhas(arquivo.read(), formato)
+        else:
+            linhas = ler_linhas(request.body, 'json')
+        vales = emitir_vales(linhas, request.user, getattr(request.user, 'pessoa_juridica', None))
+    except LoteInvalido as e:
+        return JsonResponse({'erro': str(e), 'erros': e.erros}, status=400)
+    except IntegrityError as e:
+        logger.error(f"Erro de integridade na emissão em lote: {str(e)}")
+        return JsonResponse({'erro': 'Conflito ao gravar os vales. Tente novamente.'}, status=409)
+
+    return JsonResponse({
+        'criados': len(vales),
+        'vales': [{'id': vale.id, 'numero_vale': vale.numero_vale} for vale in vales],
+    }, status=201)
+
+
+@login_required
+@require_POST
+def cadastros_importar(request, tipo):
+    """
+    Importa clientes, motoristas ou transportadoras de uma planilha CSV/XLSX
+    (campo ``arquivo``, colunas nome, cnpj/cpf, telefone e email). As linhas
+    válidas são gravadas; as demais voltam no relatório com o erro.
+    """
+    if tipo not in CADASTROS_IMPORTACAO:
+        raise Http404('Tipo de cadastro inválido')
+    if not request.user.is_staff and not hasattr(request.user, 'pessoa_juridica'):
+        return JsonResponse({'erro': 'Usuário não autorizado'}, status=403)
+
+    arquivo = request.FILES.get('arquivo')
+    if not arquivo:
+        return JsonResponse({'erro': 'Envie a planilha no campo "arquivo"'}, status=400)
+    if arquivo.name.lower().endswith('.xlsx') and not xlsx_disponivel():
+        return JsonResponse({'erro': 'Importação XLSX indisponível no servidor; use CSV'}, status=501)
+
+    pessoa_juridica = getattr(request.user, 'pessoa_juridica', None)
+    if request.user.is_staff and request.POST.get('criado_por'):
+        pessoa_juridica = PessoaJuridica.objects.filter(pk=request.POST['criado_por']).first()
+        if pessoa_juridica is None:
+            return JsonResponse({'erro': 'Pessoa jurídica não encontrada'}, status=400)
+
+    try:
+        linhas = ler_planilha(arquivo.read(), arquivo.name)
+    except Exception as e:
+        logger.error(f"Erro ao ler planilha de importação de {tipo}: {str(e)}")
+        return JsonResponse({'erro': 'Não foi possível ler a planilha'}, status=400)
+
+    try:
+        relatorio = importar_cadastros(tipo, linhas, pessoa_juridica)
+    except IntegrityError as e:
+        logger.error(f"Erro de integridade na importação de {tipo}: {str(e)}")
+        return JsonResponse({'erro': 'Conflito ao gravar os cadastros. Tente novamente.'}, status=409)
+
+    return JsonResponse(relatorio.as_dict(), status=201 if relatorio.importados else 200)
+
+
+@login_required
+@require_GET
+def valepallet_qr_code(request, id, formato):
+    """
+    QR Code do vale renderizado sob demanda (PNG ou SVG), sem arquivo em
+    disco. Responde 304 quando o navegador já tem a versão atual (ETag).
+    """
+    if formato not in QR_CODE_CONTENT_TYPES:
+        raise Http404('Formato de QR Code inválido')
+
+    vales = ValePallet.objects.only('id', 'numero_vale', 'hash_seguranca', 'criado_por_id')
+    if not request.user.is_staff:
+        if not hasattr(request.user, 'pessoa_juridica'):
+            raise PermissionDenied
+        # Vale de outra PJ responde como inexistente
+        vales = vales.filter(criado_por=request.user.pessoa_juridica)
+    vale = get_object_or_404(vales, pk=id)
+
+    scan_url = request.build_absolute_uri(
+        reverse('valepallet_processar', args=[vale.id, vale.hash_seguranca])
+    )
+    dados = dados_qr_code_vale(vale, scan_url)
+    etag = quote_etag(etag_qr_code(dados, formato))
+
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(renderizar_qr_code(dados, formato), content_type=QR_CODE_CONTENT_TYPES[formato])
+        response['Content-Disposition'] = f'inline; filename="vale_{vale.numero_vale}.{formato}"'
+
+    # O QR Code carrega o hash de segurança do vale: só o navegador pode guardar
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, max_age=QR_CODE_MAX_AGE)
+    return response
+
+
 @transaction.atomic
 @login_required
 @require_http_methods(["GET", "POST"])
 def valepallet_editar(request, id):
     """Edita vale pallet existente."""
-    vale = get_object_or_404(ValePallet, pk=id)
+    vales = ValePallet.objects.all()
+    if request.method == 'POST':
+        # Trava o vale: um scan concorrente espera a edição (ou a edição vê o
+        # vale já em SAIDA), em vez de ser desfeito pelo save da linha inteira
+        vales = vales.select_for_update()
+    vale = get_object_or_404(vales, pk=id)
     
     # Verifica permissão
     if not request.user.is_staff and (not hasattr(request.user, 'pessoa_juridica') or 
@@ -775,15 +1015,6 @@ def valepallet_editar(request, id):
     
     if request.method == 'POST':
         form = ValePalletForm(request.POST, instance=vale, user=request.user)
-        
-        # Configura os querysets para o staff
-        if request.user.is_staff:
-            form.fields['cliente'].queryset = Cliente.objects.all().order_by('nome')
-            form.fields['motorista'].queryset = Motorista.objects.all().order_by('nome')
-            form.fields['transportadora'].queryset = Transportadora.objects.all().order_by('nome')
-            form.fields['criado_por'].queryset = PessoaJuridica.objects.all().order_by('razao_social')
-            form.fields['criado_por'].required = False
-
         if form.is_valid():
             try:
                 with transaction.atomic():
@@ -802,20 +1033,7 @@ def valepallet_editar(request, id):
             messages.error(request, 'Por favor, corrija os erros abaixo.')
     else:
         form = ValePalletForm(instance=vale, user=request.user)
-        
-        # Configura os querysets baseado no tipo de usuário
-        if request.user.is_staff:
-            form.fields['cliente'].queryset = Cliente.objects.all().order_by('nome')
-            form.fields['motorista'].queryset = Motorista.objects.all().order_by('nome')
-            form.fields['transportadora'].queryset = Transportadora.objects.all().order_by('nome')
-            form.fields['criado_por'].queryset = PessoaJuridica.objects.all().order_by('razao_social')
-            form.fields['criado_por'].required = False
-        elif hasattr(request.user, 'pessoa_juridica'):
-            pj = request.user.pessoa_juridica
-            form.fields['cliente'].queryset = Cliente.objects.filter(criado_por=pj).order_by('nome')
-            form.fields['motorista'].queryset = Motorista.objects.filter(criado_por=pj).order_by('nome')
-            form.fields['transportadora'].queryset = Transportadora.objects.filter(criado_por=pj).order_by('nome')
-    
+
     return render(request, 'cadastro/valepallet/form.html', {
         'form': form,
         'titulo': f'Editar Vale {vale.numero_vale}',
@@ -840,8 +1058,12 @@ def valepallet_remover(request, id):
 
 @login_required
 def detalhes_vale(request, vale_id):
-    vale = get_object_or_404(ValePallet, pk=vale_id)
-    return render(request, "cadastro/valepallet/detalhes.html", {"vale": vale})
+    vale = get_object_or_404(vales_com_historico(), pk=vale_id)
+    return render(request, "cadastro/valepallet/detalhes.html", {
+        "vale": vale,
+        "movimentacoes": vale.lista_movimentacoes,
+        "documentos": vale.lista_documentos,
+    })
 
 @login_required
 @require_POST
@@ -887,7 +1109,6 @@ def valepallet_remover_documento(request, id):
     messages.success(request, "Documento removido com sucesso.")
     return redirect("valepallet_detalhes", id=vale_id)
 
-@transaction.atomic
 @login_required
 @require_http_methods(["GET"])
 def processar_scan(request, id, hash_seguranca):
@@ -896,52 +1117,34 @@ def processar_scan(request, id, hash_seguranca):
         messages.error(request, 'Usuário não vinculado a uma empresa.')
         return redirect('painel_usuario')
 
-    try:
-        with transaction.atomic():
-            vale = get_object_or_404(
-                ValePallet, 
-                pk=id, 
-                hash_seguranca=hash_seguranca
-            )
-            
-            # Verifica se o usuário tem permissão
-            if not request.user.is_staff and vale.criado_por != request.user.pessoa_juridica:
-                messages.error(request, 'Você não tem permissão para processar este vale.')
-                return redirect('valepallet_listar')
-            
-            if vale.estado == 'EMITIDO':
-                vale.estado = 'SAIDA'
-                vale.usuario_saida = request.user 
-                vale.data_saida = timezone.now()
-                vale.save()
-                Movimentacao.objects.create(
-                    vale=vale,
-                    tipo='SAIDA',
-                    responsavel=request.user,
-                    observacao='Saída registrada via QR Code'
-                )
-                messages.success(request, 'Saída registrada com sucesso!')
-
-            elif vale.estado == 'SAIDA':
-                vale.estado = 'RETORNO'
-                vale.usuario_retorno = request.user 
-                vale.data_retorno = timezone.now()
-                vale.save()
-                Movimentacao.objects.create(
-                    vale=vale,
-                    tipo='RETORNO',
-                    responsavel=request.user,
-                    observacao='Retorno registrado via QR Code'
-                )
-                messages.success(request, 'Retorno registrado com sucesso!')
-
-            return redirect('valepallet_detalhes', id=vale.id)
+    # Chave de idempotência opcional, enviada pelo leitor (uma por scan)
+    chave = request.headers.get('Idempotency-Key') or request.GET.get('chave')
+    pessoa_juridica = None if request.user.is_staff else request.user.pessoa_juridica
 
+    try:
+        resultado = registrar_scan(id, hash_seguranca, request.user, pessoa_juridica, chave=chave)
+    except ValePallet.DoesNotExist:
+        messages.error(request, 'Vale não encontrado.')
+        return redirect('valepallet_listar')
+    except PermissionDenied:
+        messages.error(request, 'Você não tem permissão para processar este vale.')
+        return redirect('valepallet_listar')
     except Exception as e:
         logger.error(f"Erro ao processar QR Code: {str(e)}", exc_info=True)
         messages.error(request, 'Erro no processamento do QR Code')
         return redirect('valepallet_listar')
 
+    if resultado.repetido:
+        messages.info(request, 'Scan repetido: esta leitura já havia sido registrada.')
+    elif resultado.transicao == 'SAIDA':
+        messages.success(request, 'Saída registrada com sucesso!')
+    elif resultado.transicao == 'RETORNO':
+        messages.success(request, 'Retorno registrado com sucesso!')
+    else:
+        messages.info(request, f'O vale já está em {resultado.estado}; nenhuma alteração feita.')
+
+    return redirect('valepallet_detalhes', id=resultado.vale_id)
+
     
 # ==============================================
 # GESTÃO DE MOVIMENTAÇÕES
@@ -950,119 +1153,30 @@ def processar_scan(request, id, hash_seguranca):
 @require_http_methods(["GET"])
 def movimentacao_listar(request):
     """Lista todas as movimentações e exibe o dashboard de pallets."""
-    # Consulta básica de vales
+    # Visão completa: métricas lidas dos contadores desnormalizados
     if request.user.is_staff:
-        vales = ValePallet.objects.all().select_related('cliente', 'criado_por__usuario')
+        metricas = metricas_por_contadores()
     elif hasattr(request.user, 'pessoa_juridica'):
-        vales = ValePallet.objects.filter(
-            criado_por=request.user.pessoa_juridica
-        ).select_related('cliente', 'criado_por__usuario')
+        metricas = metricas_por_contadores(request.user.pessoa_juridica)
     else:
         messages.error(request, 'Acesso não autorizado')
         return redirect('painel_usuario')
 
-    # Data atual para cálculos
-    hoje = timezone.now().date()
-
-    # Métricas de status - agora usando apenas a data_validade específica
-    a_vencer = vales.filter(
-        data_saida__isnull=False,
-        data_retorno__isnull=True,
-        data_validade__gte=hoje  # Todos que ainda não venceram
-    ).count()
-    
-    coletado = vales.filter(
-        data_saida__isnull=False,
-        data_retorno__isnull=False
-    ).count()
-    
-    pendente = vales.filter(
-        data_saida__isnull=True
-    ).count()
-    
-    vencido = vales.filter(
-        data_saida__isnull=False,
-        data_retorno__isnull=True,
-        data_validade__lt=hoje  # Vencidos
-    ).count()
-
-    # Função auxiliar para calcular a soma de pallets
-    def calcular_pallets(queryset):
-        return queryset.aggregate(
-            total=Sum(F('qtd_pbr') + F('qtd_chepp'))
-        )['total'] or 0
-
-    # Métricas de pallets
-    pallets_movimentacao = calcular_pallets(vales.filter(
-        data_saida__isnull=False,
-        data_retorno__isnull=True
-    ))
-    
-    pallets_prazo = calcular_pallets(vales.filter(
-        Q(data_saida__isnull=True) |
-        (Q(data_saida__isnull=False) & Q(data_retorno__isnull=True) & Q(data_validade__gte=hoje))
-    ))
-    
-    pallets_vencidos = calcular_pallets(vales.filter(
-        data_saida__isnull=False,
-        data_retorno__isnull=True,
-        data_validade__lt=hoje
-    ))
-    
-    total_pallets = calcular_pallets(vales)
-
-    # Dias em aberto (baseado na data_emissao)
-    menos_30_dias = vales.filter(
-        data_emissao__gte=hoje - timedelta(days=30)
-    ).count()
-    
-    mais_30_dias = vales.filter(
-        data_emissao__lt=hoje - timedelta(days=30),
-        data_emissao__gte=hoje - timedelta(days=90)
-    ).count()
-    
-    mais_90_dias = vales.filter(
-        data_emissao__lt=hoje - timedelta(days=90),
-        data_emissao__gte=hoje - timedelta(days=180)
-    ).count()
-    
-    mais_180_dias = vales.filter(
-        data_emissao__lt=hoje - timedelta(days=180)
-    ).count()
-
-    # Agregação por fornecedor (TODOS os fornecedores para a tabela)
-    fornecedores_completo = vales.values(
-        'criado_por__usuario__username'
-    ).annotate(
-        total_pallets=Sum(F('qtd_pbr') + F('qtd_chepp')),
-        vale_count=Count('id')
-    ).order_by('-total_pallets')
-
     # TOP 3 fornecedores apenas para o gráfico
-    top_fornecedores = list(fornecedores_completo[:3])
-
-    # Preparar dados para o gráfico (apenas top 3)
     grafico_labels = []
     grafico_data = []
     grafico_cores = []
     grafico_tipos = []
 
-    for item in top_fornecedores:
-        grafico_labels.append(item['criado_por__usuario__username'] or 'Sem responsável')
-        grafico_data.append(item['total_pallets'])
+    for item in metricas.top_fornecedores():
+        grafico_labels.append(item['responsavel__username'])
+        grafico_data.append(item['pallets'])
         grafico_cores.append('rgba(13, 110, 253, 0.7)')
         grafico_tipos.append('Pallets')
 
-    # Formatando para a tabela de fornecedores (TODOS os fornecedores)
-    fornecedores_data = [{
-        'responsavel__username': item['criado_por__usuario__username'] or 'Sem responsável',
-        'vale': item['vale_count'],
-        'pallets': item['total_pallets']
-    } for item in fornecedores_completo]
-
     # Se não houver fornecedores, cria um registro vazio para evitar erros
-    if not fornecedores_data:
-        fornecedores_data = [{
+    if not metricas.fornecedores:
+        metricas.fornecedores = [{
             'responsavel__username': 'Nenhum dado disponível',
             'vale': 0,
             'pallets': 0
@@ -1075,29 +1189,10 @@ def movimentacao_listar(request):
     return render(request, 'cadastro/movimentacao/listar.html', {
         'titulo': 'Movimentações',
         'is_staff': request.user.is_staff,
-        
+
         # Métricas para o dashboard
-        'a_vencer': a_vencer,
-        'coletado': coletado,
-        'pendente': pendente,
-        'vencido': vencido,
-        
-        'pallets_movimentacao': pallets_movimentacao,
-        'pallets_prazo': pallets_prazo,
-        'pallets_vencidos': pallets_vencidos,
-        'total_pallets': total_pallets,
-        
-        'menos_30_dias': menos_30_dias,
-        'mais_30_dias': mais_30_dias,
-        'mais_90_dias': mais_90_dias,
-        'mais_180_dias': mais_180_dias,
-        
-        'fornecedores_data': fornecedores_data,
-        'total_fornecedores': {
-            'vales': vales.count(),
-            'pallets': total_pallets
-        },
-        
+        **metricas.as_dict(),
+
         # Dados para o gráfico
         'grafico_labels': json.dumps(grafico_labels),
         'grafico_data': json.dumps(grafico_data),
@@ -1105,22 +1200,15 @@ def movimentacao_listar(request):
         'grafico_tipos': json.dumps(grafico_tipos)
     })
 
-@staff_required
-@require_http_methods(["GET"])
-def movimentacoes_filtrar(request):
-    """Filtra vales pallets para exibição no modal"""
-    tipo = request.GET.get('tipo', 'todos')
+def _vales_do_modal(request, tipo):
+    """Vales do usuário filtrados conforme o card do dashboard clicado"""
     hoje = timezone.now().date()
-    
+
     # Base query
     if request.user.is_staff:
-        vales = ValePallet.objects.all().select_related(
-            'cliente', 'transportadora', 'motorista', 'criado_por__usuario'
-        )
+        vales = ValePallet.objects.all()
     else:
-        vales = ValePallet.objects.filter(
-            criado_por=request.user.pessoa_juridica
-        ).select_related('cliente', 'transportadora', 'motorista', 'criado_por__usuario')
+        vales = ValePallet.objects.filter(criado_por=request.user.pessoa_juridica)
     
     # Aplicar filtros conforme o tipo
     if tipo == 'a_vencer':
@@ -1145,26 +1233,81 @@ def movimentacoes_filtrar(request):
         vales = vales.filter(estado='RETORNO')
     elif tipo == 'pendente':
         vales = vales.filter(estado='EMITIDO')
-    
-    # Serializa os dados para JSON
-    vales_data = []
-    for vale in vales:
-        vales_data.append({
-            'numero_vale': vale.numero_vale,
-            'cliente': vale.cliente.nome if vale.cliente else '-',
-            'transportadora': vale.transportadora.nome if vale.transportadora else '-',
-            'motorista': vale.motorista.nome if vale.motorista else '-',
-            'data_emissao': vale.data_emissao.strftime('%d/%m/%Y') if vale.data_emissao else '-',
-            'data_validade': vale.data_validade.strftime('%d/%m/%Y') if vale.data_validade else '-',
-            'estado': vale.estado,
-            'qtd_pbr': vale.qtd_pbr,
-            'qtd_chepp': vale.qtd_chepp,
-            'responsavel': vale.criado_por.usuario.username if vale.criado_por else '-'
-        })
-    
+
+    # Só as colunas exibidas, sem instanciar modelos
+    return vales.values(*CAMPOS_MODAL)
+
+
+def _formatar_data(valor):
+    return timezone.localtime(valor).strftime('%d/%m/%Y') if valor else '-'
+
+
+def _serializar_vale_modal(linha):
+    return {
+        'numero_vale': linha['numero_vale'],
+        'cliente': linha['cliente__nome'] or '-',
+        'transportadora': linha['transportadora__nome'] or '-',
+        'motorista': linha['motorista__nome'] or '-',
+        'data_emissao': _formatar_data(linha['data_emissao']),
+        'data_validade': _formatar_data(linha['data_validade']),
+        'estado': linha['estado'],
+        'qtd_pbr': linha['qtd_pbr'],
+        'qtd_chepp': linha['qtd_chepp'],
+        'responsavel': linha['criado_por__usuario__username'] or '-'
+    }
+
+
+def _vales_ndjson(vales, limite):
+    """
+    Uma linha JSON por vale. Se ``limite`` cortar o resultado, a última
+    linha traz o ``proximo_cursor`` para continuar.
+    """
+    if limite is not None:
+        vales = vales[:limite + 1]
+    ultima = None
+    for posicao, linha in enumerate(vales.iterator(chunk_size=MODAL_CHUNK)):
+        if posicao == limite:
+            yield json.dumps({'proximo_cursor': cursor_apos(ultima, ORDENACAO_MODAL)}) + '\n'
+            return
+        ultima = linha
+        yield json.dumps(_serializar_vale_modal(linha)) + '\n'
+
+
+@staff_required
+@require_http_methods(["GET"])
+def movimentacoes_filtrar(request):
+    """
+    Filtra vales pallets para exibição no modal.
+
+    Por padrão devolve uma página (``limite``, até MODAL_LIMITE_MAXIMO) e o
+    ``proximo_cursor``. Com ``formato=ndjson`` o resultado é transmitido
+    em streaming, um vale por linha, sem carregar tudo em memória.
+    """
+    tipo = request.GET.get('tipo', 'todos')
+    cursor = request.GET.get('cursor')
+    vales = _vales_do_modal(request, tipo)
+
+    try:
+        limite = int(request.GET['limite']) if request.GET.get('limite') else None
+    except ValueError:
+        return JsonResponse({'erro': 'limite inválido'}, status=400)
+    if limite is not None and limite < 1:
+        return JsonResponse({'erro': 'limite inválido'}, status=400)
+
+    if request.GET.get('formato') == 'ndjson':
+        vales = continuar_do_cursor(vales, cursor, ORDENACAO_MODAL)
+        return StreamingHttpResponse(_vales_ndjson(vales, limite), content_type='application/x-ndjson')
+
+    pagina = paginar_por_cursor(
+        vales, cursor,
+        por_pagina=min(limite or MODAL_POR_PAGINA, MODAL_LIMITE_MAXIMO),
+        ordenacao=ORDENACAO_MODAL
+    )
     return JsonResponse({
-        'vales': vales_data,
-        'total': len(vales_data)
+        'vales': [_serializar_vale_modal(linha) for linha in pagina],
+        'total': pagina.total,
+        'total_excede': pagina.total_excede,
+        'proximo_cursor': pagina.proximo_cursor,
     })
 
 @transaction.atomic
@@ -1191,11 +1334,7 @@ def movimentacao_registrar(request):
                     messages.error(request, 'Você não tem permissão para registrar movimentação neste vale.')
                     return redirect('movimentacao_listar')
                 
-                # Atualiza estado do vale se necessário
-                if movimentacao.tipo in ['SAIDA', 'RETORNO']:
-                    movimentacao.vale.estado = movimentacao.tipo
-                    movimentacao.vale.save()
-                
+                # O save da movimentação já atualiza o estado do vale
                 movimentacao.save()
                 messages.success(request, 'Movimentação registrada com sucesso!')
                 return redirect('valepallet_detalhes', id=movimentacao.vale.id)
@@ -1221,220 +1360,52 @@ def movimentacao_registrar(request):
 def dashboard_filtrar(request):
     """Filtra dados do dashboard por período"""
     periodo = request.GET.get('periodo', 'todos')
-    agora_local = timezone.localtime(timezone.now())
-    hoje_local = agora_local.date()
-    
-    # Consulta básica de vales
+    hoje_local = timezone.localdate()
+
     if request.user.is_staff:
-        vales = ValePallet.objects.all().select_related('cliente', 'criado_por__usuario')
+        pessoa_juridica = None
     elif hasattr(request.user, 'pessoa_juridica'):
-        vales = ValePallet.objects.filter(
-            criado_por=request.user.pessoa_juridica
-        ).select_related('cliente', 'criado_por__usuario')
+        pessoa_juridica = request.user.pessoa_juridica
     else:
         return JsonResponse({'error': 'Acesso não autorizado'}, status=403)
-    
-    # Definir intervalo de datas com base no período
-    if periodo == 'hoje':
-        inicio_dia = timezone.make_aware(datetime.datetime.combine(hoje_local, datetime.time.min))
-        fim_dia = timezone.make_aware(datetime.datetime.combine(hoje_local, datetime.time.max))
-        vales = vales.filter(data_emissao__range=(inicio_dia, fim_dia))
-        
-    elif periodo == 'semana':
-        dia_da_semana = hoje_local.weekday()
-        if dia_da_semana == 6:
-            inicio_semana = hoje_local
-        elif dia_da_semana == 5:
-            inicio_semana = hoje_local - datetime.timedelta(days=5)
-        else:
-            inicio_semana = hoje_local - datetime.timedelta(days=dia_da_semana + 1)
-            
-        fim_semana = inicio_semana + datetime.timedelta(days=6)
-        inicio_semana_dt = timezone.make_aware(datetime.datetime.combine(inicio_semana, datetime.time.min))
-        fim_semana_dt = timezone.make_aware(datetime.datetime.combine(fim_semana, datetime.time.max))
-        vales = vales.filter(data_emissao__range=(inicio_semana_dt, fim_semana_dt))
-        
-    elif periodo == 'mes':
-        primeiro_dia_mes = hoje_local.replace(day=1)
-        if hoje_local.month == 12:
-            ultimo_dia_mes = hoje_local.replace(day=31)
-        else:
-            ultimo_dia_mes = hoje_local.replace(month=hoje_local.month+1, day=1) - datetime.timedelta(days=1)
-        
-        inicio_mes = timezone.make_aware(datetime.datetime.combine(primeiro_dia_mes, datetime.time.min))
-        fim_mes = timezone.make_aware(datetime.datetime.combine(ultimo_dia_mes, datetime.time.max))
-        vales = vales.filter(data_emissao__range=(inicio_mes, fim_mes))
-        
-    elif periodo == 'trimestre':
-        inicio_trimestre = hoje_local - datetime.timedelta(days=90)
-        fim_trimestre = timezone.make_aware(datetime.datetime.combine(hoje_local, datetime.time.max))
-        inicio_trimestre_dt = timezone.make_aware(datetime.datetime.combine(inicio_trimestre, datetime.time.min))
-        vales = vales.filter(data_emissao__range=(inicio_trimestre_dt, fim_trimestre))  
-        
-    elif periodo == 'ano':
-        primeiro_dia = hoje_local.replace(month=1, day=1)
-        ultimo_dia = hoje_local.replace(month=12, day=31)
-        inicio_ano = timezone.make_aware(datetime.datetime.combine(primeiro_dia, datetime.time.min))
-        fim_ano = timezone.make_aware(datetime.datetime.combine(ultimo_dia, datetime.time.max))
-        vales = vales.filter(data_emissao__range=(inicio_ano, fim_ano))
-
-    # Métricas de status
-    a_vencer = vales.filter(
-        data_saida__isnull=False,
-        data_retorno__isnull=True,
-        data_validade__gte=hoje_local
-    ).count()
-    
-    coletado = vales.filter(
-        data_saida__isnull=False,
-        data_retorno__isnull=False
-    ).count()
-    
-    pendente = vales.filter(
-        data_saida__isnull=True
-    ).count()
-    
-    vencido = vales.filter(
-        data_saida__isnull=False,
-        data_retorno__isnull=True,
-        data_validade__lt=hoje_local
-    ).count()
-
-    # Função auxiliar para calcular a soma de pallets
-    def calcular_pallets(queryset):
-        result = queryset.aggregate(
-            total_pbr=Sum('qtd_pbr', default=0),
-            total_chepp=Sum('qtd_chepp', default=0)
-        )
-        return (result['total_pbr'] or 0) + (result['total_chepp'] or 0)
 
-    # Métricas de pallets
-    pallets_movimentacao = calcular_pallets(vales.filter(
-        data_saida__isnull=False,
-        data_retorno__isnull=True
-    ))
-    
-    pallets_prazo = calcular_pallets(vales.filter(
-        Q(data_saida__isnull=True) |
-        (Q(data_saida__isnull=False) & Q(data_retorno__isnull=True) & Q(data_validade__gte=hoje_local))
-    ))
-    
-    pallets_vencidos = calcular_pallets(vales.filter(
-        data_saida__isnull=False,
-        data_retorno__isnull=True,
-        data_validade__lt=hoje_local
-    ))
-    
-    total_pallets = calcular_pallets(vales)
-
-    # Dias em aberto
-    menos_30_dias = vales.filter(
-        data_emissao__date__gte=hoje_local - datetime.timedelta(days=30)
-    ).count()
-    
-    mais_30_dias = vales.filter(
-        data_emissao__date__lt=hoje_local - datetime.timedelta(days=30),
-        data_emissao__date__gte=hoje_local - datetime.timedelta(days=90)
-    ).count()
-    
-    mais_90_dias = vales.filter(
-        data_emissao__date__lt=hoje_local - datetime.timedelta(days=90),
-        data_emissao__date__gte=hoje_local - datetime.timedelta(days=180)
-    ).count()
-    
-    mais_180_dias = vales.filter(
-        data_emissao__date__lt=hoje_local - datetime.timedelta(days=180)
-    ).count()
-
-    # Agregação por fornecedor sem Coalesce
-    fornecedores_completo = vales.values(
-        'criado_por__usuario__username'
-    ).annotate(
-        total_pbr=Sum('qtd_pbr', default=0),
-        total_chepp=Sum('qtd_chepp', default=0),
-        vale_count=Count('id')
-    ).annotate(
-        total_pallets=F('total_pbr') + F('total_chepp')
-    ).order_by('-total_pallets')
-
-    top_fornecedores = fornecedores_completo[:3]
+    # Períodos somam os resumos diários por data de emissão
+    intervalo = intervalo_periodo(periodo, hoje_local)
+    if intervalo:
+        inicio, fim = intervalo
+        metricas = metricas_por_contadores(pessoa_juridica, hoje_local, inicio, fim)
+    else:
+        metricas = metricas_por_contadores(pessoa_juridica, hoje_local)
 
     # Preparar dados para o gráfico (apenas top 3)
     grafico_labels = []
     grafico_data = []
     grafico_cores = []
 
-    for item in top_fornecedores:
-        grafico_labels.append(item['criado_por__usuario__username'] or 'Sem responsável')
-        grafico_data.append(item['total_pallets'] or 0)
+    for item in metricas.top_fornecedores():
+        grafico_labels.append(item['responsavel__username'])
+        grafico_data.append(item['pallets'])
         grafico_cores.append('rgba(13, 110, 253, 0.7)')
 
-    # Formatando para a tabela de fornecedores
-    fornecedores_data = [{
-        'responsavel__username': item['criado_por__usuario__username'] or 'Sem responsável',
-        'vale': item['vale_count'],
-        'pallets': item['total_pallets'] or 0
-    } for item in fornecedores_completo]
-
     return JsonResponse({
-        'a_vencer': a_vencer,
-        'coletado': coletado,
-        'pendente': pendente,
-        'vencido': vencido,
-        
-        'pallets_movimentacao': pallets_movimentacao,
-        'pallets_prazo': pallets_prazo,
-        'pallets_vencidos': pallets_vencidos,
-        'total_pallets': total_pallets,
-        
-        'menos_30_dias': menos_30_dias,
-        'mais_30_dias': mais_30_dias,
-        'mais_90_dias': mais_90_dias,
-        'mais_180_dias': mais_180_dias,
-        
+        **metricas.as_dict(),
+
         'grafico_labels': grafico_labels,
         'grafico_data': grafico_data,
         'grafico_cores': grafico_cores,
-        
-        'fornecedores_data': fornecedores_data,
-        'total_fornecedores': {
-            'vales': vales.count(),
-            'pallets': total_pallets
-        }
     })
 
 # ===== APIs EXTERNAS =====
+# Views async: no ASGI a espera pelos serviços externos não ocupa um worker
 @require_GET
-def validar_cnpj_api(request):
+async def validar_cnpj_api(request):
     cnpj = request.GET.get('cnpj', '').replace('.', '').replace('/', '').replace('-', '')
     if not cnpj.isdigit() or len(cnpj) != 14:
         return JsonResponse({'valido': False, 'erro': 'CNPJ deve ter 14 dígitos numéricos.'}, status=400)
     
     try:
-        response = requests.get(f'https://receitaws.com.br/v1/cnpj/{cnpj}', timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        
-        if data.get('status') == 'ERROR':
-            return JsonResponse({'valido': False, 'erro': data.get('message', 'CNPJ inválido')})
-        
-        return JsonResponse({
-            'valido': True,
-            'DsRazaoSocial': data.get('nome', ''),
-            'DsNomeFantasia': data.get('fantasia', ''),
-            'DsSituacaoCadastral': data.get('situacao', 'ATIVO'),
-            'DsEnderecoLogradouro': data.get('logradouro', ''),
-            'NrEnderecoNumero': data.get('numero', ''),
-            'DsEnderecoBairro': data.get('bairro', ''),
-            'NrEnderecoCep': data.get('cep', '').replace('.', '').replace('-', ''),
-            'DsEnderecoCidade': data.get('municipio', ''),
-            'DsEnderecoEstado': data.get('uf', ''),
-            'DsEmail': data.get('email', ''),
-            'DsInscricaoEstadual': data.get('inscricao_estadual', ''),
-            'DsTelefone': data.get('telefone', ''),
-            'DsSite': data.get('site', '')
-        })
-    except requests.exceptions.RequestException as e:
+        return JsonResponse(await aconsultar_cnpj(cnpj))
+    except ServicoIndisponivel as e:
         logger.error(f"Erro ao consultar CNPJ: {str(e)}")
         return JsonResponse({'valido': False, 'erro': 'Serviço de consulta indisponível'}, status=503)
     except Exception as e:
@@ -1442,41 +1413,39 @@ def validar_cnpj_api(request):
         return JsonResponse({'valido': False, 'erro': 'Erro interno ao processar CNPJ'}, status=500)
 
 @require_GET
-def consultar_cep_api(request):
+async def consultar_cep_api(request):
     cep = request.GET.get('cep', '').replace('-', '')
     if not cep.isdigit() or len(cep) != 8:
         return JsonResponse({'erro': 'CEP deve conter 8 dígitos numéricos.'}, status=400)
     
     try:
-        response = requests.get(f'https://viacep.com.br/ws/{cep}/json/', timeout=5)
-        response.raise_for_status()
-        data = response.json()
-        
-        if 'erro' in data:
-            return JsonResponse({'erro': 'CEP não encontrado'}, status=404)
-            
-        return JsonResponse({
-            'DsEnderecoLogradouro': data.get('logradouro', ''),
-            'DsEnderecoBairro': data.get('bairro', ''),
-            'DsEnderecoCidade': data.get('localidade', ''),
-            'DsEnderecoEstado': data.get('uf', ''),
-            'DsEnderecoComplemento': data.get('complemento', '')
-        })
-    except requests.exceptions.RequestException as e:
+        endereco = await aconsultar_cep(cep)
+    except ServicoIndisponivel as e:
         logger.error(f"Erro ao consultar CEP: {str(e)}")
         return JsonResponse({'erro': 'Serviço de consulta indisponível'}, status=503)
     except Exception as e:
         logger.error(f"Erro inesperado ao consultar CEP: {str(e)}")
         return JsonResponse({'erro': 'Erro interno ao processar CEP'}, status=500)
 
+    if endereco is None:
+        return JsonResponse({'erro': 'CEP não encontrado'}, status=404)
+    return JsonResponse(endereco)
+
+def _resposta_localidades(request, resposta):
+    """Resposta JSON pré-montada, com ETag/304 e cache longo no navegador"""
+    etag = quote_etag(resposta.etag)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(resposta.conteudo, content_type='application/json')
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=LOCALIDADES_MAX_AGE)
+    return response
+
 @require_GET
-def listar_estados_api(request):
+async def listar_estados_api(request):
     try:
-        response = requests.get('https://servicodados.ibge.gov.br/api/v1/localidades/estados?orderBy=nome', timeout=10)
-        response.raise_for_status()
-        estados = [{'sigla': est['sigla'], 'nome': est['nome']} for est in response.json()]
-        return JsonResponse({'estados': estados})
-    except requests.exceptions.RequestException as e:
+        return _resposta_localidades(request, await aresposta_estados())
+    except ServicoIndisponivel as e:
         logger.error(f"Erro ao listar estados: {str(e)}")
         return JsonResponse({'erro': 'Serviço indisponível'}, status=503)
     except Exception as e:
@@ -1484,19 +1453,19 @@ def listar_estados_api(request):
         return JsonResponse({'erro': 'Erro interno'}, status=500)
 
 @require_GET
-def listar_municipios_api(request, uf):
+async def listar_municipios_api(request, uf):
     if not uf or len(uf) != 2:
         return JsonResponse({'erro': 'UF inválida'}, status=400)
     
     try:
-        response = requests.get(f'https://servicodados.ibge.gov.br/api/v1/localidades/estados/{uf}/municipios', timeout=10)
-        response.raise_for_status()
-        municipios = [{'id': mun['id'], 'nome': mun['nome']} for mun in response.json()]
-        return JsonResponse({'municipios': municipios})
-    except requests.exceptions.RequestException as e:
+        resposta = await aresposta_municipios(uf)
+    except ServicoIndisponivel as e:
         logger.error(f"Erro ao listar municípios: {str(e)}")
         return JsonResponse({'erro': 'Serviço indisponível'}, status=503)
     except Exception as e:
         logger.error(f"Erro inesperado ao listar municípios: {str(e)}")
         return JsonResponse({'erro': 'Erro interno'}, status=500)
-    
\ No newline at end of file
+
+    if resposta is None:
+        return JsonResponse({'erro': 'UF inválida'}, status=404)
+    return _resposta_localidades(request, resposta)
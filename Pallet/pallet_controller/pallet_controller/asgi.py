@@ -1,7 +1,35 @@
+"""
+Entrada ASGI do projeto, usada em produção para que as views async das
+APIs externas (CNPJ, CEP, IBGE) não ocupem um worker enquanto esperam o
+serviço externo:
+
+    uvicorn pallet_controller.asgi:application --workers 4 --lifespan on
+
+O lifespan abre o ``httpx.AsyncClient`` compartilhado do processo no
+startup e o fecha no shutdown (ver ``app_controller/consultas.py``).
+"""
 import os
 
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pallet_controller.settings')
 
-application = get_asgi_application()
+aplicacao_django = get_asgi_application()
+
+from app_controller.consultas import abrir_cliente_http_async, fechar_cliente_http_async  # noqa: E402
+
+
+async def application(scope, receive, send):
+    if scope['type'] != 'lifespan':
+        return await aplicacao_django(scope, receive, send)
+
+    # O Django não trata o lifespan: startup e shutdown ficam aqui
+    while True:
+        mensagem = await receive()
+        if mensagem['type'] == 'lifespan.startup':
+            await abrir_cliente_http_async()
+            await send({'type': 'lifespan.startup.complete'})
+        elif mensagem['type'] == 'lifespan.shutdown':
+            await fechar_cliente_http_async()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
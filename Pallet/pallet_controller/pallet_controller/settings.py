@@ -37,6 +37,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'app_controller.monitor_consultas.MonitorConsultasMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -65,6 +66,11 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'pallet_controller.wsgi.application'
+# As APIs externas (CNPJ, CEP, IBGE) são views async: servidas pelo ASGI
+# (uvicorn pallet_controller.asgi:application --lifespan on, ver asgi.py)
+# não ocupam workers enquanto esperam o serviço externo. O
+# MonitorConsultasMiddleware (só com DEBUG/MONITOR_CONSULTAS) é síncrono e,
+# quando ligado, faz o Django rodar essas views numa thread.
 
 
 # Database
@@ -130,6 +136,50 @@ USE_TZ = True
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
 
+# Fila de tarefas em segundo plano (exportações, PDFs...)
+# 'banco': grava na tabela Tarefa e o worker `manage.py processar_tarefas` executa
+# 'imediato': executa no próprio processo logo após o commit (desenvolvimento)
+TAREFAS_BACKEND = 'banco'
+# Segundos sem terminar após os quais uma tarefa em execução é dada como
+# abandonada (worker interrompido) e volta para a fila
+TAREFAS_PRAZO_EXECUCAO = 30 * 60
+# Horas que os arquivos de exportações e documentos em lote ficam disponíveis
+# para download; depois o worker os apaga (ver exportacao.limpar_exportacoes)
+EXPORTACOES_VALIDADE_HORAS = 24
+
+# Consulta de CNPJ (ver app_controller/consultas.py)
+# 'receitaws': API pública receitaws.com.br, com cache no banco e circuit breaker
+# 'local': dados fictícios gerados localmente, sem rede (testes/desenvolvimento)
+CONSULTA_CNPJ_BACKEND = 'receitaws'
+
+# Processos do pool que renderiza PDFs (ver app_controller/pdfs.py); 0 renderiza no próprio processo
+PDF_PROCESSOS = 2
+
+# Monitor de consultas SQL por requisição (ver app_controller/monitor_consultas.py)
+# Ligado em desenvolvimento; nos testes (ExecutorTestes) fica sempre ligado e estrito
+MONITOR_CONSULTAS = DEBUG
+# Mesma consulta repetida a partir de quantas vezes numa requisição é tratada como N+1
+LIMITE_CONSULTAS_REPETIDAS = 5
+# Máximo de consultas por view (nome da URL), ou por método HTTP da view; nos
+# testes, exceder falha o teste. Medidos com o ExecutorTestes (ver
+# OrcamentoViewsTests); o POST de vale inclui criar as linhas de contador
+# quando é o primeiro vale do dia da PJ
+ORCAMENTO_CONSULTAS = {
+    'painel_usuario': 5,
+    'cliente_listar': 7,
+    'motorista_listar': 7,
+    'transportadora_listar': 7,
+    'autocompletar': 5,
+    'valepallet_listar': 10,
+    'valepallet_cadastrar': {'GET': 6, 'POST': 32},
+    'valepallet_editar': {'GET': 11, 'POST': 26},
+    'valepallet_detalhes': 8,
+    'detalhes_vale': 8,
+    'movimentacao_listar': 7,
+    'dashboard_filtrar': 8,
+}
+TEST_RUNNER = 'app_controller.monitor_consultas.ExecutorTestes'
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/4.0/howto/static-files/
 
@@ -41,7 +41,15 @@ urlpatterns = [
     #Login_required (cadastrados)
     path('vales/', login_required(views.valepallet_listar), name='valepallet_listar'),
     path('vales/cadastrar/', login_required(views.valepallet_cadastrar), name='valepallet_cadastrar'),
+    path('vales/exportar/', login_required(views.exportar_vales), name='exportar_vales'),
+    path('vales/documentos/', login_required(views.valepallet_documentos_lote), name='valepallet_documentos_lote'),
+    path('vales/exportacoes/<int:id>/', login_required(views.exportacao_baixar), name='exportacao_baixar'),
+    path('vales/emitir-lote/', login_required(views.valepallet_emitir_lote), name='valepallet_emitir_lote'),
+    path('cadastros/autocompletar/<str:tipo>/', login_required(views.autocompletar), name='autocompletar'),
+    path('cadastros/importar/<str:tipo>/', login_required(views.cadastros_importar), name='cadastros_importar'),
     path('vales/detalhes/<int:id>/', login_required(views.valepallet_detalhes), name='valepallet_detalhes'),
+    path('vales/<int:id>/qrcode.<str:formato>', login_required(views.valepallet_qr_code), name='valepallet_qr_code'),
+    path('vales/<int:vale_id>/documento/<str:tipo>.pdf', login_required(views.valepallet_gerar_documento), name='valepallet_gerar_documento'),
     path('vales/editar/<int:id>/', login_required(views.valepallet_editar), name='valepallet_editar'),
     path('vales/remover/<int:id>/', views.staff_required(views.valepallet_remover), name='valepallet_remover'),
     path('valepallet/processar/<int:id>/<str:hash_seguranca>/', views.staff_required(views.processar_scan), name='valepallet_processar'),
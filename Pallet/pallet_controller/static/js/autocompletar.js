@@ -0,0 +1,56 @@
+// Autocompletar dos campos de cadastro do formulário de vale: o <select>
+// traz só a opção escolhida e as demais são buscadas na API conforme o
+// usuário digita (nome ou CNPJ/CPF, por prefixo).
+function debounce(func, wait) {
+    let timeout;
+    return function() {
+        const context = this, args = arguments;
+        clearTimeout(timeout);
+        timeout = setTimeout(() => func.apply(context, args), wait);
+    };
+}
+
+function iniciarAutocompletar(select) {
+    const busca = document.createElement('input');
+    busca.type = 'search';
+    busca.className = 'form-control mb-1';
+    busca.placeholder = 'Buscar por nome ou documento...';
+    busca.autocomplete = 'off';
+    select.parentNode.insertBefore(busca, select);
+
+    let ultimoTermo = null;
+
+    async function carregar() {
+        const termo = busca.value.trim();
+        if (termo === ultimoTermo) return;
+        ultimoTermo = termo;
+
+        const resposta = await fetch(`${select.dataset.autocompletar}?q=${encodeURIComponent(termo)}`, {
+            headers: { 'Accept': 'application/json' }
+        });
+        // Descarta respostas de buscas que já foram substituídas
+        if (!resposta.ok || termo !== ultimoTermo) return;
+        const { resultados } = await resposta.json();
+
+        const valor = select.value;
+        const escolhida = select.selectedOptions[0];
+        const fragmento = document.createDocumentFragment();
+        fragmento.appendChild(new Option(resultados.length ? 'Selecione...' : 'Nenhum resultado', ''));
+        if (valor && !resultados.some(item => String(item.id) === valor)) {
+            fragmento.appendChild(new Option(escolhida.text, valor, true, true));
+        }
+        resultados.forEach(item => {
+            const selecionada = String(item.id) === valor;
+            fragmento.appendChild(new Option(item.texto, item.id, selecionada, selecionada));
+        });
+        select.innerHTML = '';
+        select.appendChild(fragmento);
+    }
+
+    busca.addEventListener('input', debounce(carregar, 250));
+    select.addEventListener('focus', carregar, { once: true });
+}
+
+document.addEventListener('DOMContentLoaded', () => {
+    document.querySelectorAll('select[data-autocompletar]').forEach(iniciarAutocompletar);
+});
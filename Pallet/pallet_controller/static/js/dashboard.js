@@ -354,18 +354,9 @@ async function carregarValesModal(tipo, ordenacao = 'responsavel') {
     appState.isFetching = true;
 
     try {
-        const response = await fetch(`/movimentacoes/filtrar/?tipo=${tipo}&ordenacao=${ordenacao}`, {
-            signal: controller.signal
-        });
-        
+        const data = await buscarPaginaVales(tipo, ordenacao, null, controller.signal);
         clearTimeout(timeoutId);
-        
-        if (!response.ok) {
-            throw new Error('Erro na requisição');
-        }
-        
-        const data = await response.json();
-        
+
         tableBody.innerHTML = '';
 
         if (data.vales.length === 0) {
@@ -373,51 +364,7 @@ async function carregarValesModal(tipo, ordenacao = 'responsavel') {
             return;
         }
 
-        data.vales.forEach(vale => {
-            const row = document.createElement('tr');
-
-            let statusClass = '';
-            let statusText = vale.estado;
-
-            switch (vale.estado) {
-                case 'EMITIDO':
-                    statusClass = 'bg-secondary';
-                    break;
-                case 'SAIDA':
-                    statusClass = 'bg-warning text-dark';
-                    break;
-                case 'RETORNO':
-                    statusClass = 'bg-success';
-                    break;
-                case 'VENCIDO':
-                    statusClass = 'bg-danger';
-                    break;
-                default:
-                    statusClass = 'bg-primary';
-            }
-
-            // Adiciona informação de dias restantes
-            let diasInfo = '';
-            if (vale.dias_restantes !== null && vale.dias_restantes !== undefined) {
-                if (vale.dias_restantes < 0) {
-                    diasInfo = `<span class="badge bg-danger ms-2">Vencido há ${Math.abs(vale.dias_restantes)} dias</span>`;
-                } else {
-                    diasInfo = `<span class="badge bg-info ms-2">${vale.dias_restantes} dias restantes</span>`;
-                }
-            }
-
-            row.innerHTML = `
-                <td>${vale.numero_vale || '-'}</td>
-                <td>${vale.cliente || '-'}</td>
-                <td>${vale.transportadora || '-'}</td>
-                <td>${vale.motorista || '-'}</td>
-                <td>${vale.data_emissao || '-'}</td>
-                <td>${vale.data_validade || '-'} ${diasInfo}</td>
-                <td><span class="badge ${statusClass}">${statusText}</span></td>
-                <td>${vale.responsavel || 'Sistema'}</td>
-            `;
-            tableBody.appendChild(row);
-        });
+        renderizarVales(tableBody, data, tipo, ordenacao);
 
         const modal = new bootstrap.Modal(domCache.valesModal);
         modal.show();
@@ -430,6 +377,94 @@ async function carregarValesModal(tipo, ordenacao = 'responsavel') {
     }
 }
 
+// Busca uma página de vales do modal (paginação por cursor no servidor)
+async function buscarPaginaVales(tipo, ordenacao, cursor, signal) {
+    let url = `/movimentacoes/filtrar/?tipo=${tipo}&ordenacao=${ordenacao}`;
+    if (cursor) {
+        url += `&cursor=${encodeURIComponent(cursor)}`;
+    }
+
+    const response = await fetch(url, { signal });
+    if (!response.ok) {
+        throw new Error('Erro na requisição');
+    }
+    return response.json();
+}
+
+// Acrescenta as linhas de uma página e, se houver mais, o botão "Carregar mais"
+function renderizarVales(tableBody, data, tipo, ordenacao) {
+    data.vales.forEach(vale => {
+        const row = document.createElement('tr');
+
+        let statusClass = '';
+        let statusText = vale.estado;
+
+        switch (vale.estado) {
+            case 'EMITIDO':
+                statusClass = 'bg-secondary';
+                break;
+            case 'SAIDA':
+                statusClass = 'bg-warning text-dark';
+                break;
+            case 'RETORNO':
+                statusClass = 'bg-success';
+                break;
+            case 'VENCIDO':
+                statusClass = 'bg-danger';
+                break;
+            default:
+                statusClass = 'bg-primary';
+        }
+
+        // Adiciona informação de dias restantes
+        let diasInfo = '';
+        if (vale.dias_restantes !== null && vale.dias_restantes !== undefined) {
+            if (vale.dias_restantes < 0) {
+                diasInfo = `<span class="badge bg-danger ms-2">Vencido há ${Math.abs(vale.dias_restantes)} dias</span>`;
+            } else {
+                diasInfo = `<span class="badge bg-info ms-2">${vale.dias_restantes} dias restantes</span>`;
+            }
+        }
+
+        row.innerHTML = `
+            <td>${vale.numero_vale || '-'}</td>
+            <td>${vale.cliente || '-'}</td>
+            <td>${vale.transportadora || '-'}</td>
+            <td>${vale.motorista || '-'}</td>
+            <td>${vale.data_emissao || '-'}</td>
+            <td>${vale.data_validade || '-'} ${diasInfo}</td>
+            <td><span class="badge ${statusClass}">${statusText}</span></td>
+            <td>${vale.responsavel || 'Sistema'}</td>
+        `;
+        tableBody.appendChild(row);
+    });
+
+    if (!data.proximo_cursor) {
+        return;
+    }
+
+    const maisRow = document.createElement('tr');
+    maisRow.innerHTML = `
+        <td colspan="8" class="text-center">
+            <button type="button" class="btn btn-sm btn-outline-primary">
+                Carregar mais (${tableBody.children.length} de ${data.total}${data.total_excede ? '+' : ''})
+            </button>
+        </td>
+    `;
+    maisRow.querySelector('button').addEventListener('click', async (event) => {
+        event.target.disabled = true;
+        try {
+            const proxima = await buscarPaginaVales(tipo, ordenacao, data.proximo_cursor);
+            maisRow.remove();
+            renderizarVales(tableBody, proxima, tipo, ordenacao);
+        } catch (error) {
+            console.error('Erro ao carregar mais vales:', error);
+            event.target.disabled = false;
+        }
+    });
+    tableBody.appendChild(maisRow);
+}
+
 // Atualizar ano no footer
 function updateYear() {
     if (domCache.currentYear) {